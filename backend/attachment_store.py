@@ -0,0 +1,333 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import re
+import struct
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from bson import Binary
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from database import update_returning
+
+logger = logging.getLogger(__name__)
+
+BUCKET = 'attachments'
+
+SALT_SIZE = 16
+NONCE_SIZE = 12
+TAG_SIZE = 16
+# Stored bytes per segment on top of its plaintext
+SEGMENT_OVERHEAD = NONCE_SIZE + TAG_SIZE
+SEGMENT_AAD = struct.Struct('>Q?')
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class AttachmentError(Exception):
+    """Upload or stored attachment that cannot be processed"""
+
+
+class AttachmentTooLarge(AttachmentError):
+    pass
+
+
+class RangeNotSatisfiable(AttachmentError):
+    pass
+
+
+def file_key(master_key: str, salt: bytes) -> bytes:
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=salt, info=b'keykeeper attachment v1').derive(master_key.encode())
+
+
+def content_key(master_key: str) -> bytes:
+    """HMAC key for content addresses, so stored hashes cannot be matched against known files"""
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b'keykeeper attachment address v1').derive(master_key.encode())
+
+
+def segment_count(size: int, segment_size: int) -> int:
+    # An empty file still has its (empty) final segment
+    return max(1, -(-size // segment_size))
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Inclusive (start, end) of a single `bytes=` range, or None to send the whole file"""
+    match = RANGE.match((header or '').strip())
+    if not match or match.groups() == ('', ''):
+        # Absent, multiple or malformed ranges: the whole file is a valid answer
+        return None
+    first, last = match.groups()
+    if first == '':
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable(f"Range not satisfiable for {size} byte(s)")
+    return start, end
+
+
+class MultipartFile:
+    """One file field of a multipart/form-data body, read as the body streams in.
+
+    Nothing is spooled: the part's data is handed over chunk by chunk
+    while the body is parsed, so a large upload never sits in memory or
+    in a plaintext temporary file.
+    """
+
+    def __init__(self, body: AsyncIterator[bytes], content_type: Optional[str], field: str = 'file'):
+        mime, options = parse_options_header(content_type or '')
+        if mime != b'multipart/form-data' or not options.get(b'boundary'):
+            raise AttachmentError("Expected a multipart/form-data body")
+        self.field = field.encode()
+        self.filename: Optional[str] = None
+        self.content_type: Optional[str] = None
+        self._body = body.__aiter__()
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b''
+        self._header_value = b''
+        self._in_file = False
+        self._file_done = False
+        self._pending: List[bytes] = []
+        self._parser = MultipartParser(options[b'boundary'], callbacks={
+            'on_part_begin': self._on_part_begin,
+            'on_header_field': self._on_header_field,
+            'on_header_value': self._on_header_value,
+            'on_header_end': self._on_header_end,
+            'on_headers_finished': self._on_headers_finished,
+            'on_part_data': self._on_part_data,
+            'on_part_end': self._on_part_end,
+        })
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b''
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b'content-disposition', b''))
+        # Only the first file sent under the field name is read
+        if self.filename is None and options.get(b'name') == self.field and b'filename' in options:
+            self.filename = options[b'filename'].decode(errors='replace') or 'attachment'
+            self.content_type = self._headers.get(b'content-type', b'application/octet-stream').decode(errors='replace')
+            self._in_file = True
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._in_file:
+            self._pending.append(bytes(data[start:end]))
+
+    def _on_part_end(self) -> None:
+        if self._in_file:
+            self._in_file = False
+            self._file_done = True
+
+    async def _feed(self) -> bool:
+        try:
+            data = await self._body.__anext__()
+        except StopAsyncIteration:
+            return False
+        try:
+            self._parser.write(data)
+        except MultipartParseError as e:
+            raise AttachmentError(f"Malformed multipart body: {str(e)}")
+        return True
+
+    async def start(self) -> None:
+        """Read up to the file part's headers, so filename and content_type are known"""
+        while self.filename is None:
+            if not await self._feed():
+                raise AttachmentError(f"No '{self.field.decode()}' file in the upload")
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """The file's content, as it arrives"""
+        while True:
+            while self._pending:
+                yield self._pending.pop(0)
+            if self._file_done:
+                return
+            if not await self._feed():
+                raise AttachmentError("Upload ended before the file did")
+
+
+class AttachmentStore:
+    """Encrypted, content-addressed attachment files in GridFS.
+
+    A file is stored as AES-256-GCM segments of `segment_size` plaintext
+    bytes, each with its own nonce and authenticated with its index (and
+    whether it is the last), under a key derived from the master key and
+    a per-file salt. Every segment fills exactly one GridFS chunk, so a
+    byte range is served by seeking to the segments that cover it and
+    decrypting only those. Files are addressed by a keyed hash of their
+    content: uploading bytes that are already stored keeps the existing
+    file and drops the new copy. Items only hold small references
+    ({id, file_id, filename, ...}); files no item references any more are
+    removed by `sweep` once `grace_seconds` have passed.
+    """
+
+    def __init__(
+        self,
+        db,
+        master_key: str,
+        segment_size: int = 256 * 1024,
+        max_size: int = 100 * 1024 * 1024,
+        grace_seconds: int = 3600,
+        batch_size: int = 500
+    ):
+        self.db = db
+        self.bucket = AsyncIOMotorGridFSBucket(db, bucket_name=BUCKET)
+        self.files = db[f'{BUCKET}.files']
+        self.chunks = db[f'{BUCKET}.chunks']
+        self.master_key = master_key
+        self.address_key = content_key(master_key)
+        self.segment_size = segment_size
+        self.max_size = max_size
+        self.grace_seconds = grace_seconds
+        self.batch_size = batch_size
+
+    def _aead(self, metadata: dict) -> AESGCM:
+        return AESGCM(file_key(self.master_key, bytes(metadata['salt'])))
+
+    @staticmethod
+    def _seal(aead: AESGCM, index: int, data: bytes, last: bool) -> bytes:
+        nonce = os.urandom(NONCE_SIZE)
+        return nonce + aead.encrypt(nonce, bytes(data), SEGMENT_AAD.pack(index, last))
+
+    async def save(self, chunks: AsyncIterator[bytes], user_id: str) -> dict:
+        """Encrypt and store a file as it streams in; returns {file_id, size}, reusing an identical stored file"""
+        file_id = str(uuid.uuid4())
+        salt = os.urandom(SALT_SIZE)
+        metadata = {
+            'salt': Binary(salt),
+            'segment_size': self.segment_size,
+            'content_hash': None,
+            'uploaded_by': user_id,
+            'last_referenced_at': datetime.now(timezone.utc)
+        }
+        aead = self._aead(metadata)
+        address = hmac.new(self.address_key, digestmod=hashlib.sha256)
+        grid_in = self.bucket.open_upload_stream_with_id(
+            file_id, file_id, chunk_size_bytes=self.segment_size + SEGMENT_OVERHEAD, metadata=metadata
+        )
+        size = index = 0
+        buffer = bytearray()
+        try:
+            async for data in chunks:
+                size += len(data)
+                if size > self.max_size:
+                    raise AttachmentTooLarge(f"Attachments are limited to {self.max_size} bytes")
+                address.update(data)
+                buffer += data
+                # The last segment is only sealed once the upload has ended, so it can be marked as last
+                while len(buffer) > self.segment_size:
+                    await grid_in.write(self._seal(aead, index, buffer[:self.segment_size], False))
+                    del buffer[:self.segment_size]
+                    index += 1
+            await grid_in.write(self._seal(aead, index, buffer, True))
+            await grid_in.close()
+        except BaseException:
+            await grid_in.abort()
+            raise
+        return await self._address(file_id, address.hexdigest(), size)
+
+    async def _address(self, file_id: str, content_hash: str, size: int) -> dict:
+        # The unique content_hash index decides which copy of identical bytes is kept
+        while True:
+            now = datetime.now(timezone.utc)
+            try:
+                await self.files.update_one(
+                    {'_id': file_id},
+                    {'$set': {'metadata.content_hash': content_hash, 'metadata.size': size, 'metadata.last_referenced_at': now}}
+                )
+                return {'file_id': file_id, 'size': size}
+            except DuplicateKeyError:
+                pass
+            existing = await update_returning(
+                self.files,
+                {'metadata.content_hash': content_hash},
+                {'$set': {'metadata.last_referenced_at': now}},
+                projection={'_id': 1}
+            )
+            if existing:
+                await self._delete(file_id)
+                return {'file_id': existing['_id'], 'size': size}
+            # Swept between the two writes: claim the address for this copy after all
+
+    async def _delete(self, file_id: str, query: Optional[dict] = None) -> bool:
+        result = await self.files.delete_one({'_id': file_id, **(query or {})})
+        if result.deleted_count:
+            await self.chunks.delete_many({'files_id': file_id})
+        return bool(result.deleted_count)
+
+    async def find(self, file_id: str) -> Optional[dict]:
+        """Stored file document, if the upload completed"""
+        return await self.files.find_one({'_id': file_id, 'metadata.content_hash': {'$type': 'string'}})
+
+    async def stream(self, file: dict, start: int, end: int) -> AsyncIterator[bytes]:
+        """Plaintext bytes start..end (inclusive), decrypting only the segments that cover them"""
+        metadata = file['metadata']
+        segment_size = metadata['segment_size']
+        last = segment_count(metadata['size'], segment_size) - 1
+        aead = self._aead(metadata)
+        first_index, last_index = start // segment_size, end // segment_size
+        grid_out = await self.bucket.open_download_stream(file['_id'])
+        grid_out.seek(first_index * (segment_size + SEGMENT_OVERHEAD))
+        for index in range(first_index, last_index + 1):
+            body = await grid_out.read(segment_size + SEGMENT_OVERHEAD)
+            try:
+                plaintext = aead.decrypt(body[:NONCE_SIZE], body[NONCE_SIZE:], SEGMENT_AAD.pack(index, index == last))
+            except InvalidTag:
+                raise AttachmentError(f"Segment {index} of attachment file {file['_id']} failed authentication")
+            offset = index * segment_size
+            yield plaintext[max(start - offset, 0):end - offset + 1]
+
+    async def sweep(self) -> int:
+        """Delete files that no item references and that nothing has touched within the grace period"""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.grace_seconds)
+        deleted = 0
+        last_id = None
+        while True:
+            query = {'metadata.last_referenced_at': {'$lt': cutoff}}
+            if last_id is not None:
+                query['_id'] = {'$gt': last_id}
+            files = await self.files.find(query, {'_id': 1, 'metadata.last_referenced_at': 1}).sort('_id', 1).limit(self.batch_size).to_list(self.batch_size)
+            if not files:
+                return deleted
+            last_id = files[-1]['_id']
+            file_ids = [file['_id'] for file in files]
+            referenced = set(await self.db.items.distinct('attachments.file_id', {'attachments.file_id': {'$in': file_ids}}))
+            for file in files:
+                if file['_id'] in referenced:
+                    continue
+                # Conditional on the timestamp read: an upload that just deduplicated onto the file keeps it
+                if await self._delete(file['_id'], {'metadata.last_referenced_at': file['metadata']['last_referenced_at']}):
+                    deleted += 1
+
+    async def run(self, interval: int) -> None:
+        """Sweep unreferenced files every `interval` seconds until cancelled"""
+        while True:
+            try:
+                deleted = await self.sweep()
+                if deleted:
+                    logger.info(f"Removed {deleted} unreferenced attachment file(s)")
+            except PyMongoError as e:
+                logger.error(f"Error sweeping attachment files: {str(e)}")
+            await asyncio.sleep(interval)
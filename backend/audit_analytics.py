@@ -0,0 +1,254 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ReplaceOne, UpdateOne
+
+from audit_store import LEGACY_COLLECTION, AuditStore, partition_end, partition_start
+from database import run_transaction
+
+logger = logging.getLogger(__name__)
+
+# Secret values handed out to a user
+REVEAL_EVENTS = ['item_revealed', 'item_history_revealed']
+
+# Access requests that were turned down
+FAILED_ACCESS_EVENTS = ['jit_denied', 'breakglass_denied']
+
+# Emergency access, worth a look on its own
+EMERGENCY_EVENTS = ['breakglass_requested', 'breakglass_approved']
+
+# Upper bounds of the reveals-per-user-per-day histogram
+REVEAL_BUCKETS = [1, 5, 10, 25, 50, 100, 250]
+
+KEY_FIELDS = ('day', 'event_type', 'user_id', 'vault_id', 'item_id')
+
+# Events are counted on the day they were created, so only days this recent can still receive writes
+OPEN_DAY_MARGIN = timedelta(minutes=5)
+
+
+def day_of(timestamp: datetime) -> str:
+    """UTC day of an event as YYYY-MM-DD, which sorts and compares as a date"""
+    if timestamp.tzinfo:
+        timestamp = timestamp.astimezone(timezone.utc)
+    return timestamp.strftime('%Y-%m-%d')
+
+
+class AuditRollups:
+    """Daily audit counters, kept up to date by the audit write path.
+
+    One document per (day, event_type, user_id, vault_id, item_id) holds the
+    number of matching events that day. Every batch of audit writes is folded
+    in with one bulk of $inc upserts, so analytics over a year read a few
+    thousand small documents instead of every event, and keep working for
+    months that have been archived. `rebuild` recomputes the counters of the
+    months still in MongoDB from the events themselves: closed days, which
+    no write touches any more, directly, and the open day(s) in a
+    transaction, so a concurrent $inc makes it retry instead of being
+    overwritten (without transactions, on a standalone server, increments
+    landing during that last step can be lost until the next rebuild).
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index(
+            [('event_type', 1), ('day', 1), ('user_id', 1), ('vault_id', 1), ('item_id', 1)],
+            unique=True
+        )
+
+    @staticmethod
+    def _key(entry: dict) -> Tuple:
+        return (day_of(entry['timestamp']), entry['event_type'], entry.get('user_id'), entry.get('vault_id'), entry.get('item_id'))
+
+    async def apply(self, entries: List[dict]) -> None:
+        """Add a batch of written audit entries to the counters"""
+        counts: Dict[Tuple, Dict[str, Any]] = {}
+        for entry in entries:
+            key = self._key(entry)
+            if key not in counts:
+                counts[key] = {'count': 0, 'user_email': entry.get('user_email'), 'last_at': entry['timestamp']}
+            counts[key]['count'] += 1
+            counts[key]['last_at'] = max(counts[key]['last_at'], entry['timestamp'])
+        if not counts:
+            return
+        await self.collection.bulk_write(
+            [
+                UpdateOne(
+                    dict(zip(KEY_FIELDS, key)),
+                    {'$inc': {'count': c['count']}, '$set': {'user_email': c['user_email']}, '$max': {'last_at': c['last_at']}},
+                    upsert=True
+                )
+                for key, c in counts.items()
+            ],
+            ordered=False
+        )
+
+    async def rebuild(self, store: AuditStore, client) -> Dict[str, int]:
+        """Recompute the counters of every month still in MongoDB; archived months keep theirs"""
+        await store.partitions(refresh=True)
+        now = datetime.now(timezone.utc) - OPEN_DAY_MARGIN
+        open_from = datetime(now.year, now.month, now.day, tzinfo=timezone.utc)
+        closed = await self._rebuild_range(store, None, open_from)
+        recent = await run_transaction(client, lambda session: self._rebuild_range(store, open_from, None, session=session))
+        result = {name: closed[name] + recent[name] for name in closed}
+        logger.info(f"Rebuilt audit rollups: {result['counters']} counters over {result['days']} day(s)")
+        return result
+
+    async def _rebuild_range(self, store: AuditStore, start: Optional[datetime], end: Optional[datetime], session=None) -> Dict[str, int]:
+        """Replace the counters of the days in [start, end) with ones computed from the events"""
+        sources = await store.partitions_for(start, end)
+        partitions = [name for name in sources if name != LEGACY_COLLECTION]
+        time_range: Dict[str, datetime] = {}
+        if start:
+            time_range['$gte'] = start
+        if end:
+            time_range['$lt'] = end
+        pipeline = ([{'$match': {'timestamp': time_range}}] if time_range else []) + [
+            {'$group': {
+                '_id': {
+                    'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$timestamp'}},
+                    'event_type': '$event_type',
+                    'user_id': '$user_id',
+                    'vault_id': '$vault_id',
+                    'item_id': '$item_id'
+                },
+                'count': {'$sum': 1},
+                'user_email': {'$last': '$user_email'},
+                'last_at': {'$max': '$timestamp'}
+            }}
+        ]
+        rows: Dict[Tuple, dict] = {}
+        for name in sources:
+            async for row in store.db[name].aggregate(pipeline, allowDiskUse=True, session=session):
+                key = tuple(row['_id'].get(field) for field in KEY_FIELDS)
+                if key in rows:
+                    rows[key]['count'] += row['count']
+                    rows[key]['last_at'] = max(rows[key]['last_at'], row['last_at'])
+                else:
+                    rows[key] = {**dict(zip(KEY_FIELDS, key)), 'count': row['count'], 'user_email': row['user_email'], 'last_at': row['last_at']}
+
+        # Days covered by the sources are replaced; days only known from archived months are left alone
+        days = {key[0] for key in rows}
+        for name in partitions:
+            first = max(partition_start(name), start) if start else partition_start(name)
+            last = min(partition_end(name), end) if end else partition_end(name)
+            if first < last:
+                days.update(await self.collection.distinct('day', {'day': {'$gte': day_of(first), '$lt': day_of(last)}}, session=session))
+        requests = [ReplaceOne(dict(zip(KEY_FIELDS, key)), row, upsert=True) for key, row in rows.items()]
+        for offset in range(0, len(requests), 1000):
+            await self.collection.bulk_write(requests[offset:offset + 1000], ordered=False, session=session)
+        stale = [
+            doc['_id'] async for doc in self.collection.find({'day': {'$in': sorted(days)}}, {field: 1 for field in KEY_FIELDS}, session=session)
+            if tuple(doc.get(field) for field in KEY_FIELDS) not in rows
+        ]
+        if stale:
+            await self.collection.delete_many({'_id': {'$in': stale}}, session=session)
+        return {'days': len(days), 'counters': len(rows), 'removed': len(stale)}
+
+    # -- queries --
+
+    @staticmethod
+    def _match(event_types: List[str], start: str, end: str, **filters: Optional[str]) -> dict:
+        match: Dict[str, Any] = {'event_type': {'$in': event_types}, 'day': {'$gte': start, '$lte': end}}
+        match.update({field: value for field, value in filters.items() if value})
+        return {'$match': match}
+
+    async def reveals_per_user_day(self, start: str, end: str, user_id: Optional[str] = None, vault_id: Optional[str] = None) -> List[dict]:
+        """Reveals per user and day"""
+        pipeline = [
+            self._match(REVEAL_EVENTS, start, end, user_id=user_id, vault_id=vault_id),
+            {'$group': {
+                '_id': {'user_id': '$user_id', 'day': '$day'},
+                'user_email': {'$last': '$user_email'},
+                'count': {'$sum': '$count'},
+                'items': {'$addToSet': '$item_id'}
+            }},
+            {'$project': {
+                '_id': 0,
+                'user_id': '$_id.user_id',
+                'day': '$_id.day',
+                'user_email': 1,
+                'count': 1,
+                'distinct_items': {'$size': '$items'}
+            }},
+            {'$sort': {'day': 1, 'count': -1}}
+        ]
+        return await self.collection.aggregate(pipeline).to_list(None)
+
+    async def top_items(self, start: str, end: str, vault_id: Optional[str] = None, limit: int = 10) -> List[dict]:
+        """Most revealed items, with how many different users revealed each"""
+        pipeline = [
+            self._match(REVEAL_EVENTS, start, end, vault_id=vault_id),
+            {'$group': {
+                '_id': '$item_id',
+                'vault_id': {'$first': '$vault_id'},
+                'count': {'$sum': '$count'},
+                'users': {'$addToSet': '$user_id'},
+                'last_at': {'$max': '$last_at'}
+            }},
+            {'$sort': {'count': -1}},
+            {'$limit': limit},
+            {'$project': {
+                '_id': 0,
+                'item_id': '$_id',
+                'vault_id': 1,
+                'count': 1,
+                'distinct_users': {'$size': '$users'},
+                'last_at': 1
+            }}
+        ]
+        return await self.collection.aggregate(pipeline).to_list(limit)
+
+    async def failed_access(self, start: str, end: str, user_id: Optional[str] = None, vault_id: Optional[str] = None) -> List[dict]:
+        """Denied JIT / break-glass requests per day and event type"""
+        pipeline = [
+            self._match(FAILED_ACCESS_EVENTS, start, end, user_id=user_id, vault_id=vault_id),
+            {'$group': {'_id': {'day': '$day', 'event_type': '$event_type'}, 'count': {'$sum': '$count'}}},
+            {'$project': {'_id': 0, 'day': '$_id.day', 'event_type': '$_id.event_type', 'count': 1}},
+            {'$sort': {'day': 1, 'event_type': 1}}
+        ]
+        return await self.collection.aggregate(pipeline).to_list(None)
+
+    async def anomalies(self, start: str, end: str, threshold: int) -> Dict[str, Any]:
+        """User-days with more reveals than `threshold`, the reveal histogram and emergency access per day"""
+        per_user_day = [
+            self._match(REVEAL_EVENTS, start, end),
+            {'$group': {'_id': {'user_id': '$user_id', 'day': '$day'}, 'user_email': {'$last': '$user_email'}, 'count': {'$sum': '$count'}}}
+        ]
+        heavy = await self.collection.aggregate(per_user_day + [
+            {'$match': {'count': {'$gt': threshold}}},
+            {'$project': {'_id': 0, 'user_id': '$_id.user_id', 'day': '$_id.day', 'user_email': 1, 'count': 1}},
+            {'$sort': {'count': -1}}
+        ]).to_list(None)
+        distribution = await self.collection.aggregate(per_user_day + [
+            {'$bucket': {
+                'groupBy': '$count',
+                'boundaries': [1] + [bound + 1 for bound in REVEAL_BUCKETS],
+                'default': f'>{REVEAL_BUCKETS[-1]}',
+                'output': {'user_days': {'$sum': 1}}
+            }}
+        ]).to_list(None)
+        emergency = await self.collection.aggregate([
+            self._match(EMERGENCY_EVENTS, start, end),
+            {'$group': {'_id': {'day': '$day', 'event_type': '$event_type'}, 'count': {'$sum': '$count'}}},
+            {'$project': {'_id': 0, 'day': '$_id.day', 'event_type': '$_id.event_type', 'count': 1}},
+            {'$sort': {'day': 1}}
+        ]).to_list(None)
+
+        # Bucket ids are lower bounds; report them as "lo-hi" ranges
+        upper = dict(zip([1] + [bound + 1 for bound in REVEAL_BUCKETS], REVEAL_BUCKETS))
+        return {
+            'threshold': threshold,
+            'heavy_revealers': heavy,
+            'reveal_distribution': [
+                {'reveals': f"{b['_id']}-{upper[b['_id']]}" if b['_id'] in upper else b['_id'], 'user_days': b['user_days']}
+                for b in distribution
+            ],
+            'emergency_access': emergency,
+            'counts': {
+                'heavy_revealer_days': len(heavy),
+                'emergency_access': sum(e['count'] for e in emergency)
+            }
+        }
@@ -0,0 +1,301 @@
+import asyncio
+import hashlib
+import heapq
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import DESCENDING
+from pymongo.errors import DuplicateKeyError
+
+from audit_store import AuditStore
+
+logger = logging.getLogger(__name__)
+
+GENESIS_HASH = '0' * 64
+HEAD_ID = 'head'
+
+# Entries per Merkle checkpoint
+CHECKPOINT_SIZE = 10000
+
+# Problems reported by one verification run, at most
+MAX_PROBLEMS = 100
+
+
+def _canonical_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        # MongoDB keeps milliseconds and drops the timezone: hash what survives the round trip
+        value = (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).astimezone(timezone.utc)
+        return value.strftime('%Y-%m-%dT%H:%M:%S.') + f'{value.microsecond // 1000:03d}Z'
+    return str(value)
+
+
+def entry_hash(entry: dict) -> str:
+    """SHA-256 of an entry's canonical JSON, prev_hash and seq included, _id and hash excluded"""
+    content = {k: v for k, v in entry.items() if k not in ('_id', 'hash')}
+    payload = json.dumps(content, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=_canonical_default)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def merkle_root(leaves: List[str]) -> str:
+    """Root of a binary SHA-256 Merkle tree over hex leaf hashes (odd nodes are paired with themselves)"""
+    level = [bytes.fromhex(leaf) for leaf in leaves] or [bytes(32)]
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [hashlib.sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level), 2)]
+    return level[0].hex()
+
+
+class AuditChain:
+    """Hash-chained audit writes with group commit.
+
+    Every entry gets a global `seq`, the `prev_hash` of the entry before it
+    and its own `hash`, so editing, deleting or reordering stored entries
+    breaks the chain. Concurrent appends are queued and written together:
+    one compare-and-set on the chain head in `audit_chain` reserves the
+    whole batch (and keeps a copy of it until the next batch), then one
+    insert_many per partition stores it. Whoever finds the head moved on
+    (another worker) reloads it and first stores the batch left on it, so
+    a crash between the two writes never leaves a gap. `on_write` is
+    awaited with each stored batch (daily rollups); its errors are logged
+    and never fail the append.
+    """
+
+    def __init__(self, db, store: AuditStore, max_batch: int = 500, on_write: Optional[Callable[[List[dict]], Awaitable[None]]] = None):
+        self.db = db
+        self.store = store
+        self.max_batch = max_batch
+        self.on_write = on_write
+        self._head: Optional[dict] = None
+        self._queue: List[Tuple[List[dict], asyncio.Future]] = []
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def _load_head(self) -> dict:
+        head = await self.db.audit_chain.find_one({'_id': HEAD_ID})
+        if head is None:
+            head = {'_id': HEAD_ID, 'seq': 0, 'hash': GENESIS_HASH, 'pending': []}
+            try:
+                await self.db.audit_chain.insert_one(head)
+            except DuplicateKeyError:
+                head = await self.db.audit_chain.find_one({'_id': HEAD_ID})
+        if head['pending']:
+            # The batch reserved last may not have been stored if its writer died
+            await self.store.insert_many(head['pending'], ignore_duplicates=True)
+        return {'seq': head['seq'], 'hash': head['hash']}
+
+    def _link(self, entries: List[dict], head: dict) -> List[dict]:
+        seq, prev_hash = head['seq'], head['hash']
+        chained = []
+        for entry in entries:
+            seq += 1
+            doc = {**entry, '_id': entry.get('_id') or ObjectId(), 'seq': seq, 'prev_hash': prev_hash}
+            doc['hash'] = prev_hash = entry_hash(doc)
+            chained.append(doc)
+        return chained
+
+    async def _write(self, entries: List[dict]) -> None:
+        while True:
+            head = self._head or await self._load_head()
+            chained = self._link(entries, head)
+            last = chained[-1]
+            reserved = await self.db.audit_chain.update_one(
+                {'_id': HEAD_ID, 'seq': head['seq']},
+                {'$set': {'seq': last['seq'], 'hash': last['hash'], 'pending': chained}}
+            )
+            if reserved.modified_count:
+                self._head = {'seq': last['seq'], 'hash': last['hash']}
+                break
+            self._head = None
+        await self.store.insert_many(chained, ignore_duplicates=True)
+        if self.on_write:
+            try:
+                await self.on_write(chained)
+            except Exception as e:
+                # The entries are stored: what on_write derives from them is repairable, the audited request is not
+                logger.error(f"Audit write hook failed for seq {chained[0]['seq']}-{chained[-1]['seq']}: {str(e)}")
+
+    async def _write_batches(self, entries: List[dict]) -> None:
+        # The reserved batch is kept on the head document, so it stays bounded
+        for start in range(0, len(entries), self.max_batch):
+            await self._write(entries[start:start + self.max_batch])
+
+    async def _drain(self) -> None:
+        # Let appends issued in the same loop iteration join the first batch
+        await asyncio.sleep(0)
+        while self._queue:
+            batch, size = [], 0
+            while self._queue and (not batch or size + len(self._queue[0][0]) <= self.max_batch):
+                entries, future = self._queue.pop(0)
+                batch.append((entries, future))
+                size += len(entries)
+            try:
+                await self._write_batches([entry for entries, _ in batch for entry in entries])
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(None)
+            except Exception as e:
+                self._head = None
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def append(self, entries: List[dict]) -> None:
+        """Chain and store entries, returning once they are written"""
+        if not entries:
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((entries, future))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._drain())
+        await future
+
+
+class AuditVerifier:
+    """Streaming verification of the audit hash chain, with Merkle checkpoints.
+
+    Entries are read in `seq` order by merging one sorted cursor per hot
+    partition. Each full block of CHECKPOINT_SIZE entries that verifies is
+    recorded in `audit_checkpoints` with its Merkle root and last hash, and
+    the next run resumes after the newest checkpoint. A full run re-reads
+    everything still hot and compares each block with its checkpoint.
+    Archived months are covered by their checkpoints and archive digests;
+    archiving a month also records its last seq and hash, which both kinds
+    of run anchor on when it is newer than any checkpoint, so dropping a
+    month that was never checkpointed does not leave a gap.
+    """
+
+    def __init__(self, db, store: AuditStore, checkpoint_size: int = CHECKPOINT_SIZE, batch_size: int = 1000):
+        self.db = db
+        self.store = store
+        self.checkpoint_size = checkpoint_size
+        self.batch_size = batch_size
+
+    async def _merged(self, after: int):
+        """Chained entries with seq > after from every partition, in seq order"""
+        cursors = [
+            self.db[name].find({'seq': {'$gt': after}}, {'_id': 0}).sort('seq', 1).batch_size(self.batch_size)
+            for name in await self.store.partitions(refresh=True)
+        ]
+        heap = []
+        for index, cursor in enumerate(cursors):
+            entry = await self._next(cursor)
+            if entry is not None:
+                heap.append((entry['seq'], index, entry))
+        heapq.heapify(heap)
+        while heap:
+            _, index, entry = heap[0]
+            yield entry
+            following = await self._next(cursors[index])
+            if following is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (following['seq'], index, following))
+
+    @staticmethod
+    async def _next(cursor) -> Optional[dict]:
+        try:
+            return await cursor.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    async def _archive_anchor(self) -> Optional[dict]:
+        """End of the newest archived month, as a checkpoint-like {to_seq, last_hash}"""
+        archive = await self.db.audit_archives.find_one(
+            {'status': 'archived', 'last_seq': {'$type': 'number'}},
+            sort=[('last_seq', DESCENDING)]
+        )
+        return {'to_seq': archive['last_seq'], 'last_hash': archive['last_hash']} if archive else None
+
+    async def checkpoints(self) -> List[dict]:
+        return await self.db.audit_checkpoints.find({}).sort('_id', 1).to_list(None)
+
+    async def verify(self, full: bool = False) -> Dict[str, Any]:
+        """Check seq continuity, links and hashes of entries after the last checkpoint (or all hot ones)"""
+        stored = {c['_id']: c for c in await self.checkpoints()} if full else {}
+        last = await self._archive_anchor()
+        if not full:
+            checkpoint = await self.db.audit_checkpoints.find_one({}, sort=[('_id', DESCENDING)])
+            if checkpoint and (last is None or checkpoint['to_seq'] > last['to_seq']):
+                last = checkpoint
+        after = last['to_seq'] if last else 0
+        expected = after + 1 if last else None
+        prev_hash = last['last_hash'] if last else None
+
+        problems: List[dict] = []
+        leaves: List[str] = []
+        block_start = None
+        verified = checkpointed = 0
+        first_seq = last_seq = None
+
+        def problem(kind: str, seq: int, **details):
+            if len(problems) < MAX_PROBLEMS:
+                problems.append({'type': kind, 'seq': seq, **details})
+
+        async for entry in self._merged(after):
+            seq = entry['seq']
+            if expected is None:
+                # First hot entry of a full run: anchor on the checkpoint before it, if any
+                anchor = next((c for c in stored.values() if c['to_seq'] == seq - 1), None)
+                expected = seq
+                if seq == 1:
+                    prev_hash = GENESIS_HASH
+                else:
+                    prev_hash = anchor['last_hash'] if anchor else entry.get('prev_hash')
+            if seq != expected:
+                problem('gap' if seq > expected else 'duplicate', seq, expected=expected)
+                leaves, block_start = [], None
+            if entry.get('prev_hash') != prev_hash:
+                problem('broken_link', seq)
+            if entry_hash(entry) != entry.get('hash'):
+                problem('altered', seq)
+
+            prev_hash = entry.get('hash')
+            expected = seq + 1
+            first_seq = first_seq if first_seq is not None else seq
+            last_seq = seq
+            verified += 1
+
+            if (seq - 1) % self.checkpoint_size == 0:
+                leaves, block_start = [], seq
+            if block_start is None:
+                continue
+            leaves.append(entry['hash'])
+            if seq % self.checkpoint_size:
+                continue
+
+            block = (seq - 1) // self.checkpoint_size
+            root = merkle_root(leaves)
+            leaves, block_start = [], None
+            if block in stored:
+                if stored[block]['merkle_root'] != root:
+                    problem('checkpoint_mismatch', seq, block=block)
+            elif not problems:
+                # Only a block verified end to end with everything before it becomes a checkpoint
+                checkpoint = {
+                    '_id': block,
+                    'from_seq': seq - self.checkpoint_size + 1,
+                    'to_seq': seq,
+                    'merkle_root': root,
+                    'last_hash': entry['hash'],
+                    'created_at': datetime.now(timezone.utc)
+                }
+                try:
+                    await self.db.audit_checkpoints.insert_one(checkpoint)
+                    checkpointed += 1
+                except DuplicateKeyError:
+                    pass
+
+        if problems:
+            logger.error(f"Audit chain verification found {len(problems)} problem(s), first at seq {problems[0]['seq']}")
+        return {
+            'ok': not problems,
+            'full': full,
+            'from_seq': first_seq,
+            'to_seq': last_seq,
+            'verified': verified,
+            'checkpoints_created': checkpointed,
+            'problems': problems
+        }
@@ -0,0 +1,310 @@
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+import zstandard
+from pymongo import DESCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+
+from database import get_collection
+
+logger = logging.getLogger(__name__)
+
+LEGACY_COLLECTION = 'audit_logs'
+PARTITION_PREFIX = 'audit_logs_'
+PARTITION_PATTERN = re.compile(r'^audit_logs_(\d{4})_(\d{2})$')
+
+# Created on every monthly partition the first time it is written to
+PARTITION_INDEXES = [
+    [('timestamp', DESCENDING)],
+    [('seq', 1)],  # hash chain order, see audit_chain
+]
+
+
+def _aware(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def partition_name(timestamp: datetime) -> str:
+    """Monthly partition holding events at `timestamp` (UTC), e.g. audit_logs_2025_01"""
+    timestamp = _aware(timestamp).astimezone(timezone.utc)
+    return f"{PARTITION_PREFIX}{timestamp.year:04d}_{timestamp.month:02d}"
+
+
+def partition_start(name: str) -> datetime:
+    year, month = PARTITION_PATTERN.match(name).groups()
+    return datetime(int(year), int(month), 1, tzinfo=timezone.utc)
+
+
+def partition_end(name: str) -> datetime:
+    start = partition_start(name)
+    return datetime(start.year + start.month // 12, start.month % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return _aware(value).isoformat()
+    return str(value)
+
+
+class AuditStore:
+    """Audit events in monthly collections, with old months archived to zstd-compressed NDJSON.
+
+    Writes go to `audit_logs_YYYY_MM` by event timestamp. Queries touch only
+    the partitions overlapping their time range, newest first, and stop once
+    the limit is reached. The pre-partitioning `audit_logs` collection is
+    read alongside them, merged in timestamp order, until it has been
+    migrated. Months older
+    than `hot_months` are written to `archive_dir` and dropped; the archive
+    can still be read back with a streaming scan.
+    """
+
+    def __init__(self, db, archive_dir: str, hot_months: int = 12, partition_cache_seconds: int = 60):
+        self.db = db
+        self.archive_dir = archive_dir
+        self.hot_months = hot_months
+        self.partition_cache_seconds = partition_cache_seconds
+        self._partitions: Optional[List[str]] = None
+        self._partitions_loaded_at = 0.0
+        self._has_legacy = False
+        self._indexed: set = set()
+
+    # -- partitions --
+
+    async def _ensure_partition(self, name: str) -> None:
+        if name in self._indexed:
+            return
+        for keys in PARTITION_INDEXES:
+            await self.db[name].create_index(keys)
+        self._indexed.add(name)
+        if self._partitions is not None and name not in self._partitions:
+            self._partitions = sorted(self._partitions + [name], reverse=True)
+
+    async def partitions(self, refresh: bool = False) -> List[str]:
+        """Existing monthly partitions, newest first (cached briefly)"""
+        if refresh or self._partitions is None or time.monotonic() - self._partitions_loaded_at > self.partition_cache_seconds:
+            names = await self.db.list_collection_names()
+            self._partitions = sorted((n for n in names if PARTITION_PATTERN.match(n)), reverse=True)
+            self._has_legacy = LEGACY_COLLECTION in names
+            self._partitions_loaded_at = time.monotonic()
+        return self._partitions
+
+    async def partitions_for(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[str]:
+        """Partitions overlapping [start, end), newest first; the legacy collection last"""
+        names = [
+            name for name in await self.partitions()
+            if (start is None or partition_end(name) > _aware(start)) and (end is None or partition_start(name) < _aware(end))
+        ]
+        if self._has_legacy:
+            names.append(LEGACY_COLLECTION)
+        return names
+
+    # -- writes --
+
+    async def insert(self, entry: dict) -> None:
+        name = partition_name(entry['timestamp'])
+        await self._ensure_partition(name)
+        await self.db[name].insert_one(entry)
+
+    async def insert_many(self, entries: List[dict], ignore_duplicates: bool = False) -> None:
+        """Insert events into their partitions; with ignore_duplicates, entries already stored (same _id) are skipped"""
+        by_partition: Dict[str, List[dict]] = {}
+        for entry in entries:
+            by_partition.setdefault(partition_name(entry['timestamp']), []).append(entry)
+        for name, docs in by_partition.items():
+            await self._ensure_partition(name)
+            if not ignore_duplicates:
+                await self.db[name].insert_many(docs)
+                continue
+            try:
+                await self.db[name].insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                    raise
+
+    # -- reads --
+
+    async def find(self, query: dict, start: Optional[datetime] = None, end: Optional[datetime] = None, limit: int = 100) -> List[dict]:
+        """Newest events matching `query` in [start, end), reading only the partitions that can hold them"""
+        time_range: Dict[str, datetime] = {}
+        if start is not None:
+            time_range['$gte'] = start
+        if end is not None:
+            time_range['$lt'] = end
+        if time_range:
+            query = {**query, 'timestamp': time_range}
+
+        names = await self.partitions_for(start, end)
+        # Mid-migration the legacy collection holds the newest unmigrated events, which can be newer than
+        # whole partitions: its newest `limit` are read first and merged in timestamp order
+        legacy: List[dict] = []
+        if LEGACY_COLLECTION in names:
+            names.remove(LEGACY_COLLECTION)
+            collection = get_collection(self.db, LEGACY_COLLECTION, 'audit_read')
+            legacy = await collection.find(query).sort('timestamp', DESCENDING).limit(limit).to_list(limit)
+
+        logs: List[dict] = []
+        for name in names:
+            # Legacy events newer than this month rank above everything in it and in older months
+            newer = sum(1 for entry in legacy if _aware(entry['timestamp']) >= partition_end(name))
+            remaining = limit - len(logs) - newer
+            if remaining <= 0:
+                break
+            collection = get_collection(self.db, name, 'audit_read')
+            logs += await collection.find(query).sort('timestamp', DESCENDING).limit(remaining).to_list(remaining)
+        if legacy:
+            logs = sorted(logs + legacy, key=lambda entry: _aware(entry['timestamp']), reverse=True)[:limit]
+        return logs
+
+    # -- archival --
+
+    def archive_path(self, name: str) -> str:
+        return os.path.join(self.archive_dir, f"{name}.ndjson.zst")
+
+    async def migrate_legacy(self, batch_size: int = 1000) -> int:
+        """Move one batch of events from the unpartitioned collection into monthly partitions"""
+        legacy = self.db[LEGACY_COLLECTION]
+        batch = await legacy.find().sort('timestamp', 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            return 0
+        # Keeps _id, so a batch re-run after a crash only skips duplicates
+        await self.insert_many(batch, ignore_duplicates=True)
+        await legacy.delete_many({'_id': {'$in': [entry['_id'] for entry in batch]}})
+        return len(batch)
+
+    async def _claim_archive(self, name: str, lease: timedelta) -> bool:
+        now = datetime.now(timezone.utc)
+        try:
+            await self.db.audit_archives.insert_one({'_id': name, 'status': 'running', 'started_at': now})
+            return True
+        except DuplicateKeyError:
+            # Retry a failed run, or one whose worker died
+            taken = await self.db.audit_archives.find_one_and_update(
+                {'_id': name, '$or': [{'status': 'failed'}, {'status': 'running', 'started_at': {'$lt': now - lease}}]},
+                {'$set': {'status': 'running', 'started_at': now}}
+            )
+            return taken is not None
+
+    async def archive_partition(self, name: str, batch_size: int = 1000) -> Optional[dict]:
+        """Write one month to a zstd NDJSON file, verify it, then drop the collection"""
+        if not await self._claim_archive(name, lease=timedelta(hours=1)):
+            return None
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = self.archive_path(name)
+        tmp_path = f"{path}.tmp"
+        count = 0
+        digest = hashlib.sha256()
+        # Chain position of the month, so verification can resume after it once it is dropped
+        first_seq = last_seq = last_hash = None
+        try:
+            with open(tmp_path, 'wb') as f:
+                writer = zstandard.ZstdCompressor(level=10).stream_writer(f)
+                cursor = self.db[name].find({}, {'_id': 0}).sort('timestamp', 1).batch_size(batch_size)
+                lines: List[bytes] = []
+                async for entry in cursor:
+                    seq = entry.get('seq')
+                    if isinstance(seq, int):
+                        first_seq = seq if first_seq is None else min(first_seq, seq)
+                        if last_seq is None or seq > last_seq:
+                            last_seq, last_hash = seq, entry.get('hash')
+                    lines.append(json.dumps(entry, separators=(',', ':'), default=_json_default).encode() + b'\n')
+                    if len(lines) >= batch_size:
+                        chunk = b''.join(lines)
+                        digest.update(chunk)
+                        await asyncio.to_thread(writer.write, chunk)
+                        count += len(lines)
+                        lines = []
+                if lines:
+                    chunk = b''.join(lines)
+                    digest.update(chunk)
+                    await asyncio.to_thread(writer.write, chunk)
+                    count += len(lines)
+                writer.close()
+
+            stored = await self.db[name].count_documents({})
+            if stored != count:
+                raise RuntimeError(f"wrote {count} events but {stored} are stored")
+            os.replace(tmp_path, path)
+
+            archive = {
+                'status': 'archived',
+                'path': path,
+                'count': count,
+                'sha256': digest.hexdigest(),
+                'first_seq': first_seq,
+                'last_seq': last_seq,
+                'last_hash': last_hash,
+                'period_start': partition_start(name),
+                'period_end': partition_end(name),
+                'archived_at': datetime.now(timezone.utc)
+            }
+            await self.db.audit_archives.update_one({'_id': name}, {'$set': archive})
+            await self.db[name].drop()
+            self._indexed.discard(name)
+            await self.partitions(refresh=True)
+            logger.info(f"Archived {count} audit events of {name} to {path}")
+            return archive
+        except (PyMongoError, OSError, RuntimeError) as e:
+            logger.error(f"Error archiving {name}: {str(e)}")
+            await self.db.audit_archives.update_one({'_id': name}, {'$set': {'status': 'failed', 'error': str(e)}})
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+
+    async def archive_due(self) -> int:
+        """Archive every partition older than the hot window; returns how many were archived"""
+        now = datetime.now(timezone.utc)
+        month_index = now.year * 12 + now.month - 1 - self.hot_months
+        cutoff = datetime(month_index // 12, month_index % 12 + 1, 1, tzinfo=timezone.utc)
+        archived = 0
+        for name in reversed(await self.partitions(refresh=True)):
+            if partition_end(name) > cutoff:
+                break
+            if await self.archive_partition(name):
+                archived += 1
+        return archived
+
+    async def run(self, interval: int) -> None:
+        """Migrate legacy events and archive old months every `interval` seconds until cancelled"""
+        while True:
+            try:
+                while await self.migrate_legacy():
+                    await asyncio.sleep(0.1)
+                await self.archive_due()
+            except PyMongoError as e:
+                logger.error(f"Error in audit archiver: {str(e)}")
+            await asyncio.sleep(interval)
+
+    async def archives(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[dict]:
+        """Archived months overlapping [start, end), oldest first"""
+        query: Dict[str, Any] = {'status': 'archived'}
+        if start is not None:
+            query['period_end'] = {'$gt': start}
+        if end is not None:
+            query['period_start'] = {'$lt': end}
+        return await self.db.audit_archives.find(query).sort('period_start', 1).to_list(None)
+
+    def scan(self, paths: List[str], filters: Dict[str, str], start: Optional[datetime] = None, end: Optional[datetime] = None) -> Iterator[bytes]:
+        """Stream matching NDJSON lines out of archive files, decompressing as it goes"""
+        start = _aware(start) if start else None
+        end = _aware(end) if end else None
+        for path in paths:
+            with open(path, 'rb') as f:
+                reader = io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(f), encoding='utf-8')
+                for line in reader:
+                    entry = json.loads(line)
+                    if any(entry.get(field) != value for field, value in filters.items()):
+                        continue
+                    if start or end:
+                        timestamp = datetime.fromisoformat(entry['timestamp'])
+                        if (start and timestamp < start) or (end and timestamp >= end):
+                            continue
+                    yield line.encode()
@@ -0,0 +1,167 @@
+"""Offline breached-password lookups against a memory-mapped SHA-1 corpus.
+
+The corpus is a file of sorted, fixed-width 20-byte SHA-1 digests. Build it
+once from the Have I Been Pwned "ordered by hash" download (SHA1:COUNT
+lines), streaming, so neither step needs the corpus in memory:
+
+    python breach_check.py convert pwned-passwords-sha1-ordered-by-hash.txt breached.sha1
+
+Update a corpus in use by renaming the new file over it (convert writes a
+temporary file and renames it into place). Processes that have the old
+file mapped keep reading it until they reopen the path; overwriting it in
+place instead would crash them (SIGBUS) when mapped pages disappear.
+"""
+import argparse
+import hashlib
+import logging
+import mmap
+import os
+from typing import List, Optional, Tuple
+
+from cryptography.fernet import Fernet, InvalidToken
+
+logger = logging.getLogger(__name__)
+
+RECORD_SIZE = 20
+
+
+class BreachCorpus:
+    """Sorted SHA-1 digests, searched in place through mmap.
+
+    Only the pages a binary search touches are read (about 30 probes for
+    a billion records), and the OS page cache shares them between
+    processes, so a lookup costs microseconds whatever the corpus size.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # The map keeps its own handle on the file, so it stays valid (and is released) on its own
+        with open(path, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            self._identity = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            size = stat.st_size
+            if size % RECORD_SIZE:
+                raise ValueError(f"{path} is not a corpus of {RECORD_SIZE}-byte records ({size} bytes)")
+            self.count = size // RECORD_SIZE
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def contains_digest(self, digest: bytes) -> bool:
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = mid * RECORD_SIZE
+            record = self._map[offset:offset + RECORD_SIZE]
+            if record < digest:
+                lo = mid + 1
+            elif record > digest:
+                hi = mid
+            else:
+                return True
+        return False
+
+    def __contains__(self, password: str) -> bool:
+        return self.contains_digest(hashlib.sha1(password.encode()).digest())
+
+    def replaced(self) -> bool:
+        """True once a different file has been renamed over `path`"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns) != self._identity
+
+    def close(self) -> None:
+        """Unmap now; only for a corpus no other thread can be reading (otherwise drop the reference)"""
+        if self._map is not None:
+            self._map.close()
+
+
+def open_corpus(path: Optional[str]) -> Optional[BreachCorpus]:
+    """The corpus at `path`, or None (with a warning) when it is not configured or unusable"""
+    if not path:
+        return None
+    try:
+        corpus = BreachCorpus(path)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Breached-password checks disabled: {str(e)}")
+        return None
+    logger.info(f"Loaded breached-password corpus {path} ({corpus.count} hashes)")
+    return corpus
+
+
+def convert(source: str, target: str) -> int:
+    """Write the fixed-width corpus for an HIBP-style SHA1[:COUNT] text file; returns the record count"""
+    count = 0
+    previous = b''
+    # Written beside the target and renamed over it, so a corpus in use is never modified in place
+    tmp_target = f"{target}.tmp"
+    try:
+        with open(source, 'rb') as lines, open(tmp_target, 'wb') as out:
+            for line in lines:
+                line = line.strip()
+                if not line:
+                    continue
+                digest = bytes.fromhex(line.split(b':', 1)[0].decode())
+                if len(digest) != RECORD_SIZE:
+                    raise ValueError(f"Line {count + 1}: not a SHA-1 hash")
+                if digest <= previous:
+                    raise ValueError(f"Line {count + 1}: hashes must be sorted and unique (use the 'ordered by hash' download)")
+                out.write(digest)
+                previous = digest
+                count += 1
+        os.replace(tmp_target, target)
+    except BaseException:
+        if os.path.exists(tmp_target):
+            os.remove(tmp_target)
+        raise
+    return count
+
+
+# -- process pool workers --
+
+_worker_corpus: Optional[BreachCorpus] = None
+_worker_fernet: Optional[Fernet] = None
+
+
+def init_worker(corpus_path: str, fernet_key: bytes) -> None:
+    """Process pool initializer: each worker maps the corpus once (the pages are shared)"""
+    global _worker_corpus, _worker_fernet
+    _worker_corpus = BreachCorpus(corpus_path)
+    _worker_fernet = Fernet(fernet_key)
+
+
+def check_batch(docs: List[Tuple[object, str]]) -> List[Tuple[object, Optional[bool]]]:
+    """(id, password_encrypted) -> (id, breached), with None for passwords that do not decrypt"""
+    results = []
+    for doc_id, password_encrypted in docs:
+        try:
+            password = _worker_fernet.decrypt(password_encrypted.encode()).decode()
+        except (InvalidToken, UnicodeDecodeError):
+            results.append((doc_id, None))
+            continue
+        results.append((doc_id, password in _worker_corpus))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    convert_parser = subparsers.add_parser('convert', help='Build a corpus from an HIBP-style text file')
+    convert_parser.add_argument('source')
+    convert_parser.add_argument('target')
+    check_parser = subparsers.add_parser('check', help='Look a password up in a corpus')
+    check_parser.add_argument('corpus')
+    check_parser.add_argument('password')
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        print(f"Wrote {convert(args.source, args.target)} hashes to {args.target}")
+    else:
+        print('breached' if args.password in BreachCorpus(args.corpus) else 'not found')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import multiprocessing
+import string
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from pymongo import UpdateOne
+
+import breach_check
+from breach_check import BreachCorpus
+from database import update_returning
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_JOB_TYPE = 'password_fingerprint_backfill'
+BREACH_RESCAN_JOB_TYPE = 'breached_password_rescan'
+
+MIN_LENGTH = 12
+
+# A handful of the most common passwords and agency defaults; breach lists are checked by breach_check
+COMMON_PASSWORDS = frozenset({
+    '123456', '12345678', '123456789', '1234567890', 'password', 'password1', 'password123',
+    'qwerty', 'qwerty123', 'abc123', '111111', '000000', 'iloveyou', 'admin', 'admin123',
+    'welcome', 'welcome1', 'letmein', 'senha', 'senha123', 'mudar123', 'trocar123', 'v4company'
+})
+
+# Stored on items whose password could not be decrypted, so the backfill does not retry them forever
+UNDECRYPTABLE = 'undecryptable'
+
+# Found in the breach corpus
+BREACHED = 'breached'
+
+WEAKNESSES = ['too_short', 'low_variety', 'common', BREACHED, UNDECRYPTABLE]
+
+
+def fingerprint_key(master_key: str) -> bytes:
+    """HMAC key for fingerprints, derived apart from the encryption key"""
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b'keykeeper password fingerprint v1').derive(master_key.encode())
+
+
+def weaknesses(password: str) -> List[str]:
+    """What is wrong with a password, if anything"""
+    found = []
+    if len(password) < MIN_LENGTH:
+        found.append('too_short')
+    classes = [string.ascii_lowercase, string.ascii_uppercase, string.digits]
+    variety = sum(any(c in chars for c in password) for chars in classes) + any(not c.isalnum() for c in password)
+    if variety < 3:
+        found.append('low_variety')
+    if password.lower() in COMMON_PASSWORDS:
+        found.append('common')
+    return found
+
+
+class CredentialHygiene:
+    """Password reuse and weakness, found without decrypting anything at query time.
+
+    Every item password gets a keyed HMAC-SHA256 fingerprint and a list of
+    weaknesses, computed from the plaintext when it is written and stored
+    next to the ciphertext. Equal passwords have equal fingerprints, so reuse
+    groups come out of one $group over an indexed field; the key never leaves
+    the server, so a fingerprint cannot be brute-forced from the database
+    alone. Items written before fingerprints existed are filled in by a
+    backfill job that decrypts them in parallel batches. With a breach
+    corpus, passwords found in it are flagged `breached` on write, and a
+    rescan job rechecks every item in a process pool when the corpus is
+    updated. A corpus renamed over the configured path is mapped again when
+    a rescan starts, and by every process within `breach_reload_seconds`.
+    """
+
+    def __init__(
+        self,
+        db,
+        fernet_key: bytes,
+        key: bytes,
+        breaches: Optional[BreachCorpus] = None,
+        batch_size: int = 500,
+        workers: int = 4,
+        breach_workers: int = 4,
+        breach_reload_seconds: int = 60,
+        lease_seconds: int = 300
+    ):
+        self.db = db
+        self.fernet_key = fernet_key
+        self.fernet = Fernet(fernet_key)
+        self.key = key
+        self.breaches = breaches
+        self.batch_size = batch_size
+        self.workers = workers
+        self.breach_workers = breach_workers
+        self.breach_reload_seconds = breach_reload_seconds
+        self.lease_seconds = lease_seconds
+        self._breaches_checked_at = time.monotonic()
+
+    def fingerprint(self, password: str) -> str:
+        return hmac.new(self.key, password.encode(), hashlib.sha256).hexdigest()
+
+    def assess(self, password: Optional[str]) -> Dict[str, Any]:
+        """Fields to store with an item whose password is being set (on the event loop; worker threads use _assess)"""
+        if self.breaches is not None and time.monotonic() - self._breaches_checked_at >= self.breach_reload_seconds:
+            self.reload_breaches()
+        return self._assess(password, self.breaches)
+
+    def _assess(self, password: Optional[str], breaches: Optional[BreachCorpus]) -> Dict[str, Any]:
+        if not password:
+            return {'password_fingerprint': None, 'password_weaknesses': []}
+        found = weaknesses(password)
+        if breaches is not None and password in breaches:
+            found.append(BREACHED)
+        return {'password_fingerprint': self.fingerprint(password), 'password_weaknesses': found}
+
+    def reload_breaches(self) -> bool:
+        """Map the corpus again if a new file has been renamed over it; True when it was swapped"""
+        self._breaches_checked_at = time.monotonic()
+        if self.breaches is None or not self.breaches.replaced():
+            return False
+        corpus = breach_check.open_corpus(self.breaches.path)
+        if corpus is None:
+            return False
+        # Not closed: a backfill thread may still be searching the old map, which is released with its last reference
+        self.breaches = corpus
+        return True
+
+    # -- jobs --
+
+    async def _start_job(self, job_type: str, user_id: str, progress: Dict[str, int]) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        job = {
+            'id': str(uuid.uuid4()),
+            'type': job_type,
+            'status': 'running',  # running, completed, failed
+            'created_by': user_id,
+            'created_at': now,
+            'updated_at': now,
+            'locked_until': now + timedelta(seconds=self.lease_seconds),
+            'progress': progress,
+            'last_error': None
+        }
+        # The upsert only inserts when no job of this type holds a live lease; otherwise it returns that one
+        existing = await update_returning(
+            self.db.jobs,
+            {'type': job_type, 'status': 'running', 'locked_until': {'$gt': now}},
+            {'$setOnInsert': job},
+            projection={'_id': 0, 'id': 1},
+            upsert=True,
+            before=True
+        )
+        return None if existing else job
+
+    async def _record(self, job_id: str, counts: Dict[str, int]) -> None:
+        """Add to the job's progress counters and extend its lease"""
+        now = datetime.now(timezone.utc)
+        await self.db.jobs.update_one(
+            {'id': job_id},
+            {
+                '$inc': {f'progress.{name}': count for name, count in counts.items()},
+                '$set': {'locked_until': now + timedelta(seconds=self.lease_seconds), 'updated_at': now}
+            }
+        )
+
+    async def _run_job(self, job: dict, query: dict, projection: dict, process, concurrency: int) -> None:
+        # Pages through matching items by _id and keeps up to `concurrency` batches in `process` at once
+        in_flight = set()
+        last_id = None
+        try:
+            while True:
+                page = dict(query, _id={'$gt': last_id}) if last_id is not None else query
+                docs = await self.db.items.find(page, projection).sort('_id', 1).limit(self.batch_size).to_list(self.batch_size)
+                if not docs:
+                    break
+                last_id = docs[-1]['_id']
+                in_flight.add(asyncio.create_task(process(job['id'], docs)))
+                if len(in_flight) >= concurrency:
+                    done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        task.result()
+            await asyncio.gather(*in_flight)
+            status, error = 'completed', None
+        except Exception as e:
+            for task in in_flight:
+                task.cancel()
+            logger.error(f"Job {job['type']} {job['id']} failed: {str(e)}")
+            status, error = 'failed', str(e)
+
+        now = datetime.now(timezone.utc)
+        await self.db.jobs.update_one(
+            {'id': job['id']},
+            {'$set': {'status': status, 'last_error': error, 'completed_at': now, 'updated_at': now, 'locked_until': None}}
+        )
+
+    # -- fingerprint backfill --
+
+    async def start_backfill(self, user_id: str) -> Optional[dict]:
+        """Job document for a new backfill, or None while another one holds its lease"""
+        return await self._start_job(BACKFILL_JOB_TYPE, user_id, {'items': 0, 'failed': 0})
+
+    def _assess_batch(self, docs: List[dict], breaches: Optional[BreachCorpus]) -> Tuple[List[UpdateOne], int]:
+        # Runs in a worker thread: decrypting is the expensive part. The corpus is the one the loop handed over
+        updates = []
+        failed = 0
+        for doc in docs:
+            try:
+                fields = self._assess(self.fernet.decrypt(doc['password_encrypted'].encode()).decode(), breaches)
+            except (InvalidToken, UnicodeDecodeError):
+                fields = {'password_fingerprint': None, 'password_weaknesses': [UNDECRYPTABLE]}
+                failed += 1
+            # Conditional on the ciphertext read, so a password changed meanwhile keeps its own fingerprint
+            updates.append(UpdateOne({'_id': doc['_id'], 'password_encrypted': doc['password_encrypted']}, {'$set': fields}))
+        return updates, failed
+
+    async def _backfill_batch(self, job_id: str, docs: List[dict]) -> None:
+        updates, failed = await asyncio.get_running_loop().run_in_executor(None, self._assess_batch, docs, self.breaches)
+        await self.db.items.bulk_write(updates, ordered=False)
+        await self._record(job_id, {'items': len(docs) - failed, 'failed': failed})
+
+    async def backfill(self, job: dict) -> None:
+        """Fingerprint every item that has a password but no fingerprint yet, `workers` batches at a time"""
+        await self._run_job(
+            job,
+            {'password_encrypted': {'$type': 'string'}, 'password_fingerprint': {'$exists': False}},
+            {'_id': 1, 'password_encrypted': 1},
+            self._backfill_batch,
+            self.workers
+        )
+
+    # -- breach rescan --
+
+    async def start_breach_rescan(self, user_id: str) -> Optional[dict]:
+        """Job document for a new breach rescan, or None while another one holds its lease"""
+        return await self._start_job(BREACH_RESCAN_JOB_TYPE, user_id, {'items': 0, 'breached': 0, 'changed': 0, 'failed': 0})
+
+    async def _rescan_batch(self, pool: ProcessPoolExecutor, job_id: str, docs: List[dict]) -> None:
+        results = await asyncio.get_running_loop().run_in_executor(
+            pool, breach_check.check_batch, [(doc['_id'], doc['password_encrypted']) for doc in docs]
+        )
+        updates = []
+        counts = {'items': len(docs), 'breached': 0, 'changed': 0, 'failed': 0}
+        for doc, (_, breached) in zip(docs, results):
+            if breached is None:
+                counts['failed'] += 1
+                continue
+            counts['breached'] += breached
+            if breached == (BREACHED in (doc.get('password_weaknesses') or [])):
+                continue
+            # Conditional on the ciphertext read, like the backfill
+            change = {'$addToSet': {'password_weaknesses': BREACHED}} if breached else {'$pull': {'password_weaknesses': BREACHED}}
+            updates.append(UpdateOne({'_id': doc['_id'], 'password_encrypted': doc['password_encrypted']}, change))
+        if updates:
+            counts['changed'] = (await self.db.items.bulk_write(updates, ordered=False)).modified_count
+        await self._record(job_id, counts)
+
+    async def rescan_breaches(self, job: dict) -> None:
+        """Recheck every item password against the breach corpus in `breach_workers` processes"""
+        # Spawned, not forked: the workers only need the corpus and the key, not this process' threads and sockets
+        pool = ProcessPoolExecutor(
+            self.breach_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=breach_check.init_worker,
+            initargs=(self.breaches.path, self.fernet_key)
+        )
+        try:
+            await self._run_job(
+                job,
+                {'password_encrypted': {'$type': 'string'}},
+                {'_id': 1, 'password_encrypted': 1, 'password_weaknesses': 1},
+                partial(self._rescan_batch, pool),
+                self.breach_workers * 2
+            )
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    # -- reports --
+
+    async def reuse_groups(self, query: dict) -> List[dict]:
+        """Items sharing a password, grouped, largest groups first"""
+        pipeline = [
+            {'$match': {'$and': [query, {'password_fingerprint': {'$type': 'string'}}]}},
+            {'$group': {
+                '_id': '$password_fingerprint',
+                'count': {'$sum': 1},
+                'vaults': {'$addToSet': '$vault_id'},
+                'items': {'$push': {'id': '$id', 'vault_id': '$vault_id', 'title': '$title', 'type': '$type'}}
+            }},
+            {'$match': {'count': {'$gt': 1}}},
+            {'$sort': {'count': -1}}
+        ]
+        groups = await self.db.items.aggregate(pipeline, allowDiskUse=True).to_list(None)
+        # The fingerprint itself stays in the database; a short prefix is enough to tell groups apart
+        return [
+            {'group': group['_id'][:12], 'count': group['count'], 'vaults': len(group['vaults']), 'items': group['items']}
+            for group in groups
+        ]
+
+    async def weak_items(self, query: dict) -> List[dict]:
+        return await self.db.items.find(
+            {'$and': [query, {'password_weaknesses': {'$in': WEAKNESSES}}]},
+            {'_id': 0, 'id': 1, 'vault_id': 1, 'title': 1, 'type': 1, 'password_weaknesses': 1}
+        ).to_list(None)
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReadPreference, ReturnDocument, monitoring
+from pymongo.errors import OperationFailure, PyMongoError
+from pymongo.write_concern import WriteConcern
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+# ============= SETTINGS =============
+
+def _env_int(name: str, default: Optional[int]) -> Optional[int]:
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+@dataclass
+class DatabaseSettings:
+    """Motor client settings, sized per uvicorn worker"""
+    url: str
+    db_name: str
+    max_pool_size: int = 100
+    min_pool_size: int = 0
+    max_idle_time_ms: Optional[int] = None
+    wait_queue_timeout_ms: Optional[int] = None
+    connect_timeout_ms: int = 20000
+    server_selection_timeout_ms: int = 30000
+    socket_timeout_ms: Optional[int] = None
+    warmup: bool = True
+
+    @classmethod
+    def from_env(cls) -> 'DatabaseSettings':
+        return cls(
+            url=os.environ['MONGO_URL'],
+            db_name=os.environ['DB_NAME'],
+            max_pool_size=_env_int('MONGO_MAX_POOL_SIZE', 100),
+            min_pool_size=_env_int('MONGO_MIN_POOL_SIZE', 0),
+            max_idle_time_ms=_env_int('MONGO_MAX_IDLE_TIME_MS', None),
+            wait_queue_timeout_ms=_env_int('MONGO_WAIT_QUEUE_TIMEOUT_MS', None),
+            connect_timeout_ms=_env_int('MONGO_CONNECT_TIMEOUT_MS', 20000),
+            server_selection_timeout_ms=_env_int('MONGO_SERVER_SELECTION_TIMEOUT_MS', 30000),
+            socket_timeout_ms=_env_int('MONGO_SOCKET_TIMEOUT_MS', None),
+            warmup=os.environ.get('MONGO_WARMUP', 'true').lower() in ('1', 'true', 'yes')
+        )
+
+
+# ============= OPERATION CLASSES =============
+
+# Read preference / write concern per kind of operation. Reads that tolerate
+# replication lag (audit browsing, analytics) may go to secondaries; writes of
+# secrets must survive a primary failover.
+OPERATION_CLASSES: Dict[str, Dict[str, Any]] = {
+    'default': {},
+    'audit_read': {
+        'read_preference': os.environ.get('MONGO_AUDIT_READ_PREFERENCE', 'secondaryPreferred')
+    },
+    'secret_write': {
+        'write_concern': os.environ.get('MONGO_SECRET_WRITE_CONCERN', 'majority')
+    },
+}
+
+
+def _read_preference(name: str):
+    return {
+        'primary': ReadPreference.PRIMARY,
+        'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+        'secondary': ReadPreference.SECONDARY,
+        'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+        'nearest': ReadPreference.NEAREST,
+    }[name]
+
+
+def _write_concern(w: str) -> WriteConcern:
+    return WriteConcern(w=int(w) if w.isdigit() else w)
+
+
+def get_collection(db, name: str, operation_class: str = 'default'):
+    """Collection handle carrying the read preference / write concern of an operation class"""
+    options = OPERATION_CLASSES[operation_class]
+    kwargs = {}
+    if 'read_preference' in options:
+        kwargs['read_preference'] = _read_preference(options['read_preference'])
+    if 'write_concern' in options:
+        kwargs['write_concern'] = _write_concern(options['write_concern'])
+    return db.get_collection(name, **kwargs) if kwargs else db[name]
+
+
+# ============= WRITE HELPERS =============
+
+async def update_returning(collection, query: dict, update, projection: Optional[dict] = None, before: bool = False, **kwargs) -> Optional[dict]:
+    """Update one document and return it from the same round trip (post-image, or pre-image with before=True)"""
+    return await collection.find_one_and_update(
+        query,
+        update,
+        projection=projection,
+        return_document=ReturnDocument.BEFORE if before else ReturnDocument.AFTER,
+        **kwargs
+    )
+
+
+async def delete_returning(collection, query: dict, projection: Optional[dict] = None) -> Optional[dict]:
+    """Delete one document and return it from the same round trip"""
+    return await collection.find_one_and_delete(query, projection=projection)
+
+
+# Set once a server rejects transactions (standalone mongod)
+_transactions_supported: Optional[bool] = None
+
+
+async def run_transaction(client, callback):
+    """Run `await callback(session)` in a transaction, or with session=None where transactions are unsupported"""
+    global _transactions_supported
+    if _transactions_supported is not False:
+        try:
+            async with await client.start_session() as session:
+                result = await session.with_transaction(callback)
+            _transactions_supported = True
+            return result
+        except OperationFailure as e:
+            # IllegalOperation: transactions need a replica set or mongos
+            if e.code != 20:
+                raise
+            _transactions_supported = False
+            logger.warning("MongoDB transactions unavailable, running multi-document writes without one")
+    return await callback(None)
+
+
+# ============= POOL METRICS =============
+
+registry.gauge('mongodb_pool_connections', 'Open connections in the MongoDB pool')
+registry.gauge('mongodb_pool_checked_out', 'Connections currently checked out of the MongoDB pool')
+registry.gauge('mongodb_pool_wait_queue', 'Operations waiting for a MongoDB connection')
+registry.gauge('mongodb_pool_max_size', 'Configured maxPoolSize per server, per worker')
+registry.counter('mongodb_pool_checkout_failures_total', 'Failed connection checkouts (e.g. wait queue timeout)')
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Tracks pool size, checked-out connections and waiters, for pool saturation"""
+
+    def _address(self, event) -> str:
+        host, port = event.address
+        return f"{host}:{port}"
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        registry.inc('mongodb_pool_connections', 1, address=self._address(event))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        registry.inc('mongodb_pool_connections', -1, address=self._address(event))
+
+    def connection_check_out_started(self, event):
+        registry.inc('mongodb_pool_wait_queue', 1, address=self._address(event))
+
+    def connection_check_out_failed(self, event):
+        registry.inc('mongodb_pool_wait_queue', -1, address=self._address(event))
+        registry.inc('mongodb_pool_checkout_failures_total', 1, address=self._address(event), reason=str(event.reason))
+
+    def connection_checked_out(self, event):
+        registry.inc('mongodb_pool_wait_queue', -1, address=self._address(event))
+        registry.inc('mongodb_pool_checked_out', 1, address=self._address(event))
+
+    def connection_checked_in(self, event):
+        registry.inc('mongodb_pool_checked_out', -1, address=self._address(event))
+
+
+# ============= LIFECYCLE =============
+
+def create_client(settings: DatabaseSettings, event_listeners: Sequence = ()) -> AsyncIOMotorClient:
+    """Create the Motor client with the configured pool and timeouts"""
+    options = {
+        'maxPoolSize': settings.max_pool_size,
+        'minPoolSize': settings.min_pool_size,
+        'connectTimeoutMS': settings.connect_timeout_ms,
+        'serverSelectionTimeoutMS': settings.server_selection_timeout_ms,
+    }
+    if settings.max_idle_time_ms is not None:
+        options['maxIdleTimeMS'] = settings.max_idle_time_ms
+    if settings.wait_queue_timeout_ms is not None:
+        options['waitQueueTimeoutMS'] = settings.wait_queue_timeout_ms
+    if settings.socket_timeout_ms is not None:
+        options['socketTimeoutMS'] = settings.socket_timeout_ms
+
+    registry.set('mongodb_pool_max_size', settings.max_pool_size)
+    return AsyncIOMotorClient(
+        settings.url,
+        event_listeners=list(event_listeners) + [PoolMetricsListener()],
+        **options
+    )
+
+
+async def warm_up(db, settings: DatabaseSettings) -> None:
+    """Open up to minPoolSize connections before serving traffic"""
+    connections = max(1, settings.min_pool_size)
+    await asyncio.gather(*[db.command('ping') for _ in range(connections)])
+    logger.info(f"MongoDB pool warmed up with {connections} connection(s)")
+
+
+# (keys, options) as passed to create_index
+IndexSpec = Tuple[Union[str, List[Tuple[str, int]]], Dict[str, Any]]
+
+
+def _normalize_keys(keys) -> List[Tuple[str, int]]:
+    if isinstance(keys, str):
+        return [(keys, 1)]
+    return [(field, direction) for field, direction in keys]
+
+
+async def ensure_indexes(db, indexes: Dict[str, List[IndexSpec]]) -> None:
+    """Create declared indexes that are missing and report ones that could not be built"""
+    for collection_name, specs in indexes.items():
+        collection = db[collection_name]
+        try:
+            existing = await collection.index_information()
+        except PyMongoError:
+            existing = {}
+        existing_keys = {tuple(info['key']) for info in existing.values()}
+
+        for keys, options in specs:
+            normalized = _normalize_keys(keys)
+            if tuple(normalized) in existing_keys:
+                continue
+            try:
+                await collection.create_index(normalized, **options)
+                logger.info(f"Created index on {collection_name}: {normalized}")
+            except OperationFailure as e:
+                logger.error(f"Could not create index on {collection_name} {normalized}: {str(e)}")
+
+
+def shutdown(client: AsyncIOMotorClient) -> None:
+    client.close()
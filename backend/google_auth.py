@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import re
+import time
+from typing import Dict, Optional, Sequence
+
+import httpx
+import jwt
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_TOKEN_URL = 'https://oauth2.googleapis.com/token'
+GOOGLE_JWKS_URL = 'https://www.googleapis.com/oauth2/v3/certs'
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+MAX_AGE_PATTERN = re.compile(r'max-age=(\d+)')
+
+
+def max_age(cache_control: Optional[str], default: int) -> int:
+    """Seconds a response may be cached for, from its Cache-Control header"""
+    if not cache_control:
+        return default
+    if 'no-store' in cache_control or 'no-cache' in cache_control:
+        return 0
+    match = MAX_AGE_PATTERN.search(cache_control)
+    return int(match.group(1)) if match else default
+
+
+class JWKSCache:
+    """Signing keys of an identity provider, cached as long as its Cache-Control allows.
+
+    Keys are fetched once and reused until max-age runs out; `run` refetches
+    them in the background shortly before that, so logins never wait on the
+    JWKS endpoint. A token signed with an unknown key id triggers one early
+    refetch (key rotation), at most every `min_refresh_seconds`. If a refetch
+    fails, the previous keys keep being used.
+    """
+
+    def __init__(self, http: httpx.AsyncClient, url: str, default_max_age: int = 3600, min_refresh_seconds: int = 60, refresh_margin: int = 300):
+        self.http = http
+        self.url = url
+        self.default_max_age = default_max_age
+        self.min_refresh_seconds = min_refresh_seconds
+        self.refresh_margin = refresh_margin
+        self._keys: Dict[str, jwt.PyJWK] = {}
+        self._expires_at = 0.0
+        self._fetched_at = float('-inf')
+        self._lock = asyncio.Lock()
+
+    @property
+    def fresh(self) -> bool:
+        return bool(self._keys) and time.monotonic() < self._expires_at
+
+    async def refresh(self) -> None:
+        response = await self.http.get(self.url)
+        response.raise_for_status()
+        keys = {}
+        for jwk in response.json().get('keys', []):
+            try:
+                keys[jwk['kid']] = jwt.PyJWK(jwk)
+            except (KeyError, jwt.PyJWKError) as e:
+                logger.warning(f"Skipping unusable JWKS key {jwk.get('kid')}: {str(e)}")
+        now = time.monotonic()
+        self._keys = keys
+        self._fetched_at = now
+        self._expires_at = now + max_age(response.headers.get('cache-control'), self.default_max_age)
+        logger.info(f"Loaded {len(keys)} signing key(s) from {self.url}")
+
+    async def _refresh_if(self, needed) -> None:
+        # Single flight: concurrent logins wait for one fetch instead of each starting their own
+        async with self._lock:
+            if needed():
+                try:
+                    await self.refresh()
+                except httpx.HTTPError as e:
+                    if not self._keys:
+                        raise
+                    logger.warning(f"JWKS refresh failed, keeping {len(self._keys)} cached key(s): {str(e)}")
+
+    async def get(self, kid: str) -> jwt.PyJWK:
+        """Signing key with this key id, fetching the key set only when it is stale or the id is new"""
+        if not self.fresh:
+            await self._refresh_if(lambda: not self.fresh)
+        if kid not in self._keys and time.monotonic() - self._fetched_at >= self.min_refresh_seconds:
+            await self._refresh_if(lambda: kid not in self._keys and time.monotonic() - self._fetched_at >= self.min_refresh_seconds)
+        key = self._keys.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f"Unknown signing key {kid}")
+        return key
+
+    async def run(self) -> None:
+        """Keep the keys fresh until cancelled"""
+        while True:
+            try:
+                await self._refresh_if(lambda: True)
+                delay = max(self.min_refresh_seconds, self._expires_at - time.monotonic() - self.refresh_margin)
+            except httpx.HTTPError as e:
+                logger.error(f"Error fetching JWKS from {self.url}: {str(e)}")
+                delay = self.min_refresh_seconds
+            await asyncio.sleep(delay)
+
+
+class GoogleOAuth:
+    """Authorization-code login with Google, verifying the id_token locally.
+
+    The code exchange is the only call to Google on a login: the id_token it
+    returns is checked against the cached JWKS (signature, audience, issuer,
+    expiry) and carries the profile, so no userinfo request is needed.
+    """
+
+    def __init__(
+        self,
+        http: httpx.AsyncClient,
+        jwks: JWKSCache,
+        client_id: str,
+        client_secret: str,
+        redirect_uri: str,
+        token_url: str = GOOGLE_TOKEN_URL,
+        issuers: Sequence[str] = GOOGLE_ISSUERS,
+        leeway: int = 30
+    ):
+        self.http = http
+        self.jwks = jwks
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.redirect_uri = redirect_uri
+        self.token_url = token_url
+        self.issuers = tuple(issuers)
+        self.leeway = leeway
+
+    async def exchange_code(self, code: str) -> dict:
+        response = await self.http.post(
+            self.token_url,
+            data={
+                'code': code,
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'redirect_uri': self.redirect_uri,
+                'grant_type': 'authorization_code'
+            }
+        )
+        return response.json()
+
+    async def verify_id_token(self, id_token: str) -> dict:
+        """Claims of a Google id_token; raises jwt.InvalidTokenError if it does not check out"""
+        header = jwt.get_unverified_header(id_token)
+        key = await self.jwks.get(header.get('kid', ''))
+        claims = jwt.decode(
+            id_token,
+            key.key,
+            algorithms=['RS256'],
+            audience=self.client_id,
+            leeway=self.leeway,
+            options={'require': ['exp', 'iat', 'iss', 'aud', 'sub']}
+        )
+        if claims['iss'] not in self.issuers:
+            raise jwt.InvalidIssuerError(f"Unexpected issuer {claims['iss']}")
+        if claims.get('email') and claims.get('email_verified') is False:
+            raise jwt.InvalidTokenError("Email address not verified")
+        return claims
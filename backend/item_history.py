@@ -0,0 +1,151 @@
+import asyncio
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from cryptography.fernet import Fernet
+from pymongo import DESCENDING
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Bookkeeping and derived fields that are not worth a history entry
+UNTRACKED_FIELDS = {'updated_at', 'updated_by', 'version', 'tag_pairs', 'password_fingerprint', 'password_weaknesses'}
+
+# Values that are only handed out through an explicit (audited) reveal
+SECRET_FIELDS = {'password_encrypted', 'notes_encrypted'}
+
+
+class ItemHistory:
+    """Versioned change history of items, kept as encrypted reverse deltas.
+
+    Every update bumps the item's `version` and stores one record holding
+    the values the changed fields had before it, sealed with Fernet. The
+    current item plus the records walked newest-first rebuild any earlier
+    state. Once an item has more than `keep_versions` records, the oldest
+    ones are folded into a single record that keeps each field's earliest
+    known value.
+    """
+
+    def __init__(self, collection, fernet: Fernet, keep_versions: int = 50, compact_every: int = 10):
+        self.collection = collection
+        self.fernet = fernet
+        self.keep_versions = keep_versions
+        self.compact_every = compact_every
+        self._compactions: set = set()
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index([('item_id', 1), ('version', DESCENDING)], unique=True)
+
+    def _seal(self, values: Dict[str, Any]) -> str:
+        return self.fernet.encrypt(json.dumps(values, separators=(',', ':'), default=str).encode()).decode()
+
+    def _open(self, token: str) -> Dict[str, Any]:
+        return json.loads(self.fernet.decrypt(token.encode()))
+
+    @staticmethod
+    def delta(before: dict, changes: dict) -> Dict[str, Any]:
+        """Previous values of the fields an update actually changes"""
+        return {
+            field: before.get(field)
+            for field, value in changes.items()
+            if field not in UNTRACKED_FIELDS and before.get(field) != value
+        }
+
+    def _entry(self, before: dict, changes: dict, version: int, user_id: str) -> Optional[dict]:
+        previous = self.delta(before, changes)
+        if not previous:
+            return None
+        return {
+            'item_id': before['id'],
+            'version': version,
+            'changed_at': datetime.now(timezone.utc),
+            'changed_by': user_id,
+            'fields': sorted(previous),
+            'delta': self._seal(previous),
+            'compacted_from': None
+        }
+
+    def _maybe_compact(self, item_id: str, version: int) -> None:
+        if version > self.keep_versions and version % self.compact_every == 0:
+            task = asyncio.create_task(self.compact(item_id))
+            self._compactions.add(task)
+            task.add_done_callback(self._compactions.discard)
+
+    async def record(self, before: dict, changes: dict, version: int, user_id: str) -> Optional[dict]:
+        """Store the change that produced `version` of an item"""
+        entry = self._entry(before, changes, version, user_id)
+        if entry is None:
+            return None
+        await self.collection.insert_one(dict(entry))
+        self._maybe_compact(before['id'], version)
+        return entry
+
+    async def record_many(self, updates: List[Tuple[dict, dict, int]], user_id: str) -> int:
+        """Store (before, changes, version) changes of many items with one insert; returns entries written"""
+        entries = [entry for entry in (self._entry(*update, user_id) for update in updates) if entry]
+        if not entries:
+            return 0
+        await self.collection.insert_many(entries, ordered=False)
+        for entry in entries:
+            self._maybe_compact(entry['item_id'], entry['version'])
+        return len(entries)
+
+    def _public(self, entry: dict) -> dict:
+        previous = self._open(entry['delta'])
+        return {
+            'version': entry['version'],
+            'changed_at': entry['changed_at'],
+            'changed_by': entry['changed_by'],
+            'fields': entry['fields'],
+            'compacted_from': entry.get('compacted_from'),
+            'previous': {k: v for k, v in previous.items() if k not in SECRET_FIELDS}
+        }
+
+    async def list(self, item_id: str, limit: int = 20, before_version: Optional[int] = None) -> List[dict]:
+        """History entries newest first, paginated by version"""
+        query: Dict[str, Any] = {'item_id': item_id}
+        if before_version is not None:
+            query['version'] = {'$lt': before_version}
+        entries = await self.collection.find(query, {'_id': 0}).sort('version', DESCENDING).limit(limit).to_list(limit)
+        return [self._public(entry) for entry in entries]
+
+    async def previous_values(self, item_id: str, version: int) -> Optional[Dict[str, Any]]:
+        """All previous values (secrets included, still encrypted with the item key) of one entry"""
+        entry = await self.collection.find_one({'item_id': item_id, 'version': version}, {'_id': 0, 'delta': 1})
+        return self._open(entry['delta']) if entry else None
+
+    async def compact(self, item_id: str) -> int:
+        """Fold entries older than the newest `keep_versions` into one; returns entries removed"""
+        try:
+            newest = await self.collection.find_one({'item_id': item_id}, {'_id': 0, 'version': 1}, sort=[('version', DESCENDING)])
+            if not newest:
+                return 0
+            cutoff = newest['version'] - self.keep_versions
+            old = await self.collection.find(
+                {'item_id': item_id, 'version': {'$lte': cutoff}}, {'_id': 0}
+            ).sort('version', 1).to_list(None)
+            if len(old) < 2:
+                return 0
+
+            # Oldest value wins: the folded entry describes the item before the first folded change
+            merged: Dict[str, Any] = {}
+            for entry in old:
+                for field, value in self._open(entry['delta']).items():
+                    merged.setdefault(field, value)
+
+            last = old[-1]
+            folded = {
+                **last,
+                'fields': sorted(merged),
+                'delta': self._seal(merged),
+                'compacted_from': old[0].get('compacted_from') or old[0]['version']
+            }
+            # Replace first, then delete: a crash in between leaves entries that fold again identically
+            await self.collection.replace_one({'item_id': item_id, 'version': last['version']}, folded)
+            result = await self.collection.delete_many({'item_id': item_id, 'version': {'$lt': last['version']}})
+            return result.deleted_count
+        except PyMongoError as e:
+            logger.error(f"Error compacting history of item {item_id}: {str(e)}")
+            return 0
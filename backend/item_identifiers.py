@@ -0,0 +1,93 @@
+import logging
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Characters people type inconsistently in platform ids (123-456-7890, GTM-ABC 123)
+SEPARATORS = str.maketrans('', '', ' -')
+
+
+def normalize(value: Any) -> Optional[str]:
+    """Canonical form of an identifier, so lookups match however it was typed"""
+    if isinstance(value, bool) or not isinstance(value, (str, int)):
+        return None
+    normalized = str(value).translate(SEPARATORS).lower()
+    return normalized or None
+
+
+class IdentifierIndex:
+    """Platform identifiers of items (pixel, ad account, MCC...), kept queryable.
+
+    Each item stores the identifier fields its type's template declares as
+    an `identifiers` array of {field, value} pairs with normalized values,
+    next to the free-form metadata they come from. A multikey index on
+    (identifiers.field, identifiers.value) turns "which items carry pixel X"
+    into an index seek. Secrets in metadata (api keys, app secrets) are
+    never declared as identifiers, so they stay out of the index.
+    """
+
+    def __init__(self, collection, fields_by_type: Mapping[str, Sequence[str]], batch_size: int = 1000):
+        self.collection = collection
+        self.fields_by_type = fields_by_type
+        self.batch_size = batch_size
+
+    @property
+    def fields(self) -> List[str]:
+        """Every field name some item type declares as an identifier"""
+        return sorted({field for fields in self.fields_by_type.values() for field in fields})
+
+    def extract(self, item_type: str, metadata: Optional[Mapping[str, Any]]) -> List[Dict[str, str]]:
+        """Identifier entries of an item of this type with this metadata"""
+        identifiers = []
+        for field in self.fields_by_type.get(item_type, ()):
+            value = normalize((metadata or {}).get(field))
+            if value is not None:
+                identifiers.append({'field': field, 'value': value})
+        return identifiers
+
+    def expression(self, metadata: Optional[Mapping[str, Any]]) -> dict:
+        """Aggregation expression for the identifiers of an item given this metadata, by its stored `type`"""
+        branches = [
+            {'case': {'$eq': ['$type', item_type]}, 'then': {'$literal': self.extract(item_type, metadata)}}
+            for item_type in self.fields_by_type
+        ]
+        return {'$switch': {'branches': branches, 'default': []}} if branches else {'$literal': []}
+
+    @staticmethod
+    def match(field: str, value: Any) -> dict:
+        """Items query for one identifier, answered from the multikey index"""
+        return {'identifiers': {'$elemMatch': {'field': field, 'value': normalize(value)}}}
+
+    async def reindex(self, missing_only: bool = False) -> Dict[str, int]:
+        """Recompute stored identifiers, e.g. for items written before a template change"""
+        query = {'identifiers': {'$exists': False}} if missing_only else {}
+        scanned = updated = 0
+        batch: List[UpdateOne] = []
+        cursor = self.collection.find(query, {'_id': 1, 'type': 1, 'metadata': 1, 'identifiers': 1, 'version': 1})
+        async for item in cursor.batch_size(self.batch_size):
+            scanned += 1
+            identifiers = self.extract(item.get('type'), item.get('metadata'))
+            if item.get('identifiers') == identifiers:
+                continue
+            # Conditional on the version read, so a concurrent edit's identifiers are never overwritten
+            batch.append(UpdateOne(
+                {'_id': item['_id'], 'version': item.get('version')},
+                {'$set': {'identifiers': identifiers}}
+            ))
+            if len(batch) >= self.batch_size:
+                updated += (await self.collection.bulk_write(batch, ordered=False)).modified_count
+                batch = []
+        if batch:
+            updated += (await self.collection.bulk_write(batch, ordered=False)).modified_count
+        logger.info(f"Reindexed item identifiers: {updated} of {scanned} item(s) changed")
+        return {'scanned': scanned, 'updated': updated}
+
+    async def backfill(self) -> None:
+        """Index the items stored before they carried identifiers"""
+        try:
+            await self.reindex(missing_only=True)
+        except PyMongoError as e:
+            logger.error(f"Error backfilling item identifiers: {str(e)}")
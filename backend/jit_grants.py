@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ReplaceOne
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+
+def _aware(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class JITGrantCache:
+    """In-memory index of active JIT grants, keyed by (user_id, item_id).
+
+    Grants live in their own collection (`_id` is the JIT request id) with a
+    TTL index on `expires_at`. Other workers' grants arrive through a change
+    stream; deployments without one (standalone mongod) fall back to polling.
+    """
+
+    def __init__(self, collection, refresh_seconds: int = 30):
+        self.collection = collection
+        self.refresh_seconds = refresh_seconds
+        self._grants: Dict[Tuple[str, str], dict] = {}
+        self._keys_by_id: Dict[str, Tuple[str, str]] = {}
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index([('user_id', 1), ('item_id', 1), ('expires_at', 1)])
+        await self.collection.create_index('expires_at', expireAfterSeconds=0)
+        await self.collection.create_index('item_id')
+
+    async def grant(self, request_id: str, user_id: str, item_id: str, vault_id: str, expires_at: datetime) -> None:
+        """Persist an approved grant and make it visible locally right away"""
+        grant = {
+            '_id': request_id,
+            'user_id': user_id,
+            'item_id': item_id,
+            'vault_id': vault_id,
+            'expires_at': expires_at
+        }
+        await self.collection.replace_one({'_id': request_id}, grant, upsert=True)
+        self.add(grant)
+
+    async def grant_many(self, grants: List[dict]) -> None:
+        """Persist several grants in one bulk write"""
+        if not grants:
+            return
+        await self.collection.bulk_write(
+            [ReplaceOne({'_id': grant['_id']}, grant, upsert=True) for grant in grants],
+            ordered=False
+        )
+        for grant in grants:
+            self.add(grant)
+
+    def add(self, grant: dict) -> None:
+        key = (grant['user_id'], grant['item_id'])
+        grant = {**grant, 'expires_at': _aware(grant['expires_at'])}
+        current = self._grants.get(key)
+        if current is None or current['expires_at'] < grant['expires_at']:
+            if current is not None:
+                self._keys_by_id.pop(current['_id'], None)
+            self._grants[key] = grant
+            self._keys_by_id[grant['_id']] = key
+
+    def discard(self, request_id: str) -> None:
+        key = self._keys_by_id.pop(request_id, None)
+        if key is not None:
+            self._grants.pop(key, None)
+
+    def lookup(self, user_id: str, item_id: str) -> Optional[dict]:
+        """Return the active grant for a user/item pair, if any (no database access)"""
+        grant = self._grants.get((user_id, item_id))
+        if grant is None:
+            return None
+        if grant['expires_at'] <= datetime.now(timezone.utc):
+            self.discard(grant['_id'])
+            return None
+        return grant
+
+    def prune(self) -> int:
+        """Drop lapsed grants from memory"""
+        now = datetime.now(timezone.utc)
+        lapsed = [grant['_id'] for grant in self._grants.values() if grant['expires_at'] <= now]
+        for request_id in lapsed:
+            self.discard(request_id)
+        return len(lapsed)
+
+    async def load(self) -> None:
+        """Replace the in-memory index with the active grants in the database"""
+        grants = await self.collection.find({'expires_at': {'$gt': datetime.now(timezone.utc)}}).to_list(None)
+        self._grants.clear()
+        self._keys_by_id.clear()
+        for grant in grants:
+            self.add(grant)
+
+    async def watch(self) -> None:
+        """Follow grant changes made by other workers until cancelled"""
+        while True:
+            try:
+                async with self.collection.watch(full_document='updateLookup') as stream:
+                    await self.load()
+                    async for change in stream:
+                        if change['operationType'] in ('insert', 'replace', 'update') and change.get('fullDocument'):
+                            self.add(change['fullDocument'])
+                        elif change['operationType'] == 'delete':
+                            self.discard(change['documentKey']['_id'])
+            except OperationFailure as e:
+                logger.info(f"JIT grant change stream unavailable ({e.code}), polling every {self.refresh_seconds}s")
+                await self._poll()
+            except PyMongoError as e:
+                logger.error(f"JIT grant change stream interrupted: {str(e)}")
+                await asyncio.sleep(self.refresh_seconds)
+
+    async def _poll(self) -> None:
+        while True:
+            try:
+                await self.load()
+            except PyMongoError as e:
+                logger.error(f"Error refreshing JIT grants: {str(e)}")
+            await asyncio.sleep(self.refresh_seconds)
@@ -0,0 +1,192 @@
+import bisect
+import contextvars
+import threading
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+class Histogram:
+    """Cumulative-bucket histogram, as in the Prometheus exposition format"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Thread-safe store of labelled counters, gauges and histograms"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._counters: Dict[str, Dict[tuple, float]] = {}
+        self._histograms: Dict[str, Dict[tuple, Histogram]] = {}
+        self._bucket_defs: Dict[str, Sequence[float]] = {}
+
+    def counter(self, name: str, help_text: str) -> None:
+        self._help[name] = ('counter', help_text)
+        self._counters.setdefault(name, {})
+
+    def gauge(self, name: str, help_text: str) -> None:
+        self._help[name] = ('gauge', help_text)
+        self._counters.setdefault(name, {})
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self._help[name] = ('histogram', help_text)
+        self._histograms.setdefault(name, {})
+        self._bucket_defs[name] = buckets
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._counters[name][key] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms[name]
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = Histogram(self._bucket_defs[name])
+            hist.observe(value)
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in self._help.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind in ('counter', 'gauge'):
+                    for labels, value in self._counters[name].items():
+                        lines.append(f"{name}{_format_labels(labels)} {value}")
+                    continue
+                for labels, hist in self._histograms[name].items():
+                    cumulative = 0
+                    for bound, count in zip(hist.buckets, hist.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labels, ('le', repr(float(bound))))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {hist.count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {hist.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+registry.histogram('http_request_duration_seconds', 'HTTP request latency by route')
+registry.histogram('http_request_db_queries', 'MongoDB commands issued per HTTP request', QUERY_COUNT_BUCKETS)
+registry.histogram('http_request_db_seconds', 'Time spent in MongoDB commands per HTTP request')
+registry.histogram('mongodb_command_duration_seconds', 'MongoDB command latency by command')
+registry.counter('mongodb_command_failures_total', 'Failed MongoDB commands by command')
+
+
+class RequestStats:
+    """MongoDB activity attributed to the request being served"""
+
+    def __init__(self, scope: Optional[dict] = None):
+        self._lock = threading.Lock()
+        self.scope = scope or {}
+        self.db_queries = 0
+        self.db_seconds = 0.0
+
+    @property
+    def route(self) -> str:
+        """Route template once routing has happened, e.g. /api/items/{item_id}"""
+        return getattr(self.scope.get('route'), 'path', None) or 'unmatched'
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.db_queries += 1
+            self.db_seconds += seconds
+
+
+# Motor runs commands on executor threads with a copy of the caller's context,
+# so the listener sees the stats object of the request that issued the command.
+current_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar('current_request_stats', default=None)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Counts MongoDB round trips and their latency, globally and per request"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._finish(event.command_name, event.duration_micros / 1e6)
+
+    def failed(self, event):
+        registry.inc('mongodb_command_failures_total', command=event.command_name)
+        self._finish(event.command_name, event.duration_micros / 1e6)
+
+    def _finish(self, command: str, seconds: float) -> None:
+        registry.observe('mongodb_command_duration_seconds', seconds, command=command)
+        stats = current_request_stats.get()
+        if stats is not None:
+            stats.record(seconds)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency and adding a Server-Timing header"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = current_request_stats.set(stats)
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                timing = (
+                    f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.db_queries} queries", '
+                    f'app;dur={elapsed_ms:.1f}'
+                )
+                message['headers'] = list(message.get('headers', [])) + [(b'server-timing', timing.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_request_stats.reset(token)
+            labels = {'method': scope['method'], 'route': stats.route}
+            registry.observe('http_request_duration_seconds', time.perf_counter() - start, status=str(status_code), **labels)
+            registry.observe('http_request_db_queries', stats.db_queries, **labels)
+            registry.observe('http_request_db_seconds', stats.db_seconds, **labels)
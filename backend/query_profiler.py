@@ -0,0 +1,173 @@
+import asyncio
+import json
+import logging
+import random
+import threading
+from typing import Any, Dict, List, Optional
+
+from pymongo import monitoring
+from pymongo.errors import PyMongoError
+
+from metrics import current_request_stats
+
+logger = logging.getLogger(__name__)
+
+EXPLAINABLE_COMMANDS = {'find', 'aggregate', 'count', 'distinct', 'update', 'delete', 'findAndModify'}
+
+# Driver/session fields that must not be sent back inside `explain`
+SESSION_FIELDS = {'lsid', '$db', '$clusterTime', '$readPreference', 'txnNumber', 'signature',
+                  'readConcern', 'writeConcern', 'autocommit', 'startTransaction', 'apiVersion'}
+
+
+def query_shape(value: Any) -> Any:
+    """Replace literal values with placeholders so queries differing only in values compare equal"""
+    if isinstance(value, dict):
+        return {k: query_shape(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [query_shape(value[0])] if value else []
+    return '?'
+
+
+def _command_shape(command_name: str, command: dict) -> str:
+    keys = {k: command.get(k) for k in ('filter', 'query', 'pipeline', 'sort', 'updates', 'deletes') if k in command}
+    return json.dumps([command_name, command.get(command_name), query_shape(keys)], sort_keys=True, default=str)
+
+
+def _plan_stages(plan: Any) -> List[str]:
+    if not isinstance(plan, dict):
+        return []
+    stages = [plan['stage']] if 'stage' in plan else []
+    for key in ('inputStage', 'queryPlan'):
+        stages += _plan_stages(plan.get(key))
+    for child in plan.get('inputStages', []):
+        stages += _plan_stages(child)
+    return stages
+
+
+def _find_key(doc: Any, key: str) -> Optional[Any]:
+    """First value of `key` anywhere in a nested explain document"""
+    if isinstance(doc, dict):
+        if key in doc:
+            return doc[key]
+        values = doc.values()
+    elif isinstance(doc, list):
+        values = doc
+    else:
+        return None
+    for value in values:
+        found = _find_key(value, key)
+        if found is not None:
+            return found
+    return None
+
+
+class QueryProfiler(monitoring.CommandListener):
+    """Development-mode profiler: samples queries per route and explains each distinct shape.
+
+    Commands are captured from the driver's command monitoring events, then
+    explained in the background with executionStats. A query is flagged when
+    its winning plan contains a COLLSCAN or it examines many more documents
+    than it returns.
+    """
+
+    def __init__(self, sample_rate: float = 1.0, max_examined_ratio: float = 10.0, min_docs_examined: int = 100):
+        self.sample_rate = sample_rate
+        self.max_examined_ratio = max_examined_ratio
+        self.min_docs_examined = min_docs_examined
+        self.db = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._lock = threading.Lock()
+        self._seen: set = set()
+        self._results: Dict[str, List[dict]] = {}
+
+    # -- command monitoring (runs on driver threads) --
+
+    def started(self, event):
+        if event.command_name not in EXPLAINABLE_COMMANDS or self._queue is None:
+            return
+        stats = current_request_stats.get()
+        route = stats.route if stats is not None else 'background'
+        command = {k: v for k, v in event.command.items() if k not in SESSION_FIELDS}
+        shape = _command_shape(event.command_name, command)
+
+        with self._lock:
+            if (route, shape) in self._seen or random.random() >= self.sample_rate:
+                return
+            self._seen.add((route, shape))
+
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (route, event.database_name, event.command_name, command, shape))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    # -- explain worker --
+
+    async def run(self, db) -> None:
+        """Explain sampled queries until cancelled"""
+        self.db = db
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        while True:
+            route, database, command_name, command, shape = await self._queue.get()
+            try:
+                await self._explain(route, database, command_name, command, shape)
+            except PyMongoError as e:
+                logger.warning(f"Could not explain {command_name} on {command.get(command_name)}: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    async def drain(self) -> None:
+        """Wait until every sampled query has been explained"""
+        if self._queue is not None:
+            # Let commands handed over from driver threads reach the queue
+            await asyncio.sleep(0)
+            await self._queue.join()
+
+    async def _explain(self, route: str, database: str, command_name: str, command: dict, shape: str) -> None:
+        explain = await self.db.client[database].command({'explain': command, 'verbosity': 'executionStats'})
+
+        stages = _plan_stages(_find_key(explain, 'winningPlan') or {})
+        docs_examined = _find_key(explain, 'totalDocsExamined') or 0
+        keys_examined = _find_key(explain, 'totalKeysExamined') or 0
+        n_returned = _find_key(explain, 'nReturned') or 0
+        ratio = docs_examined / max(n_returned, 1)
+
+        flags = []
+        if 'COLLSCAN' in stages:
+            flags.append('COLLSCAN')
+        if docs_examined >= self.min_docs_examined and ratio > self.max_examined_ratio:
+            flags.append('HIGH_EXAMINED_RATIO')
+
+        entry = {
+            'collection': command.get(command_name),
+            'command': command_name,
+            'shape': json.loads(shape)[2],
+            'stages': stages,
+            'docs_examined': docs_examined,
+            'keys_examined': keys_examined,
+            'n_returned': n_returned,
+            'examined_ratio': round(ratio, 2),
+            'flags': flags
+        }
+        with self._lock:
+            self._results.setdefault(route, []).append(entry)
+        if flags:
+            logger.warning(f"Slow query shape on {route}: {command_name} {entry['collection']} {', '.join(flags)}")
+
+    # -- reporting --
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            routes = {route: list(entries) for route, entries in sorted(self._results.items())}
+        flagged = sum(1 for entries in routes.values() for e in entries if e['flags'])
+        return {'flagged': flagged, 'routes': routes}
+
+    def write_report(self, path: str) -> Dict[str, Any]:
+        report = self.report()
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        return report
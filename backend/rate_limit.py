@@ -0,0 +1,111 @@
+import math
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+
+
+@dataclass(frozen=True)
+class RateLimitPolicy:
+    """Token bucket policy: `capacity` requests, fully refilled every `per_seconds`"""
+    capacity: int
+    per_seconds: float
+
+    @property
+    def refill_rate(self) -> float:
+        return self.capacity / self.per_seconds
+
+
+class RateLimitBackend(ABC):
+    """Storage for rate limit state. `hit` returns 0 when allowed, else seconds to wait"""
+
+    @abstractmethod
+    async def hit(self, key: str, policy: RateLimitPolicy, cost: int = 1) -> float:
+        ...
+
+    async def ensure_indexes(self) -> None:
+        pass
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """Per-process token buckets. Used for single-worker deployments and tests"""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+
+    async def hit(self, key: str, policy: RateLimitPolicy, cost: int = 1) -> float:
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [float(policy.capacity), now]
+            self._buckets[key] = bucket
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+
+        tokens, last = bucket
+        tokens = min(policy.capacity, tokens + (now - last) * policy.refill_rate)
+        bucket[1] = now
+
+        if tokens >= cost:
+            bucket[0] = tokens - cost
+            return 0.0
+
+        bucket[0] = tokens
+        return (cost - tokens) / policy.refill_rate
+
+
+class MongoRateLimitBackend(RateLimitBackend):
+    """Shared fixed-window counters in MongoDB, for multi-worker deployments.
+
+    Each window lasts `per_seconds` and admits `capacity` hits; old windows
+    are removed by a TTL index on `expires_at`.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index('expires_at', expireAfterSeconds=0)
+
+    async def hit(self, key: str, policy: RateLimitPolicy, cost: int = 1) -> float:
+        now = time.time()
+        window = int(now // policy.per_seconds)
+        window_end = (window + 1) * policy.per_seconds
+
+        doc = await self.collection.find_one_and_update(
+            {'_id': f"{key}:{window}"},
+            {
+                '$inc': {'count': cost},
+                '$setOnInsert': {
+                    'expires_at': datetime.fromtimestamp(window_end, timezone.utc) + timedelta(seconds=policy.per_seconds)
+                }
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if doc['count'] <= policy.capacity:
+            return 0.0
+        return window_end - now
+
+
+class RateLimiter:
+    """Applies rate limit policies against a backend and raises 429 when exceeded"""
+
+    def __init__(self, backend: RateLimitBackend):
+        self.backend = backend
+
+    async def check(self, key: str, policy: RateLimitPolicy, cost: int = 1) -> None:
+        retry_after = await self.backend.hit(key, policy, cost)
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests",
+                headers={'Retry-After': str(max(1, math.ceil(retry_after)))}
+            )
@@ -1,32 +1,75 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, status
-from fastapi.responses import RedirectResponse, JSONResponse
+from fastapi.responses import RedirectResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
 from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, timedelta, timezone
 from pathlib import Path
 import os
 import logging
 import uuid
 import jwt
 import hashlib
+import hmac
 import base64
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 import httpx
 import json
+import asyncio
+from urllib.parse import quote
+
+from attachment_store import AttachmentError, AttachmentStore, AttachmentTooLarge, MultipartFile, RangeNotSatisfiable, parse_range
+from audit_analytics import AuditRollups
+from audit_chain import AuditChain, AuditVerifier
+from audit_store import AuditStore
+from breach_check import open_corpus
+from cache import TTLCache
+from credential_hygiene import CredentialHygiene, fingerprint_key
+import database
+from database import DatabaseSettings, delete_returning, get_collection, update_returning
+import google_auth
+from google_auth import GoogleOAuth, JWKSCache
+from item_history import ItemHistory
+from item_identifiers import IdentifierIndex
+from jit_grants import JITGrantCache
+from metrics import MetricsMiddleware, MongoCommandListener, registry as metrics_registry
+from query_profiler import QueryProfiler
+from rate_limit import RateLimiter, RateLimitPolicy, InMemoryRateLimitBackend, MongoRateLimitBackend
+from share_links import ShareLinkCache
+from sheet_sync import SheetSync
+import tag_index
+from tag_index import tag_filter, tag_pairs
+from token_revocation import TokenRevocationList
+import vault_archive
+from vault_purge import VaultPurger, new_purge_job
+from vault_rollups import VaultRollups, tree_rollups
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Development query profiler: explains sampled queries and flags COLLSCANs
+QUERY_PROFILER_ENABLED = os.environ.get('QUERY_PROFILER', '').lower() in ('1', 'true', 'yes')
+QUERY_PROFILER_REPORT = os.environ.get('QUERY_PROFILER_REPORT', 'query_profile.json')
+query_profiler = QueryProfiler(
+    sample_rate=float(os.environ.get('QUERY_PROFILER_SAMPLE_RATE', '1.0')),
+    max_examined_ratio=float(os.environ.get('QUERY_PROFILER_MAX_EXAMINED_RATIO', '10'))
+) if QUERY_PROFILER_ENABLED else None
+
+# Bearer token Prometheus must send to scrape /metrics; the endpoint is disabled when unset
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# MongoDB connection (pool sizing and timeouts from MONGO_* settings)
+db_settings = DatabaseSettings.from_env()
+client = database.create_client(
+    db_settings,
+    event_listeners=[MongoCommandListener()] + ([query_profiler] if query_profiler else [])
+)
+db = client[db_settings.db_name]
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -40,12 +83,27 @@ JWT_SECRET = os.environ.get('JWT_SECRET')
 if not JWT_SECRET:
     raise ValueError("JWT_SECRET environment variable must be set")
 JWT_ALGORITHM = 'HS256'
+JWT_TOKEN_TTL = timedelta(days=7)
+
+# Token revocation
+TOKEN_REVOCATION_REFRESH_SECONDS = int(os.environ.get('TOKEN_REVOCATION_REFRESH_SECONDS', '30'))
+TOKEN_REVOCATION_CAPACITY = int(os.environ.get('TOKEN_REVOCATION_CAPACITY', '100000'))
 
 # Google OAuth
 GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID', '')
 GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET', '')
 GOOGLE_REDIRECT_URI = os.environ.get('GOOGLE_REDIRECT_URI', '')
 ALLOWED_DOMAIN = os.environ.get('ALLOWED_DOMAIN', 'v4company.com')
+# Overridable to point logins at a local stand-in OAuth/JWKS server
+GOOGLE_AUTH_URL = os.environ.get('GOOGLE_AUTH_URL', 'https://accounts.google.com/o/oauth2/v2/auth')
+GOOGLE_TOKEN_URL = os.environ.get('GOOGLE_TOKEN_URL', google_auth.GOOGLE_TOKEN_URL)
+GOOGLE_JWKS_URL = os.environ.get('GOOGLE_JWKS_URL', google_auth.GOOGLE_JWKS_URL)
+GOOGLE_ISSUERS = os.environ['GOOGLE_ISSUERS'].split(',') if os.environ.get('GOOGLE_ISSUERS') else google_auth.GOOGLE_ISSUERS
+
+# Outbound HTTP (shared connection pool)
+HTTP_TIMEOUT_SECONDS = float(os.environ.get('HTTP_TIMEOUT_SECONDS', '10'))
+HTTP_MAX_CONNECTIONS = int(os.environ.get('HTTP_MAX_CONNECTIONS', '100'))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('HTTP_MAX_KEEPALIVE_CONNECTIONS', '20'))
 
 # Google Chat Webhook
 GOOGLE_CHAT_WEBHOOK = os.environ.get('GOOGLE_CHAT_WEBHOOK', '')
@@ -61,10 +119,195 @@ def get_fernet_key():
         salt=b'v4company-salt',
         iterations=100000,
     )
-    key = base64.urlsafe_b64encode(kdf.derive(ENCRYPTION_KEY.encode()))
-    return Fernet(key)
+    return base64.urlsafe_b64encode(kdf.derive(ENCRYPTION_KEY.encode()))
+
+FERNET_KEY = get_fernet_key()
+fernet = Fernet(FERNET_KEY)
+
+# Public endpoint rate limiting
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # memory, mongo
+PUBLIC_IP_RATE_LIMIT = RateLimitPolicy(
+    capacity=int(os.environ.get('PUBLIC_IP_RATE_LIMIT_PER_MINUTE', '60')),
+    per_seconds=60
+)
+PUBLIC_TOKEN_RATE_LIMIT = RateLimitPolicy(
+    capacity=int(os.environ.get('PUBLIC_TOKEN_RATE_LIMIT_PER_MINUTE', '20')),
+    per_seconds=60
+)
+# Proxies in front of the API (ingress, load balancer) whose X-Forwarded-For entries are trusted;
+# 0 uses the connecting address, which behind a proxy is the proxy's own
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '0'))
+TOKEN_PREFIX_LENGTH = 8
+INVALID_TOKEN_CACHE_TTL = int(os.environ.get('INVALID_TOKEN_CACHE_TTL_SECONDS', '300'))
+
+# Check-out leases
+CHECKOUT_LEASE_MINUTES = int(os.environ.get('CHECKOUT_LEASE_MINUTES', '60'))
+CHECKOUT_MAX_LEASE_MINUTES = int(os.environ.get('CHECKOUT_MAX_LEASE_MINUTES', '480'))
+
+# JIT grants
+BATCH_DECISION_MAX = int(os.environ.get('BATCH_DECISION_MAX', '200'))
+JIT_EXPIRY_INTERVAL_SECONDS = int(os.environ.get('JIT_EXPIRY_INTERVAL_SECONDS', '60'))
+JIT_GRANT_REFRESH_SECONDS = int(os.environ.get('JIT_GRANT_REFRESH_SECONDS', '30'))
+
+# Client share links
+SHARE_LINK_CACHE_TTL = int(os.environ.get('SHARE_LINK_CACHE_TTL_SECONDS', '60'))
+# Without a change stream (standalone mongod), how often each worker rechecks its cached links
+SHARE_LINK_REFRESH_SECONDS = int(os.environ.get('SHARE_LINK_REFRESH_SECONDS', '30'))
+CLIENT_SUBMIT_MAX_BATCH = int(os.environ.get('CLIENT_SUBMIT_MAX_BATCH', '100'))
+CLIENT_SUBMIT_ITEM_QUOTA = RateLimitPolicy(
+    capacity=int(os.environ.get('CLIENT_SUBMIT_ITEMS_PER_HOUR', '500')),
+    per_seconds=3600
+)
 
-fernet = get_fernet_key()
+# Vault deletion (soft delete, then background purge)
+VAULT_RESTORE_WINDOW_HOURS = int(os.environ.get('VAULT_RESTORE_WINDOW_HOURS', '24'))
+VAULT_PURGE_INTERVAL_SECONDS = int(os.environ.get('VAULT_PURGE_INTERVAL_SECONDS', '60'))
+VAULT_PURGE_BATCH_SIZE = int(os.environ.get('VAULT_PURGE_BATCH_SIZE', '500'))
+VAULT_PURGE_BATCH_DELAY_SECONDS = float(os.environ.get('VAULT_PURGE_BATCH_DELAY_SECONDS', '0.2'))
+VAULT_ARCHIVE_CHUNK_SIZE = int(os.environ.get('VAULT_ARCHIVE_CHUNK_SIZE', '1000'))
+TOMBSTONE_CACHE_TTL = int(os.environ.get('TOMBSTONE_CACHE_TTL_SECONDS', '5'))
+VAULT_ROLLUP_RECONCILE_INTERVAL_SECONDS = int(os.environ.get('VAULT_ROLLUP_RECONCILE_INTERVAL_SECONDS', '3600'))
+
+# Item version history
+ITEM_HISTORY_KEEP_VERSIONS = int(os.environ.get('ITEM_HISTORY_KEEP_VERSIONS', '50'))
+ITEM_HISTORY_COMPACT_EVERY = int(os.environ.get('ITEM_HISTORY_COMPACT_EVERY', '10'))
+ITEM_HISTORY_PAGE_MAX = 100
+
+# Platform identifier index over item metadata
+ITEM_IDENTIFIER_BATCH_SIZE = int(os.environ.get('ITEM_IDENTIFIER_BATCH_SIZE', '1000'))
+ITEM_LOOKUP_MAX = 500
+
+# Facet counts in the vault explorer
+ITEM_FACET_TAG_LIMIT = int(os.environ.get('ITEM_FACET_TAG_LIMIT', '50'))
+
+# Item attachments: encrypted segments in GridFS, deduplicated by content
+ATTACHMENT_MAX_SIZE = int(os.environ.get('ATTACHMENT_MAX_SIZE_MB', '100')) * 1024 * 1024
+ATTACHMENT_SEGMENT_SIZE = int(os.environ.get('ATTACHMENT_SEGMENT_SIZE_KB', '256')) * 1024
+ATTACHMENT_MAX_PER_ITEM = int(os.environ.get('ATTACHMENT_MAX_PER_ITEM', '20'))
+ATTACHMENT_SWEEP_INTERVAL_SECONDS = int(os.environ.get('ATTACHMENT_SWEEP_INTERVAL_SECONDS', '3600'))
+ATTACHMENT_SWEEP_GRACE_SECONDS = int(os.environ.get('ATTACHMENT_SWEEP_GRACE_SECONDS', '3600'))
+
+# Sheet imports in sync mode
+IMPORT_SYNC_REPORT_MAX = int(os.environ.get('IMPORT_SYNC_REPORT_MAX', '1000'))
+
+# Password fingerprints (reuse detection); the key defaults to one derived from ENCRYPTION_KEY
+PASSWORD_FINGERPRINT_KEY = os.environ.get('PASSWORD_FINGERPRINT_KEY', ENCRYPTION_KEY)
+HYGIENE_BACKFILL_BATCH_SIZE = int(os.environ.get('HYGIENE_BACKFILL_BATCH_SIZE', '500'))
+HYGIENE_BACKFILL_WORKERS = int(os.environ.get('HYGIENE_BACKFILL_WORKERS', '4'))
+
+# Breached-password corpus: sorted 20-byte SHA-1 records (see breach_check.py); checks are off without it.
+# Update it by renaming a new file over the path (never by rewriting it in place), then start a rescan
+BREACH_CORPUS_PATH = os.environ.get('BREACH_CORPUS_PATH', '')
+BREACH_RELOAD_SECONDS = int(os.environ.get('BREACH_RELOAD_SECONDS', '60'))
+BREACH_RESCAN_WORKERS = int(os.environ.get('BREACH_RESCAN_WORKERS', str(os.cpu_count() or 2)))
+
+# Audit log partitions and cold storage
+AUDIT_ARCHIVE_DIR = os.environ.get('AUDIT_ARCHIVE_DIR', str(ROOT_DIR / 'audit_archive'))
+AUDIT_HOT_MONTHS = int(os.environ.get('AUDIT_HOT_MONTHS', '12'))
+AUDIT_ARCHIVE_INTERVAL_SECONDS = int(os.environ.get('AUDIT_ARCHIVE_INTERVAL_SECONDS', '21600'))
+
+# Audit hash chain
+AUDIT_CHAIN_MAX_BATCH = int(os.environ.get('AUDIT_CHAIN_MAX_BATCH', '500'))
+AUDIT_CHECKPOINT_SIZE = int(os.environ.get('AUDIT_CHECKPOINT_SIZE', '10000'))
+
+# Audit analytics
+AUDIT_ANALYTICS_DEFAULT_DAYS = int(os.environ.get('AUDIT_ANALYTICS_DEFAULT_DAYS', '30'))
+AUDIT_ANALYTICS_MAX_DAYS = int(os.environ.get('AUDIT_ANALYTICS_MAX_DAYS', '731'))
+AUDIT_ANOMALY_DAILY_REVEALS = int(os.environ.get('AUDIT_ANOMALY_DAILY_REVEALS', '50'))
+
+if RATE_LIMIT_BACKEND == 'mongo':
+    rate_limit_backend = MongoRateLimitBackend(db.rate_limits)
+else:
+    rate_limit_backend = InMemoryRateLimitBackend()
+public_rate_limiter = RateLimiter(rate_limit_backend)
+
+# Tokens recently looked up and not found, so repeated probes never reach MongoDB
+invalid_token_cache = TTLCache(maxsize=50000, ttl=INVALID_TOKEN_CACHE_TTL)
+
+# Share token -> vault summary, so client submissions skip the vault lookup; dropped on every worker when a link changes
+share_link_cache = ShareLinkCache(db.vaults, ttl=SHARE_LINK_CACHE_TTL, refresh_seconds=SHARE_LINK_REFRESH_SECONDS)
+
+# Active JIT grants, answered from memory
+jit_grants = JITGrantCache(db.jit_grants, refresh_seconds=JIT_GRANT_REFRESH_SECONDS)
+
+# One pooled client for outbound calls, so logins reuse warm TLS connections
+http_client = httpx.AsyncClient(
+    timeout=HTTP_TIMEOUT_SECONDS,
+    limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS)
+)
+
+# Google login: code exchange, then local id_token verification against cached signing keys
+google_jwks = JWKSCache(http_client, GOOGLE_JWKS_URL)
+google_oauth = GoogleOAuth(
+    http_client,
+    google_jwks,
+    GOOGLE_CLIENT_ID,
+    GOOGLE_CLIENT_SECRET,
+    GOOGLE_REDIRECT_URI,
+    token_url=GOOGLE_TOKEN_URL,
+    issuers=GOOGLE_ISSUERS
+)
+
+# Revoked JWTs (logout, deactivated users), answered from memory
+token_revocations = TokenRevocationList(
+    db.revoked_tokens,
+    refresh_seconds=TOKEN_REVOCATION_REFRESH_SECONDS,
+    capacity=TOKEN_REVOCATION_CAPACITY
+)
+
+# Ids of soft-deleted vaults, so item queries can hide their items without a lookup each
+tombstone_cache = TTLCache(maxsize=1, ttl=TOMBSTONE_CACHE_TTL)
+vault_purger = VaultPurger(db, batch_size=VAULT_PURGE_BATCH_SIZE, batch_delay=VAULT_PURGE_BATCH_DELAY_SECONDS)
+
+# Item counters on each vault document, returned with the vault tree
+vault_rollups = VaultRollups(db)
+
+# Audit events in monthly collections; months past the hot window go to zstd NDJSON files
+audit_store = AuditStore(db, AUDIT_ARCHIVE_DIR, hot_months=AUDIT_HOT_MONTHS)
+
+# Daily audit counters behind the analytics endpoints
+audit_rollups = AuditRollups(db.audit_rollups)
+
+# Every audit write goes through the hash chain, batched across concurrent requests
+audit_chain = AuditChain(db, audit_store, max_batch=AUDIT_CHAIN_MAX_BATCH, on_write=audit_rollups.apply)
+audit_verifier = AuditVerifier(db, audit_store, checkpoint_size=AUDIT_CHECKPOINT_SIZE)
+
+# Keyed password fingerprints and weaknesses (including breached passwords), stored with each item
+credential_hygiene = CredentialHygiene(
+    db,
+    FERNET_KEY,
+    fingerprint_key(PASSWORD_FINGERPRINT_KEY),
+    breaches=open_corpus(BREACH_CORPUS_PATH),
+    batch_size=HYGIENE_BACKFILL_BATCH_SIZE,
+    workers=HYGIENE_BACKFILL_WORKERS,
+    breach_workers=BREACH_RESCAN_WORKERS,
+    breach_reload_seconds=BREACH_RELOAD_SECONDS
+)
+
+# Attachment files; items keep only references to them
+attachment_store = AttachmentStore(
+    db,
+    ENCRYPTION_KEY,
+    segment_size=ATTACHMENT_SEGMENT_SIZE,
+    max_size=ATTACHMENT_MAX_SIZE,
+    grace_seconds=ATTACHMENT_SWEEP_GRACE_SECONDS
+)
+
+# Previous values of updated items, as encrypted per-version deltas
+item_history = ItemHistory(
+    get_collection(db, 'item_history', 'secret_write'),
+    fernet,
+    keep_versions=ITEM_HISTORY_KEEP_VERSIONS,
+    compact_every=ITEM_HISTORY_COMPACT_EVERY
+)
+
+# Sync-mode sheet imports: rows matched to the items earlier imports created
+sheet_sync = SheetSync(db, fernet, credential_hygiene, item_history, vault_rollups, report_limit=IMPORT_SYNC_REPORT_MAX)
+
+# Long-running tasks started with the app
+background_tasks: List[asyncio.Task] = []
+# Fire-and-forget notifications still in flight
+pending_notifications: set = set()
 
 # Configure logging
 logging.basicConfig(
@@ -97,11 +340,21 @@ class Vault(BaseModel):
     owner_id: str
     acl: List[Dict[str, Any]] = []
     tags: Dict[str, str] = {}
+    # Same tags as [{key, value}], which the tag index serves
+    tag_pairs: List[Dict[str, str]] = []
     
     # Client access features
     client_share_token: Optional[str] = None  # Token for client access
     client_share_enabled: bool = False
     
+    # Soft delete: set until the purge job removes the vault for good
+    deleted_at: Optional[datetime] = None
+    deleted_by: Optional[str] = None
+    purge_job_id: Optional[str] = None
+    
+    # Counters of the items directly in the vault (maintained by vault_rollups)
+    item_counts: Dict[str, Any] = {}
+    
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -114,11 +367,15 @@ class Item(BaseModel):
     password_encrypted: Optional[str] = None
     login_url: Optional[str] = None
     metadata: Dict[str, Any] = {}
+    # Normalized platform ids from metadata, declared per type in ITEM_TEMPLATES
+    identifiers: List[Dict[str, str]] = []
     owner_id: str
     environment: str = "prod"  # prod, stage
     criticality: str = "medium"  # high, medium, low
     expires_at: Optional[datetime] = None
     tags: Dict[str, str] = {}
+    # Same tags as [{key, value}], which the tag index serves
+    tag_pairs: List[Dict[str, str]] = []
     attachments: List[Dict[str, Any]] = []
     notes_encrypted: Optional[str] = None
     login_instructions: Optional[str] = None
@@ -132,7 +389,12 @@ class Item(BaseModel):
     no_copy: bool = False  # Prevent copy/paste
     requires_checkout: bool = False  # Check-out/check-in flow
     checked_out_by: Optional[str] = None
+    checked_out_by_name: Optional[str] = None
     checked_out_at: Optional[datetime] = None
+    checkout_expires_at: Optional[datetime] = None
+    
+    # Bumped on every update; history entries are keyed by it
+    version: int = 1
     
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -177,6 +439,10 @@ class AuditLog(BaseModel):
     user_agent: Optional[str] = None
     details: Dict[str, Any] = {}
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    # Set by the audit hash chain when the entry is written
+    seq: Optional[int] = None
+    prev_hash: Optional[str] = None
+    hash: Optional[str] = None
 
 class JITRequest(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -200,6 +466,10 @@ class VaultCreate(BaseModel):
     parent_id: Optional[str] = None
     tags: Dict[str, str] = {}
 
+class VaultNode(Vault):
+    # {direct, subtree}: item totals by type and criticality, and expired/expiring counts
+    rollup: Dict[str, Any] = {}
+
 class ItemCreate(BaseModel):
     vault_id: str
     type: str  # web_credential, api_key, ad_token_google, ad_token_meta, ad_token_tiktok, ad_token_linkedin, social_login, ssh_key, db_credential, certificate, secure_note, attachment
@@ -252,6 +522,9 @@ class UpdateRoleRequest(BaseModel):
 class UpdateStatusRequest(BaseModel):
     status: str
 
+class BatchDecisionRequest(BaseModel):
+    request_ids: List[str]
+
 class OneTimeLinkRequest(BaseModel):
     expires_hours: int = 24
 
@@ -283,35 +556,66 @@ def decrypt_data(encrypted_data: str) -> str:
 
 def create_jwt_token(user_data: dict) -> str:
     """Create JWT token"""
+    now = datetime.now(timezone.utc)
     payload = {
         'user_id': user_data['id'],
         'email': user_data['email'],
         'role': user_data['role'],
-        'exp': datetime.now(timezone.utc) + timedelta(days=7)
+        'jti': uuid.uuid4().hex,
+        'iat': now,
+        'exp': now + JWT_TOKEN_TTL
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """Get current authenticated user from JWT token"""
+async def get_token_payload(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    """Decode the bearer token and reject revoked ones (checked in memory)"""
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user = await db.users.find_one({'id': payload['user_id']})
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
-        return User(**user)
+        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    if token_revocations.is_revoked(payload):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    return payload
+
+async def get_current_user(payload: dict = Depends(get_token_payload)):
+    """Get current authenticated user from JWT token"""
+    user = await db.users.find_one({'id': payload['user_id']})
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+    if user.get('status') == 'inactive':
+        raise HTTPException(status_code=401, detail="User is inactive")
+    return User(**user)
 
 async def get_client_ip(request: Request) -> str:
     """Get client IP address"""
-    return request.client.host if request.client else "unknown"
+    peer = request.client.host if request.client else "unknown"
+    if TRUSTED_PROXY_HOPS <= 0:
+        return peer
+    # Each trusted proxy appends the address it received from, so the client is that many entries from the end;
+    # anything further left was sent by the client and can be forged
+    forwarded = [hop.strip() for hop in request.headers.get('x-forwarded-for', '').split(',') if hop.strip()]
+    if len(forwarded) < TRUSTED_PROXY_HOPS:
+        return forwarded[0] if forwarded else peer
+    return forwarded[-TRUSTED_PROXY_HOPS]
+
+async def guard_public_token(request: Request, kind: str, token: str, not_found_detail: str):
+    """Rate limit a public token endpoint by client IP and token prefix, and reject known-invalid tokens"""
+    client_ip = await get_client_ip(request)
+    await public_rate_limiter.check(f"ip:{client_ip}", PUBLIC_IP_RATE_LIMIT)
+    await public_rate_limiter.check(f"{kind}:{token[:TOKEN_PREFIX_LENGTH]}", PUBLIC_TOKEN_RATE_LIMIT)
+    
+    if (kind, token) in invalid_token_cache:
+        raise HTTPException(status_code=404, detail=not_found_detail)
 
-async def log_audit(event_type: str, user: User, request: Request, item_id: Optional[str] = None, vault_id: Optional[str] = None, details: Dict = {}):
-    """Log audit event"""
-    log_entry = AuditLog(
+def remember_invalid_token(kind: str, token: str):
+    """Cache a failed token lookup"""
+    invalid_token_cache.set((kind, token), True)
+
+async def build_audit_entry(event_type: str, user: User, request: Request, item_id: Optional[str] = None, vault_id: Optional[str] = None, details: Dict = {}) -> AuditLog:
+    """Build an audit event for the current user and request"""
+    return AuditLog(
         event_type=event_type,
         user_id=user.id,
         user_email=user.email,
@@ -321,9 +625,20 @@ async def log_audit(event_type: str, user: User, request: Request, item_id: Opti
         user_agent=request.headers.get('user-agent', 'unknown'),
         details=details
     )
-    await db.audit_logs.insert_one(log_entry.dict())
+
+async def log_audit(event_type: str, user: User, request: Request, item_id: Optional[str] = None, vault_id: Optional[str] = None, details: Dict = {}):
+    """Log audit event"""
+    log_entry = await build_audit_entry(event_type, user, request, item_id=item_id, vault_id=vault_id, details=details)
+    await audit_chain.append([log_entry.dict()])
     logger.info(f"Audit log: {event_type} by {user.email}")
 
+async def log_audit_many(entries: List[AuditLog]):
+    """Log several audit events in one write"""
+    if not entries:
+        return
+    await audit_chain.append([entry.dict() for entry in entries])
+    logger.info(f"Audit log: {len(entries)} events ({entries[0].event_type}) by {entries[0].user_email}")
+
 async def send_google_chat_notification(message: str):
     """Send notification to Google Chat"""
     if not GOOGLE_CHAT_WEBHOOK:
@@ -345,13 +660,91 @@ async def send_google_chat_notification(message: str):
         logger.error(f"Error sending Google Chat notification: {str(e)}")
 
 
+def notify_in_background(message: str):
+    """Send a Google Chat notification without holding up the request"""
+    task = asyncio.create_task(send_google_chat_notification(message))
+    pending_notifications.add(task)
+    task.add_done_callback(pending_notifications.discard)
+
+async def apply_batch_decision(collection, request_ids: List[str], build_update) -> List[dict]:
+    """Conditionally update pending requests in one bulk_write, returning those this call decided"""
+    request_ids = list(dict.fromkeys(request_ids))
+    if len(request_ids) > BATCH_DECISION_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_DECISION_MAX} requests can be processed at once")
+    
+    pending = await collection.find({'id': {'$in': request_ids}, 'status': 'pending'}).to_list(len(request_ids))
+    if not pending:
+        return []
+    
+    batch_id = str(uuid.uuid4())
+    result = await collection.bulk_write(
+        [
+            UpdateOne({'id': req['id'], 'status': 'pending'}, {'$set': {**build_update(req), 'decision_batch_id': batch_id}})
+            for req in pending
+        ],
+        ordered=False
+    )
+    
+    # Another approver got to some of them first
+    if result.modified_count < len(pending):
+        won = await collection.distinct('id', {'decision_batch_id': batch_id})
+        pending = [req for req in pending if req['id'] in won]
+    
+    return pending
+
+async def resolve_names(requests: List[dict]) -> tuple:
+    """Look up requester names and item titles for a list of requests"""
+    requester_ids = list({req['requester_id'] for req in requests})
+    item_ids = list({req['item_id'] for req in requests})
+    users = await db.users.find({'id': {'$in': requester_ids}}, {'_id': 0, 'id': 1, 'name': 1}).to_list(len(requester_ids))
+    items = await db.items.find({'id': {'$in': item_ids}}, {'_id': 0, 'id': 1, 'title': 1}).to_list(len(item_ids))
+    return {u['id']: u['name'] for u in users}, {i['id']: i['title'] for i in items}
+
+async def update_or_404(collection, query: dict, update, detail: str, projection: Optional[dict] = None, before: bool = False) -> dict:
+    """Update one document and return it in a single round trip, or 404 if nothing matched"""
+    doc = await update_returning(collection, query, update, projection=projection, before=before)
+    if doc is None:
+        raise HTTPException(status_code=404, detail=detail)
+    return doc
+
+async def decide_pending_request(collection, request_id: str, update: dict, projection: Optional[dict] = None) -> dict:
+    """Move a pending JIT/break-glass request to its decided state in a single round trip, returning it as it was"""
+    decided = await update_returning(collection, {'id': request_id, 'status': 'pending'}, {'$set': update}, projection=projection, before=True)
+    if decided is None:
+        # Only a failed decision pays for the read telling "missing" from "already decided"
+        if await collection.count_documents({'id': request_id}, limit=1):
+            raise HTTPException(status_code=400, detail="Request already processed")
+        raise HTTPException(status_code=404, detail="Request not found")
+    return decided
+
+async def get_tombstoned_vault_ids() -> set:
+    """Ids of soft-deleted vaults awaiting purge (cached for a few seconds)"""
+    vault_ids = tombstone_cache.get('vault_ids')
+    if vault_ids is None:
+        vault_ids = set(await db.vaults.distinct('id', {'deleted_at': {'$type': 'date'}}))
+        tombstone_cache.set('vault_ids', vault_ids)
+    return vault_ids
+
+async def live_items_query(query: dict) -> dict:
+    """Restrict an items query to items whose vault is not soft-deleted"""
+    deleted = await get_tombstoned_vault_ids()
+    if not deleted:
+        return query
+    return {'$and': [query, {'vault_id': {'$nin': list(deleted)}}]}
+
+async def ensure_live_vault(vault_id: str):
+    """404 if a vault has been soft-deleted"""
+    if vault_id in await get_tombstoned_vault_ids():
+        raise HTTPException(status_code=404, detail="Vault not found")
+
+
 # ============= AUTH ROUTES =============
 
 @api_router.get("/auth/google/login")
 async def google_login():
     """Redirect to Google OAuth"""
     google_auth_url = (
-        f"https://accounts.google.com/o/oauth2/v2/auth?"
+        f"{GOOGLE_AUTH_URL}?"
         f"client_id={GOOGLE_CLIENT_ID}&"
         f"redirect_uri={GOOGLE_REDIRECT_URI}&"
         f"response_type=code&"
@@ -365,43 +758,32 @@ async def google_callback(code: str, request: Request):
     """Handle Google OAuth callback"""
     try:
         # Exchange code for token
-        async with httpx.AsyncClient() as client:
-            token_response = await client.post(
-                "https://oauth2.googleapis.com/token",
-                data={
-                    "code": code,
-                    "client_id": GOOGLE_CLIENT_ID,
-                    "client_secret": GOOGLE_CLIENT_SECRET,
-                    "redirect_uri": GOOGLE_REDIRECT_URI,
-                    "grant_type": "authorization_code"
-                }
-            )
-            token_data = token_response.json()
-            
-            if "error" in token_data:
-                raise HTTPException(status_code=400, detail=token_data["error"])
-            
-            # Get user info
-            user_response = await client.get(
-                "https://www.googleapis.com/oauth2/v2/userinfo",
-                headers={"Authorization": f"Bearer {token_data['access_token']}"}
-            )
-            user_info = user_response.json()
+        token_data = await google_oauth.exchange_code(code)
+        
+        if "error" in token_data:
+            raise HTTPException(status_code=400, detail=token_data["error"])
+        if "id_token" not in token_data:
+            raise HTTPException(status_code=400, detail="No id_token returned")
+        
+        # The verified id_token carries the profile: no userinfo request
+        try:
+            user_info = await google_oauth.verify_id_token(token_data['id_token'])
+        except jwt.InvalidTokenError as e:
+            raise HTTPException(status_code=401, detail=f"Invalid id_token: {str(e)}")
         
         # Validate domain
         email = user_info.get('email', '')
         if not email.endswith(f"@{ALLOWED_DOMAIN}"):
             raise HTTPException(status_code=403, detail=f"Only @{ALLOWED_DOMAIN} emails are allowed")
         
-        # Check if user exists
-        existing_user = await db.users.find_one({'email': email})
+        # Update last login of an existing user
+        existing_user = await update_returning(
+            db.users,
+            {'email': email},
+            {'$set': {'last_login': datetime.now(timezone.utc)}}
+        )
         
         if existing_user:
-            # Update last login
-            await db.users.update_one(
-                {'id': existing_user['id']},
-                {'$set': {'last_login': datetime.now(timezone.utc)}}
-            )
             user = User(**existing_user)
         else:
             # Create new user (pending approval)
@@ -409,7 +791,7 @@ async def google_callback(code: str, request: Request):
                 email=email,
                 name=user_info.get('name', email),
                 avatar_url=user_info.get('picture'),
-                google_id=user_info.get('id'),
+                google_id=user_info.get('sub'),
                 role='contributor',
                 status='active',  # Auto-activate for MVP
                 last_login=datetime.now(timezone.utc)
@@ -426,6 +808,8 @@ async def google_callback(code: str, request: Request):
         frontend_url = os.environ.get('FRONTEND_URL', 'http://localhost:3000')
         return RedirectResponse(url=f"{frontend_url}?token={token}")
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Google auth error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -436,8 +820,10 @@ async def get_me(current_user: User = Depends(get_current_user)):
     return current_user
 
 @api_router.post("/auth/logout")
-async def logout(current_user: User = Depends(get_current_user), request: Request = None):
-    """Logout user"""
+async def logout(current_user: User = Depends(get_current_user), payload: dict = Depends(get_token_payload), request: Request = None):
+    """Logout user (revokes the token)"""
+    if payload.get('jti'):
+        await token_revocations.revoke(payload['jti'], current_user.id, datetime.fromtimestamp(payload['exp'], timezone.utc))
     await log_audit('logout', current_user, request)
     return {"message": "Logged out successfully"}
 
@@ -450,7 +836,7 @@ async def create_vault(vault_data: VaultCreate, current_user: User = Depends(get
     # Build path
     path = vault_data.name
     if vault_data.parent_id:
-        parent = await db.vaults.find_one({'id': vault_data.parent_id})
+        parent = await db.vaults.find_one({'id': vault_data.parent_id, 'deleted_at': None})
         if parent:
             path = f"{parent['path']} > {vault_data.name}"
     
@@ -461,6 +847,7 @@ async def create_vault(vault_data: VaultCreate, current_user: User = Depends(get
         path=path,
         owner_id=current_user.id,
         tags=vault_data.tags,
+        tag_pairs=tag_pairs(vault_data.tags),
         acl=[
             {'user_id': current_user.id, 'permissions': ['view', 'create', 'edit', 'delete', 'reveal', 'export']}
         ]
@@ -471,17 +858,18 @@ async def create_vault(vault_data: VaultCreate, current_user: User = Depends(get
     
     return vault
 
-@api_router.get("/vaults", response_model=List[Vault])
+@api_router.get("/vaults", response_model=List[VaultNode])
 async def get_vaults(current_user: User = Depends(get_current_user)):
-    """Get all vaults (tree structure)"""
+    """Get all vaults (tree structure), each with its item rollup"""
     # For MVP, return all vaults. In production, filter by ACL
-    vaults = await db.vaults.find().to_list(1000)
-    return [Vault(**v) for v in vaults]
+    vaults = await db.vaults.find({'deleted_at': None}).to_list(1000)
+    rollups = tree_rollups(vaults)
+    return [VaultNode(**v, rollup=rollups[v['id']]) for v in vaults]
 
 @api_router.get("/vaults/{vault_id}", response_model=Vault)
 async def get_vault(vault_id: str, current_user: User = Depends(get_current_user)):
     """Get vault details"""
-    vault = await db.vaults.find_one({'id': vault_id})
+    vault = await db.vaults.find_one({'id': vault_id, 'deleted_at': None})
     if not vault:
         raise HTTPException(status_code=404, detail="Vault not found")
     return Vault(**vault)
@@ -492,51 +880,196 @@ async def update_vault(vault_id: str, name: str, tags: Dict[str, str] = {}, curr
     if current_user.role not in ['admin', 'manager']:
         raise HTTPException(status_code=403, detail="Only admins and managers can update vaults")
     
-    vault = await db.vaults.find_one({'id': vault_id})
+    vault = await db.vaults.find_one({'id': vault_id, 'deleted_at': None}, {'_id': 0, 'parent_id': 1})
     if not vault:
         raise HTTPException(status_code=404, detail="Vault not found")
     
-    # Update path if name changed
+    # A child's path is "<parent path> > <name>", from the parent's current path
     new_path = name
     if vault.get('parent_id'):
-        parent = await db.vaults.find_one({'id': vault['parent_id']})
+        parent = await db.vaults.find_one({'id': vault['parent_id']}, {'_id': 0, 'path': 1})
         if parent:
             new_path = f"{parent['path']} > {name}"
     
-    await db.vaults.update_one(
-        {'id': vault_id},
-        {'$set': {
-            'name': name,
-            'path': new_path,
-            'tags': tags,
-            'updated_at': datetime.now(timezone.utc)
-        }}
-    )
+    changes = {
+        'name': name,
+        'path': new_path,
+        'tags': tags,
+        'tag_pairs': tag_pairs(tags),
+        'updated_at': datetime.now(timezone.utc)
+    }
+    vault = await update_or_404(db.vaults, {'id': vault_id, 'deleted_at': None}, {'$set': changes}, "Vault not found")
     
     await log_audit('vault_updated', current_user, request, vault_id=vault_id, details={'name': name})
     
-    updated_vault = await db.vaults.find_one({'id': vault_id})
-    return Vault(**updated_vault)
+    return Vault(**vault)
+
+async def live_subtree(vault_id: str, fields: List[str]) -> List[dict]:
+    """A live vault followed by all its live descendants (404 if the vault is missing or deleted)"""
+    vaults = await db.vaults.find(
+        {'deleted_at': None},
+        {'_id': 0, 'id': 1, 'parent_id': 1, **{field: 1 for field in fields}}
+    ).to_list(None)
+    vault = next((v for v in vaults if v['id'] == vault_id), None)
+    if not vault:
+        raise HTTPException(status_code=404, detail="Vault not found")
+    
+    children: Dict[str, List[dict]] = {}
+    for v in vaults:
+        children.setdefault(v.get('parent_id'), []).append(v)
+    subtree = [vault]
+    for v in subtree:
+        subtree.extend(children.get(v['id'], []))
+    return subtree
 
 @api_router.delete("/vaults/{vault_id}")
 async def delete_vault(vault_id: str, current_user: User = Depends(get_current_user), request: Request = None):
-    """Delete vault (Admin/Manager only)"""
+    """Delete vault and its sub-vaults (Admin/Manager only); restorable until the purge job runs"""
     if current_user.role not in ['admin', 'manager']:
         raise HTTPException(status_code=403, detail="Only admins and managers can delete vaults")
     
-    vault = await db.vaults.find_one({'id': vault_id})
+    # The vault and every live descendant go into the same job
+    subtree = await live_subtree(vault_id, ['name', 'client_share_token'])
+    vault = subtree[0]
+    vault_ids = [v['id'] for v in subtree]
+    
+    now = datetime.now(timezone.utc)
+    job = new_purge_job(vault_id, vault_ids, current_user.id, purge_after=now + timedelta(hours=VAULT_RESTORE_WINDOW_HOURS))
+    
+    async def tombstone(session):
+        await db.vaults.update_many(
+            {'id': {'$in': vault_ids}, 'deleted_at': None},
+            {'$set': {'deleted_at': now, 'deleted_by': current_user.id, 'purge_job_id': job['id']}},
+            session=session
+        )
+        await db.jobs.insert_one(dict(job), session=session)
+    
+    await database.run_transaction(client, tombstone)
+    tombstone_cache.clear()
+    
+    for v in subtree:
+        if v.get('client_share_token'):
+            invalidate_share_token(v['client_share_token'])
+    
+    await log_audit('vault_deleted', current_user, request, vault_id=vault_id, details={'name': vault['name'], 'vaults': len(vault_ids), 'job_id': job['id']})
+    
+    return {"message": "Vault deleted successfully", "job_id": job['id'], "restorable_until": job['purge_after']}
+
+@api_router.post("/vaults/{vault_id}/restore", response_model=Vault)
+async def restore_vault(vault_id: str, current_user: User = Depends(get_current_user), request: Request = None):
+    """Restore a deleted vault and its sub-vaults before they are purged (Admin/Manager only)"""
+    if current_user.role not in ['admin', 'manager']:
+        raise HTTPException(status_code=403, detail="Only admins and managers can restore vaults")
+    
+    vault = await db.vaults.find_one({'id': vault_id, 'deleted_at': {'$type': 'date'}})
     if not vault:
-        raise HTTPException(status_code=404, detail="Vault not found")
+        raise HTTPException(status_code=404, detail="Deleted vault not found")
+    
+    job = await db.jobs.find_one({'id': vault['purge_job_id']}, {'_id': 0, 'vault_id': 1, 'vault_ids': 1})
+    if job and job['vault_id'] != vault_id:
+        raise HTTPException(status_code=400, detail="This vault was deleted with its parent; restore the parent instead")
+    
+    async def restore(session):
+        # Cancelling the job only succeeds while no purge worker has claimed it
+        cancelled = await update_returning(
+            db.jobs,
+            {'id': vault['purge_job_id'], 'status': 'scheduled'},
+            {'$set': {'status': 'cancelled', 'cancelled_by': current_user.id, 'updated_at': datetime.now(timezone.utc)}},
+            projection={'_id': 0, 'id': 1},
+            before=True,
+            session=session
+        )
+        if cancelled is None:
+            return False
+        await db.vaults.update_many(
+            {'purge_job_id': vault['purge_job_id']},
+            {'$set': {'deleted_at': None, 'deleted_by': None, 'purge_job_id': None}},
+            session=session
+        )
+        return True
+    
+    if not await database.run_transaction(client, restore):
+        raise HTTPException(status_code=409, detail="The restore window for this vault has passed")
+    tombstone_cache.clear()
+    
+    # Share links of the restored vaults work again
+    restored = await db.vaults.find(
+        {'id': {'$in': job['vault_ids']}, 'client_share_token': {'$type': 'string'}},
+        {'_id': 0, 'client_share_token': 1}
+    ).to_list(None)
+    for v in restored:
+        invalid_token_cache.discard(('share', v['client_share_token']))
+    
+    await log_audit('vault_restored', current_user, request, vault_id=vault_id, details={'name': vault['name']})
+    
+    return Vault(**{**vault, 'deleted_at': None, 'deleted_by': None, 'purge_job_id': None})
+
+@api_router.get("/vaults/{vault_id}/export")
+async def export_vault(vault_id: str, current_user: User = Depends(get_current_user), request: Request = None):
+    """Encrypted archive of a vault subtree: vaults (with ACLs), items with their ciphertexts, item history and attachment files (Admin only)"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Only admins can export vaults")
+    
+    subtree = await live_subtree(vault_id, ['name', 'path'])
+    root = subtree[0]
+    parent = await db.vaults.find_one({'id': root['parent_id']}, {'_id': 0, 'path': 1}) if root.get('parent_id') else None
+    header = {
+        'archive_id': str(uuid.uuid4()),
+        'format': 2,
+        'root_id': root['id'],
+        'root_path': root['path'],
+        'root_parent_id': root.get('parent_id'),
+        'root_parent_path': parent['path'] if parent else None,
+        'vaults': len(subtree),
+        'exported_at': datetime.now(timezone.utc),
+        'exported_by': current_user.email
+    }
+    await log_audit('vault_exported', current_user, request, vault_id=vault_id, details={'archive_id': header['archive_id'], 'vaults': len(subtree)})
     
-    # Delete all items in vault
-    await db.items.delete_many({'vault_id': vault_id})
+    filename = f"vault-{root['name']}-{header['exported_at']:%Y%m%d%H%M%S}.kkvault".replace(' ', '_')
+    return StreamingResponse(
+        vault_archive.export_vaults(db, [v['id'] for v in subtree], header, ENCRYPTION_KEY, chunk_size=VAULT_ARCHIVE_CHUNK_SIZE),
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@api_router.post("/vaults/import-archive")
+async def import_vault_archive(request: Request, job_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """Restore a vault archive streamed as the request body (Admin only); pass the job_id of a failed restore to resume it"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Only admins can import vault archives")
+    
+    if job_id:
+        job = await update_returning(
+            db.jobs,
+            {'id': job_id, 'type': vault_archive.JOB_TYPE, 'status': 'failed'},
+            {'$set': {'status': 'running', 'updated_at': datetime.now(timezone.utc)}},
+            projection={'_id': 0},
+            before=True
+        )
+        if not job:
+            raise HTTPException(status_code=404, detail="No failed archive import with this id")
+    else:
+        job = vault_archive.new_import_job(current_user.id)
+        await db.jobs.insert_one(dict(job))
     
-    # Delete vault
-    await db.vaults.delete_one({'id': vault_id})
+    try:
+        progress = await vault_archive.import_archive(db, request.stream(), ENCRYPTION_KEY, job)
+    except Exception as e:
+        await db.jobs.update_one(
+            {'id': job['id']},
+            {'$set': {'status': 'failed', 'last_error': str(e), 'updated_at': datetime.now(timezone.utc)}}
+        )
+        if isinstance(e, vault_archive.ArchiveError):
+            raise HTTPException(status_code=400, detail=f"{str(e)}; resume with job_id={job['id']}")
+        raise
     
-    await log_audit('vault_deleted', current_user, request, vault_id=vault_id, details={'name': vault['name']})
+    # Restored vault documents carry their counters from export time; recount them from the restored items
+    restored = await db.jobs.find_one({'id': job['id']}, {'_id': 0, 'vault_id': 1})
+    await vault_rollups.reconcile([vault['id'] for vault in await live_subtree(restored['vault_id'], [])])
     
-    return {"message": "Vault deleted successfully"}
+    await log_audit('vault_archive_imported', current_user, request, details={'job_id': job['id'], **progress})
+    return {"message": "Archive restored", "job_id": job['id'], "progress": progress}
 
 @api_router.post("/vaults/{vault_id}/generate-client-link")
 async def generate_client_link(vault_id: str, current_user: User = Depends(get_current_user)):
@@ -544,52 +1077,83 @@ async def generate_client_link(vault_id: str, current_user: User = Depends(get_c
     if current_user.role not in ['admin', 'manager']:
         raise HTTPException(status_code=403, detail="Only admins and managers can generate client links")
     
-    vault = await db.vaults.find_one({'id': vault_id})
-    if not vault:
-        raise HTTPException(status_code=404, detail="Vault not found")
-    
-    if vault['type'] != 'client':
-        raise HTTPException(status_code=400, detail="Only client-type vaults can have shareable links")
-    
     # Generate secure token
     share_token = hashlib.sha256(f"{vault_id}-{datetime.now(timezone.utc).isoformat()}".encode()).hexdigest()
+    invalid_token_cache.discard(('share', share_token))
     
-    await db.vaults.update_one(
-        {'id': vault_id},
+    vault = await update_returning(
+        db.vaults,
+        {'id': vault_id, 'type': 'client', 'deleted_at': None},
         {'$set': {
             'client_share_token': share_token,
             'client_share_enabled': True
-        }}
+        }},
+        projection={'_id': 0, 'client_share_token': 1},
+        before=True
     )
+    if not vault:
+        if await db.vaults.count_documents({'id': vault_id, 'deleted_at': None}, limit=1):
+            raise HTTPException(status_code=400, detail="Only client-type vaults can have shareable links")
+        raise HTTPException(status_code=404, detail="Vault not found")
+    
+    if vault.get('client_share_token'):
+        invalidate_share_token(vault['client_share_token'])
     
     frontend_url = os.environ.get('FRONTEND_URL', 'http://localhost:3000')
     share_url = f"{frontend_url}/client-submit/{share_token}"
     
     return {"share_url": share_url, "token": share_token}
 
-@api_router.get("/vaults/by-token/{token}")
-async def get_vault_by_token(token: str):
-    """Get vault info by share token (public access)"""
-    vault = await db.vaults.find_one({'client_share_token': token, 'client_share_enabled': True})
-    if not vault:
-        raise HTTPException(status_code=404, detail="Invalid or expired link")
+@api_router.delete("/vaults/{vault_id}/client-link")
+async def disable_client_link(vault_id: str, current_user: User = Depends(get_current_user), request: Request = None):
+    """Disable the client shareable link of a vault (Admin/Manager only)"""
+    if current_user.role not in ['admin', 'manager']:
+        raise HTTPException(status_code=403, detail="Only admins and managers can disable client links")
     
-    return {
-        'vault_id': vault['id'],
-        'vault_name': vault['name'],
-        'client_name': vault['tags'].get('client', 'Client')
-    }
+    vault = await update_or_404(
+        db.vaults,
+        {'id': vault_id},
+        {'$set': {'client_share_enabled': False}},
+        "Vault not found",
+        projection={'_id': 0, 'client_share_token': 1}
+    )
+    
+    if vault.get('client_share_token'):
+        invalidate_share_token(vault['client_share_token'])
+    
+    await log_audit('client_link_disabled', current_user, request, vault_id=vault_id)
+    
+    return {"message": "Client link disabled"}
 
-@api_router.post("/vaults/client-submit/{token}/item")
-async def client_submit_item(token: str, item_data: ItemCreate):
-    """Allow client to submit item via shareable link (no auth required)"""
-    vault = await db.vaults.find_one({'client_share_token': token, 'client_share_enabled': True})
+def invalidate_share_token(token: str):
+    """Forget a share token that was regenerated or disabled"""
+    share_link_cache.discard(token)
+    remember_invalid_token('share', token)
+
+async def resolve_share_token(token: str) -> dict:
+    """Resolve an enabled share token to its vault, served from cache when possible"""
+    vault = share_link_cache.get(token)
+    if vault is not None:
+        return vault
+    
+    # `_id` keys the cache entry to the vault's change events
+    vault = await db.vaults.find_one(
+        {'client_share_token': token, 'client_share_enabled': True, 'deleted_at': None},
+        {'_id': 1, 'id': 1, 'name': 1, 'tags': 1}
+    )
     if not vault:
+        remember_invalid_token('share', token)
         raise HTTPException(status_code=404, detail="Invalid or expired link")
     
-    # Force vault_id from token
-    item_data.vault_id = vault['id']
-    
+    share_link_cache.set(token, vault)
+    return vault
+
+def item_document(item: Item, password: Optional[str]) -> dict:
+    """Item as stored: the model plus its password fingerprint, which is never returned by the API"""
+    return {**item.dict(), **credential_hygiene.assess(password)}
+
+def build_client_item(vault: dict, item_data: ItemCreate) -> Item:
+    """Build an item submitted through a client share link"""
     # Encrypt sensitive fields
     password_encrypted = None
     if item_data.password:
@@ -599,7 +1163,7 @@ async def client_submit_item(token: str, item_data: ItemCreate):
     if item_data.notes:
         notes_encrypted = encrypt_data(item_data.notes)
     
-    item = Item(
+    return Item(
         vault_id=vault['id'],
         type=item_data.type,
         title=item_data.title,
@@ -607,11 +1171,13 @@ async def client_submit_item(token: str, item_data: ItemCreate):
         password_encrypted=password_encrypted,
         login_url=item_data.login_url,
         metadata=item_data.metadata,
+        identifiers=identifier_index.extract(item_data.type, item_data.metadata),
         owner_id='client-submitted',  # Special owner for client submissions
         environment=item_data.environment,
         criticality=item_data.criticality,
         expires_at=item_data.expires_at,
         tags=item_data.tags,
+        tag_pairs=tag_pairs(item_data.tags),
         notes_encrypted=notes_encrypted,
         login_instructions=item_data.login_instructions,
         no_copy=item_data.no_copy,
@@ -619,11 +1185,10 @@ async def client_submit_item(token: str, item_data: ItemCreate):
         created_by='client-submitted',
         updated_by='client-submitted'
     )
-    
-    await db.items.insert_one(item.dict())
-    
-    # Log without user context
-    log_entry = AuditLog(
+
+def build_client_submission_log(vault: dict, item: Item) -> AuditLog:
+    """Audit entry for a client submission (no user context)"""
+    return AuditLog(
         event_type='client_item_submitted',
         user_id='client',
         user_email=vault['tags'].get('client', 'unknown'),
@@ -631,115 +1196,191 @@ async def client_submit_item(token: str, item_data: ItemCreate):
         vault_id=vault['id'],
         details={'title': item.title, 'via_share_link': True}
     )
-    await db.audit_logs.insert_one(log_entry.dict())
+
+@api_router.get("/vaults/by-token/{token}")
+async def get_vault_by_token(token: str, request: Request):
+    """Get vault info by share token (public access)"""
+    await guard_public_token(request, 'share', token, "Invalid or expired link")
+    
+    vault = await resolve_share_token(token)
+    
+    return {
+        'vault_id': vault['id'],
+        'vault_name': vault['name'],
+        'client_name': vault['tags'].get('client', 'Client')
+    }
+
+@api_router.post("/vaults/client-submit/{token}/item")
+async def client_submit_item(token: str, item_data: ItemCreate, request: Request):
+    """Allow client to submit item via shareable link (no auth required)"""
+    await guard_public_token(request, 'share', token, "Invalid or expired link")
+    
+    vault = await resolve_share_token(token)
+    await public_rate_limiter.check(f"share_items:{token}", CLIENT_SUBMIT_ITEM_QUOTA)
+    
+    # Force vault_id from token
+    item_data.vault_id = vault['id']
+    
+    item = build_client_item(vault, item_data)
+    doc = item_document(item, item_data.password)
+    await get_collection(db, 'items', 'secret_write').insert_one(doc)
+    await vault_rollups.added([doc])
+    
+    # Log without user context
+    log_entry = build_client_submission_log(vault, item)
+    await audit_chain.append([log_entry.dict()])
     
     return {"message": "Item submitted successfully", "item_id": item.id}
 
+@api_router.post("/vaults/client-submit/{token}/items")
+async def client_submit_items(token: str, items_data: List[ItemCreate], request: Request):
+    """Allow client to submit many items at once via shareable link (no auth required)"""
+    await guard_public_token(request, 'share', token, "Invalid or expired link")
+    
+    if not items_data:
+        raise HTTPException(status_code=400, detail="No items submitted")
+    if len(items_data) > CLIENT_SUBMIT_MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {CLIENT_SUBMIT_MAX_BATCH} items can be submitted at once")
+    
+    vault = await resolve_share_token(token)
+    await public_rate_limiter.check(f"share_items:{token}", CLIENT_SUBMIT_ITEM_QUOTA, cost=len(items_data))
+    
+    items = [build_client_item(vault, item_data) for item_data in items_data]
+    docs = [item_document(item, item_data.password) for item, item_data in zip(items, items_data)]
+    await get_collection(db, 'items', 'secret_write').insert_many(docs)
+    await vault_rollups.added(docs)
+    await audit_chain.append([build_client_submission_log(vault, item).dict() for item in items])
+    
+    return {
+        "message": f"{len(items)} items submitted successfully",
+        "item_ids": [item.id for item in items]
+    }
+
 
 # ============= ITEM ROUTES =============
 
+# Metadata fields per item type; `identifiers` are the platform ids that are indexed for lookups
+ITEM_TEMPLATES = {
+    "ad_token_google": {
+        "fields": ["account_id", "customer_id", "mcc_id", "conversion_tracking_id", "gtm_container_id"],
+        "identifiers": ["account_id", "customer_id", "mcc_id", "conversion_tracking_id", "gtm_container_id"],
+        "labels": {
+            "account_id": "Google Ads Account ID",
+            "customer_id": "Customer ID",
+            "mcc_id": "MCC ID (if applicable)",
+            "conversion_tracking_id": "Conversion Tracking ID",
+            "gtm_container_id": "GTM Container ID"
+        }
+    },
+    "ad_token_meta": {
+        "fields": ["business_manager_id", "ad_account_id", "pixel_id", "app_id", "app_secret"],
+        "identifiers": ["business_manager_id", "ad_account_id", "pixel_id", "app_id"],
+        "labels": {
+            "business_manager_id": "Business Manager ID",
+            "ad_account_id": "Ad Account ID",
+            "pixel_id": "Facebook Pixel ID",
+            "app_id": "App ID",
+            "app_secret": "App Secret"
+        }
+    },
+    "ad_token_tiktok": {
+        "fields": ["advertiser_id", "pixel_id", "app_id"],
+        "identifiers": ["advertiser_id", "pixel_id", "app_id"],
+        "labels": {
+            "advertiser_id": "Advertiser ID",
+            "pixel_id": "TikTok Pixel ID",
+            "app_id": "App ID"
+        }
+    },
+    "ad_token_linkedin": {
+        "fields": ["account_id", "campaign_manager_account", "insight_tag_id"],
+        "identifiers": ["account_id", "campaign_manager_account", "insight_tag_id"],
+        "labels": {
+            "account_id": "LinkedIn Account ID",
+            "campaign_manager_account": "Campaign Manager Account",
+            "insight_tag_id": "Insight Tag ID"
+        }
+    },
+    "gtm": {
+        "fields": ["container_id", "account_id", "workspace"],
+        "identifiers": ["container_id", "account_id"],
+        "labels": {
+            "container_id": "GTM Container ID",
+            "account_id": "Account ID",
+            "workspace": "Workspace Name"
+        }
+    },
+    "integration_rd": {
+        "fields": ["api_key", "client_id", "client_secret", "webhook_url"],
+        "identifiers": ["client_id"],
+        "labels": {
+            "api_key": "RD Station API Key",
+            "client_id": "Client ID",
+            "client_secret": "Client Secret",
+            "webhook_url": "Webhook URL"
+        }
+    },
+    "integration_hubspot": {
+        "fields": ["api_key", "portal_id", "app_id"],
+        "identifiers": ["portal_id", "app_id"],
+        "labels": {
+            "api_key": "HubSpot API Key",
+            "portal_id": "Portal ID",
+            "app_id": "App ID"
+        }
+    },
+    "integration_ekyte": {
+        "fields": ["api_key", "client_id", "environment"],
+        "identifiers": ["client_id"],
+        "labels": {
+            "api_key": "eKyte API Key",
+            "client_id": "Client ID",
+            "environment": "Environment (prod/sandbox)"
+        }
+    },
+    "ssh_key": {
+        "fields": ["hostname", "port", "username", "private_key_path"],
+        "identifiers": [],
+        "labels": {
+            "hostname": "Hostname/IP",
+            "port": "Port",
+            "username": "Username",
+            "private_key_path": "Private Key Path"
+        }
+    },
+    "db_credential": {
+        "fields": ["host", "port", "database", "username", "connection_string"],
+        "identifiers": [],
+        "labels": {
+            "host": "Host",
+            "port": "Port",
+            "database": "Database Name",
+            "username": "Username",
+            "connection_string": "Connection String"
+        }
+    }
+}
+
+# Platform ids from item metadata, stored normalized next to it and indexed
+identifier_index = IdentifierIndex(
+    db.items,
+    {item_type: template["identifiers"] for item_type, template in ITEM_TEMPLATES.items()},
+    batch_size=ITEM_IDENTIFIER_BATCH_SIZE
+)
+
 @api_router.get("/items/templates/{item_type}")
 async def get_item_template(item_type: str):
     """Get metadata template for specific item type"""
-    templates = {
-        "ad_token_google": {
-            "fields": ["account_id", "customer_id", "mcc_id", "conversion_tracking_id", "gtm_container_id"],
-            "labels": {
-                "account_id": "Google Ads Account ID",
-                "customer_id": "Customer ID",
-                "mcc_id": "MCC ID (if applicable)",
-                "conversion_tracking_id": "Conversion Tracking ID",
-                "gtm_container_id": "GTM Container ID"
-            }
-        },
-        "ad_token_meta": {
-            "fields": ["business_manager_id", "ad_account_id", "pixel_id", "app_id", "app_secret"],
-            "labels": {
-                "business_manager_id": "Business Manager ID",
-                "ad_account_id": "Ad Account ID",
-                "pixel_id": "Facebook Pixel ID",
-                "app_id": "App ID",
-                "app_secret": "App Secret"
-            }
-        },
-        "ad_token_tiktok": {
-            "fields": ["advertiser_id", "pixel_id", "app_id"],
-            "labels": {
-                "advertiser_id": "Advertiser ID",
-                "pixel_id": "TikTok Pixel ID",
-                "app_id": "App ID"
-            }
-        },
-        "ad_token_linkedin": {
-            "fields": ["account_id", "campaign_manager_account", "insight_tag_id"],
-            "labels": {
-                "account_id": "LinkedIn Account ID",
-                "campaign_manager_account": "Campaign Manager Account",
-                "insight_tag_id": "Insight Tag ID"
-            }
-        },
-        "gtm": {
-            "fields": ["container_id", "account_id", "workspace"],
-            "labels": {
-                "container_id": "GTM Container ID",
-                "account_id": "Account ID",
-                "workspace": "Workspace Name"
-            }
-        },
-        "integration_rd": {
-            "fields": ["api_key", "client_id", "client_secret", "webhook_url"],
-            "labels": {
-                "api_key": "RD Station API Key",
-                "client_id": "Client ID",
-                "client_secret": "Client Secret",
-                "webhook_url": "Webhook URL"
-            }
-        },
-        "integration_hubspot": {
-            "fields": ["api_key", "portal_id", "app_id"],
-            "labels": {
-                "api_key": "HubSpot API Key",
-                "portal_id": "Portal ID",
-                "app_id": "App ID"
-            }
-        },
-        "integration_ekyte": {
-            "fields": ["api_key", "client_id", "environment"],
-            "labels": {
-                "api_key": "eKyte API Key",
-                "client_id": "Client ID",
-                "environment": "Environment (prod/sandbox)"
-            }
-        },
-        "ssh_key": {
-            "fields": ["hostname", "port", "username", "private_key_path"],
-            "labels": {
-                "hostname": "Hostname/IP",
-                "port": "Port",
-                "username": "Username",
-                "private_key_path": "Private Key Path"
-            }
-        },
-        "db_credential": {
-            "fields": ["host", "port", "database", "username", "connection_string"],
-            "labels": {
-                "host": "Host",
-                "port": "Port",
-                "database": "Database Name",
-                "username": "Username",
-                "connection_string": "Connection String"
-            }
-        }
-    }
-    
-    if item_type not in templates:
-        return {"fields": [], "labels": {}}
+    if item_type not in ITEM_TEMPLATES:
+        return {"fields": [], "labels": {}, "identifiers": []}
     
-    return templates[item_type]
+    return ITEM_TEMPLATES[item_type]
 
 @api_router.post("/items", response_model=Item)
 async def create_item(item_data: ItemCreate, current_user: User = Depends(get_current_user), request: Request = None):
     """Create a new item (secret)"""
+    await ensure_live_vault(item_data.vault_id)
+    
     # Encrypt sensitive fields
     password_encrypted = None
     if item_data.password:
@@ -757,11 +1398,13 @@ async def create_item(item_data: ItemCreate, current_user: User = Depends(get_cu
         password_encrypted=password_encrypted,
         login_url=item_data.login_url,
         metadata=item_data.metadata,
+        identifiers=identifier_index.extract(item_data.type, item_data.metadata),
         owner_id=current_user.id,
         environment=item_data.environment,
         criticality=item_data.criticality,
         expires_at=item_data.expires_at,
         tags=item_data.tags,
+        tag_pairs=tag_pairs(item_data.tags),
         notes_encrypted=notes_encrypted,
         login_instructions=item_data.login_instructions,
         no_copy=item_data.no_copy,
@@ -773,21 +1416,24 @@ async def create_item(item_data: ItemCreate, current_user: User = Depends(get_cu
         updated_by=current_user.id
     )
     
-    await db.items.insert_one(item.dict())
+    doc = item_document(item, item_data.password)
+    await get_collection(db, 'items', 'secret_write').insert_one(doc)
+    await vault_rollups.added([doc])
     await log_audit('item_created', current_user, request, item_id=item.id, vault_id=item.vault_id, details={'title': item.title})
     
     return item
 
-@api_router.get("/items", response_model=List[Item])
-async def get_items(
+def build_items_query(
     vault_id: Optional[str] = None,
     search: Optional[str] = None,
     type: Optional[str] = None,
     environment: Optional[str] = None,
     criticality: Optional[str] = None,
-    current_user: User = Depends(get_current_user)
-):
-    """Get items with filters"""
+    client: Optional[str] = None,
+    squad: Optional[str] = None,
+    tag: Optional[str] = None
+) -> dict:
+    """Items query for the vault explorer filters; `tag` is key:value"""
     query = {}
     
     if vault_id:
@@ -801,21 +1447,121 @@ async def get_items(
     if search:
         query['title'] = {'$regex': search, '$options': 'i'}
     
-    items = await db.items.find(query).to_list(1000)
-    return [Item(**item) for item in items]
+    # Client and squad are fields on items created in the app, tags on imported ones
+    conditions = []
+    for field, value in (('client', client), ('squad', squad)):
+        if value and value.strip():
+            conditions.append({'$or': [{field: value.strip()}, tag_filter(field, value)]})
+    if tag:
+        key, separator, value = tag.partition(':')
+        if not separator:
+            raise HTTPException(status_code=400, detail="tag must be key:value")
+        conditions.append(tag_filter(key, value))
+    if conditions:
+        query['$and'] = conditions
+    
+    return query
+
+@api_router.get("/items", response_model=List[Item])
+async def get_items(
+    vault_id: Optional[str] = None,
+    search: Optional[str] = None,
+    type: Optional[str] = None,
+    environment: Optional[str] = None,
+    criticality: Optional[str] = None,
+    client: Optional[str] = None,
+    squad: Optional[str] = None,
+    tag: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Get items with filters"""
+    query = build_items_query(vault_id, search, type, environment, criticality, client, squad, tag)
+    items = await db.items.find(await live_items_query(query)).to_list(1000)
+    return [Item(**release_expired_checkout(item)) for item in items]
+
+@api_router.get("/items/facets")
+async def get_item_facets(
+    vault_id: Optional[str] = None,
+    search: Optional[str] = None,
+    type: Optional[str] = None,
+    environment: Optional[str] = None,
+    criticality: Optional[str] = None,
+    client: Optional[str] = None,
+    squad: Optional[str] = None,
+    tag: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Item counts per type, environment, criticality, client, squad and tag for the same filters as GET /items"""
+    query = build_items_query(vault_id, search, type, environment, criticality, client, squad, tag)
+    pipeline = tag_index.facet_pipeline(await live_items_query(query), ITEM_FACET_TAG_LIMIT)
+    result = await db.items.aggregate(pipeline).to_list(1)
+    return tag_index.facet_counts(result[0] if result else None)
+
+@api_router.get("/items/lookup", response_model=List[Item])
+async def lookup_items(field: str, value: str, type: Optional[str] = None, limit: int = 100, current_user: User = Depends(get_current_user)):
+    """Items carrying a platform identifier, e.g. field=pixel_id&value=1234567890"""
+    if field not in identifier_index.fields:
+        raise HTTPException(status_code=400, detail=f"Unknown identifier field; expected one of: {', '.join(identifier_index.fields)}")
+    limit = max(1, min(limit, ITEM_LOOKUP_MAX))
+    
+    query = identifier_index.match(field, value)
+    if type:
+        query['type'] = type
+    items = await db.items.find(await live_items_query(query)).to_list(limit)
+    return [Item(**release_expired_checkout(item)) for item in items]
+
+@api_router.get("/items/lookup/clients")
+async def lookup_identifier_clients(field: str, value: str, current_user: User = Depends(get_current_user)):
+    """Client vaults sharing a platform identifier (which clients use this pixel / MCC)"""
+    if field not in identifier_index.fields:
+        raise HTTPException(status_code=400, detail=f"Unknown identifier field; expected one of: {', '.join(identifier_index.fields)}")
+    
+    items = await db.items.find(
+        await live_items_query(identifier_index.match(field, value)),
+        {'_id': 0, 'id': 1, 'vault_id': 1, 'type': 1, 'title': 1}
+    ).to_list(ITEM_LOOKUP_MAX)
+    by_vault: Dict[str, List[dict]] = {}
+    for item in items:
+        by_vault.setdefault(item['vault_id'], []).append({'id': item['id'], 'type': item['type'], 'title': item['title']})
+    
+    vaults = await db.vaults.find(
+        {'id': {'$in': list(by_vault)}},
+        {'_id': 0, 'id': 1, 'name': 1, 'path': 1, 'tags': 1}
+    ).to_list(None)
+    clients = [
+        {
+            'vault_id': vault['id'],
+            'vault_name': vault['name'],
+            'vault_path': vault['path'],
+            'client': (vault.get('tags') or {}).get('client'),
+            'items': by_vault[vault['id']]
+        }
+        for vault in sorted(vaults, key=lambda v: v['path'])
+    ]
+    return {'field': field, 'value': value, 'clients': clients}
+
+@api_router.post("/items/identifiers/reindex")
+async def reindex_item_identifiers(current_user: User = Depends(get_current_user), request: Request = None):
+    """Recompute the identifier index of every item, e.g. after a template change (Admin only)"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Only admins can reindex item identifiers")
+    
+    result = await identifier_index.reindex()
+    await log_audit('item_identifiers_reindexed', current_user, request, details=result)
+    return result
 
 @api_router.get("/items/{item_id}", response_model=Item)
 async def get_item(item_id: str, current_user: User = Depends(get_current_user)):
     """Get item details (without revealing password)"""
-    item = await db.items.find_one({'id': item_id})
+    item = await db.items.find_one(await live_items_query({'id': item_id}))
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
-    return Item(**item)
+    return Item(**release_expired_checkout(item))
 
 @api_router.post("/items/{item_id}/reveal")
 async def reveal_item(item_id: str, current_user: User = Depends(get_current_user), request: Request = None):
     """Reveal password (decrypt and log)"""
-    item = await db.items.find_one({'id': item_id})
+    item = await db.items.find_one(await live_items_query({'id': item_id}))
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
     
@@ -828,8 +1574,14 @@ async def reveal_item(item_id: str, current_user: User = Depends(get_current_use
     if item.get('notes_encrypted'):
         notes = decrypt_data(item['notes_encrypted'])
     
+    # Reveal under an active JIT grant is recorded against it
+    details = {'title': item['title']}
+    grant = jit_grants.lookup(current_user.id, item_id)
+    if grant:
+        details['jit_request_id'] = grant['_id']
+    
     # Log reveal
-    await log_audit('item_revealed', current_user, request, item_id=item_id, vault_id=item['vault_id'], details={'title': item['title']})
+    await log_audit('item_revealed', current_user, request, item_id=item_id, vault_id=item['vault_id'], details=details)
     
     # Send notification if critical
     if item.get('criticality') == 'high':
@@ -840,16 +1592,13 @@ async def reveal_item(item_id: str, current_user: User = Depends(get_current_use
     
     return {
         'password': password,
-        'notes': notes
+        'notes': notes,
+        'jit_expires_at': grant['expires_at'] if grant else None
     }
 
 @api_router.put("/items/{item_id}", response_model=Item)
 async def update_item(item_id: str, item_data: ItemUpdate, current_user: User = Depends(get_current_user), request: Request = None):
     """Update item"""
-    item = await db.items.find_one({'id': item_id})
-    if not item:
-        raise HTTPException(status_code=404, detail="Item not found")
-    
     update_dict = {}
     
     if item_data.title is not None:
@@ -858,6 +1607,7 @@ async def update_item(item_id: str, item_data: ItemUpdate, current_user: User =
         update_dict['login'] = item_data.login
     if item_data.password is not None:
         update_dict['password_encrypted'] = encrypt_data(item_data.password)
+        update_dict.update(credential_hygiene.assess(item_data.password))
     if item_data.login_url is not None:
         update_dict['login_url'] = item_data.login_url
     if item_data.metadata is not None:
@@ -870,6 +1620,7 @@ async def update_item(item_id: str, item_data: ItemUpdate, current_user: User =
         update_dict['expires_at'] = item_data.expires_at
     if item_data.tags is not None:
         update_dict['tags'] = item_data.tags
+        update_dict['tag_pairs'] = tag_pairs(item_data.tags)
     if item_data.notes is not None:
         update_dict['notes_encrypted'] = encrypt_data(item_data.notes)
     if item_data.login_instructions is not None:
@@ -878,26 +1629,188 @@ async def update_item(item_id: str, item_data: ItemUpdate, current_user: User =
     update_dict['updated_at'] = datetime.now(timezone.utc)
     update_dict['updated_by'] = current_user.id
     
-    await db.items.update_one({'id': item_id}, {'$set': update_dict})
+    update = {'$set': update_dict, '$inc': {'version': 1}}
+    if 'metadata' in update_dict:
+        # Identifiers depend on the type, which only the stored item knows: a pipeline update picks them in the same write
+        update = [{'$set': {
+            **{name: {'$literal': value} for name, value in update_dict.items()},
+            'identifiers': identifier_index.expression(update_dict['metadata']),
+            'version': {'$add': [{'$ifNull': ['$version', 0]}, 1]}
+        }}]
+    
+    # The pre-image feeds the history entry and keeps the audit entry on the previous title
+    item = await update_or_404(
+        get_collection(db, 'items', 'secret_write'),
+        await live_items_query({'id': item_id}),
+        update,
+        "Item not found",
+        before=True
+    )
+    # Items created before versioning count as version 0
+    version = item.get('version', 0) + 1
+    await item_history.record(item, update_dict, version, current_user.id)
+    if 'criticality' in update_dict or 'expires_at' in update_dict:
+        await vault_rollups.changed(item, {**item, **update_dict})
+    
+    # What the pipeline wrote, now that the pre-image tells the type
+    if 'metadata' in update_dict:
+        update_dict['identifiers'] = identifier_index.extract(item['type'], update_dict['metadata'])
     
-    await log_audit('item_updated', current_user, request, item_id=item_id, vault_id=item['vault_id'], details={'title': item['title']})
+    await log_audit('item_updated', current_user, request, item_id=item_id, vault_id=item['vault_id'], details={'title': item['title'], 'version': version})
     
-    updated_item = await db.items.find_one({'id': item_id})
-    return Item(**updated_item)
+    return Item(**{**item, **update_dict, 'version': version})
 
 @api_router.delete("/items/{item_id}")
 async def delete_item(item_id: str, current_user: User = Depends(get_current_user), request: Request = None):
     """Delete item"""
-    item = await db.items.find_one({'id': item_id})
+    item = await delete_returning(
+        db.items,
+        await live_items_query({'id': item_id}),
+        projection={'_id': 0, 'vault_id': 1, 'title': 1, 'type': 1, 'criticality': 1, 'expires_at': 1}
+    )
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
-    
-    await db.items.delete_one({'id': item_id})
+    await item_history.collection.delete_many({'item_id': item_id})
+    await vault_rollups.removed([item])
     
     await log_audit('item_deleted', current_user, request, item_id=item_id, vault_id=item['vault_id'], details={'title': item['title']})
     
     return {"message": "Item deleted successfully"}
 
+@api_router.get("/items/{item_id}/history")
+async def get_item_history(item_id: str, limit: int = 20, before_version: Optional[int] = None, current_user: User = Depends(get_current_user)):
+    """Item change history, newest first (secret values are never listed)"""
+    item = await db.items.find_one(await live_items_query({'id': item_id}), {'_id': 0, 'version': 1})
+    if not item:
+        raise HTTPException(status_code=404, detail="Item not found")
+    
+    limit = max(1, min(limit, ITEM_HISTORY_PAGE_MAX))
+    entries = await item_history.list(item_id, limit=limit, before_version=before_version)
+    return {
+        'current_version': item.get('version', 0),
+        'entries': entries,
+        'next_before_version': entries[-1]['version'] if len(entries) == limit else None
+    }
+
+@api_router.post("/items/{item_id}/history/{version}/reveal")
+async def reveal_item_history(item_id: str, version: int, current_user: User = Depends(get_current_user), request: Request = None):
+    """Reveal the secret values an item had before the given version (decrypt and log)"""
+    item = await db.items.find_one(await live_items_query({'id': item_id}), {'_id': 0, 'vault_id': 1, 'title': 1})
+    if not item:
+        raise HTTPException(status_code=404, detail="Item not found")
+    
+    previous = await item_history.previous_values(item_id, version)
+    if previous is None:
+        raise HTTPException(status_code=404, detail="Version not found")
+    
+    await log_audit('item_history_revealed', current_user, request, item_id=item_id, vault_id=item['vault_id'], details={'title': item['title'], 'version': version})
+    
+    return {
+        'version': version,
+        'password': decrypt_data(previous['password_encrypted']) if previous.get('password_encrypted') else None,
+        'notes': decrypt_data(previous['notes_encrypted']) if previous.get('notes_encrypted') else None
+    }
+
+@api_router.post("/items/{item_id}/attachments")
+async def upload_attachment(item_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    """Attach a file (multipart field `file`), encrypted into GridFS as it streams in"""
+    item = await db.items.find_one(await live_items_query({'id': item_id}), {'_id': 0, 'vault_id': 1, 'title': 1, 'attachments.id': 1})
+    if not item:
+        raise HTTPException(status_code=404, detail="Item not found")
+    if len(item.get('attachments') or []) >= ATTACHMENT_MAX_PER_ITEM:
+        raise HTTPException(status_code=400, detail=f"Items can have at most {ATTACHMENT_MAX_PER_ITEM} attachments")
+    # Refused before reading the body when the client announces its size
+    if int(request.headers.get('content-length') or 0) > ATTACHMENT_MAX_SIZE + 64 * 1024:
+        raise HTTPException(status_code=413, detail=f"Attachments are limited to {ATTACHMENT_MAX_SIZE} bytes")
+    
+    try:
+        upload = MultipartFile(request.stream(), request.headers.get('content-type'))
+        await upload.start()
+        stored = await attachment_store.save(upload.chunks(), current_user.id)
+    except AttachmentTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except AttachmentError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    now = datetime.now(timezone.utc)
+    attachment = {
+        'id': str(uuid.uuid4()),
+        'file_id': stored['file_id'],
+        'filename': upload.filename,
+        'content_type': upload.content_type,
+        'size': stored['size'],
+        'uploaded_by': current_user.id,
+        'uploaded_at': now
+    }
+    # A file left unreferenced by a failed push is removed by the attachment sweeper
+    await update_or_404(
+        db.items,
+        await live_items_query({'id': item_id}),
+        {'$push': {'attachments': attachment}, '$set': {'updated_at': now, 'updated_by': current_user.id}},
+        "Item not found",
+        projection={'_id': 1}
+    )
+    
+    await log_audit('attachment_uploaded', current_user, request, item_id=item_id, vault_id=item['vault_id'], details={'title': item['title'], 'filename': upload.filename, 'size': stored['size']})
+    
+    return attachment
+
+@api_router.get("/items/{item_id}/attachments/{attachment_id}")
+async def download_attachment(item_id: str, attachment_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    """Download an attachment, decrypted as it streams; a single Range is honoured (decrypt and log)"""
+    item = await db.items.find_one(
+        await live_items_query({'id': item_id, 'attachments.id': attachment_id}),
+        {'_id': 0, 'vault_id': 1, 'title': 1, 'attachments': {'$elemMatch': {'id': attachment_id}}}
+    )
+    if not item:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    attachment = item['attachments'][0]
+    file = await attachment_store.find(attachment['file_id'])
+    if not file:
+        raise HTTPException(status_code=404, detail="Attachment content is missing")
+    
+    size = file['metadata']['size']
+    try:
+        byte_range = parse_range(request.headers.get('range'), size)
+    except RangeNotSatisfiable as e:
+        raise HTTPException(status_code=416, detail=str(e), headers={'Content-Range': f'bytes */{size}'})
+    start, end = byte_range or (0, size - 1)
+    
+    details = {'title': item['title'], 'filename': attachment['filename']}
+    if byte_range:
+        details['range'] = [start, end]
+    await log_audit('attachment_downloaded', current_user, request, item_id=item_id, vault_id=item['vault_id'], details=details)
+    
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'Content-Length': str(end - start + 1),
+        'Content-Disposition': f"attachment; filename*=UTF-8''{quote(attachment['filename'])}"
+    }
+    if byte_range:
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return StreamingResponse(
+        attachment_store.stream(file, start, end),
+        status_code=206 if byte_range else 200,
+        media_type=attachment['content_type'],
+        headers=headers
+    )
+
+@api_router.delete("/items/{item_id}/attachments/{attachment_id}")
+async def delete_attachment(item_id: str, attachment_id: str, current_user: User = Depends(get_current_user), request: Request = None):
+    """Remove an attachment from an item (the file goes once nothing references it)"""
+    item = await update_or_404(
+        db.items,
+        await live_items_query({'id': item_id, 'attachments.id': attachment_id}),
+        {'$pull': {'attachments': {'id': attachment_id}}, '$set': {'updated_at': datetime.now(timezone.utc), 'updated_by': current_user.id}},
+        "Attachment not found",
+        projection={'_id': 0, 'vault_id': 1, 'title': 1, 'attachments': {'$elemMatch': {'id': attachment_id}}},
+        before=True
+    )
+    
+    await log_audit('attachment_deleted', current_user, request, item_id=item_id, vault_id=item['vault_id'], details={'title': item['title'], 'filename': item['attachments'][0]['filename']})
+    
+    return {"message": "Attachment deleted successfully"}
+
 
 # ============= AUDIT ROUTES =============
 
@@ -907,10 +1820,12 @@ async def get_audit_logs(
     user_id: Optional[str] = None,
     item_id: Optional[str] = None,
     vault_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
     limit: int = 100,
     current_user: User = Depends(get_current_user)
 ):
-    """Get audit logs with filters"""
+    """Get audit logs with filters (only the monthly partitions overlapping start/end are read)"""
     query = {}
     
     if event_type:
@@ -922,27 +1837,190 @@ async def get_audit_logs(
     if vault_id:
         query['vault_id'] = vault_id
     
-    logs = await db.audit_logs.find(query).sort('timestamp', -1).limit(limit).to_list(limit)
+    logs = await audit_store.find(query, start=start, end=end, limit=limit)
+    
+    # Enrich logs with vault and item names, one lookup per collection
+    vault_ids = list({log['vault_id'] for log in logs if log.get('vault_id')})
+    item_ids = list({log['item_id'] for log in logs if log.get('item_id')})
+    vaults = await db.vaults.find({'id': {'$in': vault_ids}}, {'_id': 0, 'id': 1, 'name': 1}).to_list(len(vault_ids)) if vault_ids else []
+    items = await db.items.find({'id': {'$in': item_ids}}, {'_id': 0, 'id': 1, 'title': 1}).to_list(len(item_ids)) if item_ids else []
+    vault_names = {v['id']: v['name'] for v in vaults}
+    item_titles = {i['id']: i['title'] for i in items}
     
-    # Enrich logs with vault and item names
     enriched_logs = []
     for log in logs:
         log_dict = AuditLog(**log).dict()
         
         # Add vault name
         if log.get('vault_id'):
-            vault = await db.vaults.find_one({'id': log['vault_id']})
-            log_dict['details']['vault_name'] = vault['name'] if vault else 'Unknown Vault'
+            log_dict['details']['vault_name'] = vault_names.get(log['vault_id'], 'Unknown Vault')
         
         # Add item title
         if log.get('item_id'):
-            item = await db.items.find_one({'id': log['item_id']})
-            log_dict['details']['item_title'] = item['title'] if item else log_dict['details'].get('title', 'Unknown Item')
+            log_dict['details']['item_title'] = item_titles.get(log['item_id']) or log_dict['details'].get('title', 'Unknown Item')
         
         enriched_logs.append(AuditLog(**log_dict))
     
     return enriched_logs
 
+@api_router.get("/audit/archives")
+async def get_audit_archives(current_user: User = Depends(get_current_user)):
+    """Months moved to cold storage (Admin only)"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Only admins can view audit archives")
+    
+    archives = await db.audit_archives.find({}, {'path': 0}).sort('_id', -1).to_list(None)
+    return [{'partition': a.pop('_id'), **a} for a in archives]
+
+@api_router.get("/audit/archive/scan")
+async def scan_audit_archive(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    event_type: Optional[str] = None,
+    user_id: Optional[str] = None,
+    item_id: Optional[str] = None,
+    vault_id: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Stream archived audit events as NDJSON, oldest first (Admin only)"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Only admins can scan audit archives")
+    
+    filters = {
+        field: value
+        for field, value in {'event_type': event_type, 'user_id': user_id, 'item_id': item_id, 'vault_id': vault_id}.items()
+        if value
+    }
+    archives = await audit_store.archives(start, end)
+    
+    # A sync generator: Starlette iterates it in a worker thread, off the event loop
+    return StreamingResponse(
+        audit_store.scan([a['path'] for a in archives], filters, start=start, end=end),
+        media_type='application/x-ndjson'
+    )
+
+@api_router.post("/audit/verify")
+async def verify_audit_chain(request: Request, full: bool = False, current_user: User = Depends(get_current_user)):
+    """Verify the audit hash chain since the last checkpoint, or all hot entries with full=true (Admin only)"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Only admins can verify the audit log")
+    
+    result = await audit_verifier.verify(full=full)
+    await log_audit('audit_verified', current_user, request, details={
+        'ok': result['ok'],
+        'full': full,
+        'verified': result['verified'],
+        'problems': len(result['problems'])
+    })
+    return result
+
+@api_router.get("/audit/checkpoints")
+async def get_audit_checkpoints(current_user: User = Depends(get_current_user)):
+    """Merkle checkpoints of verified audit blocks (Admin only)"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Only admins can view audit checkpoints")
+    
+    checkpoints = await audit_verifier.checkpoints()
+    return [{'block': c.pop('_id'), **c} for c in checkpoints]
+
+
+# ============= AUDIT ANALYTICS ROUTES =============
+
+def analytics_range(start: Optional[date], end: Optional[date]) -> tuple:
+    """Inclusive day range of an analytics query as YYYY-MM-DD strings (default: the last N days)"""
+    end = end or datetime.now(timezone.utc).date()
+    start = start or end - timedelta(days=AUDIT_ANALYTICS_DEFAULT_DAYS - 1)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if (end - start).days >= AUDIT_ANALYTICS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"At most {AUDIT_ANALYTICS_MAX_DAYS} days can be queried at once")
+    return start.isoformat(), end.isoformat()
+
+@api_router.get("/audit/analytics/reveals")
+async def audit_reveals_per_user_day(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    user_id: Optional[str] = None,
+    vault_id: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Secret reveals per user and day (Admin only)"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Only admins can view audit analytics")
+    
+    start_day, end_day = analytics_range(start, end)
+    return {
+        'start': start_day,
+        'end': end_day,
+        'rows': await audit_rollups.reveals_per_user_day(start_day, end_day, user_id=user_id, vault_id=vault_id)
+    }
+
+@api_router.get("/audit/analytics/top-items")
+async def audit_top_revealed_items(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    vault_id: Optional[str] = None,
+    limit: int = 10,
+    current_user: User = Depends(get_current_user)
+):
+    """Most revealed items (Admin only)"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Only admins can view audit analytics")
+    
+    start_day, end_day = analytics_range(start, end)
+    rows = await audit_rollups.top_items(start_day, end_day, vault_id=vault_id, limit=max(1, min(limit, 100)))
+    
+    item_ids = [row['item_id'] for row in rows if row['item_id']]
+    items = await db.items.find({'id': {'$in': item_ids}}, {'_id': 0, 'id': 1, 'title': 1}).to_list(len(item_ids)) if item_ids else []
+    titles = {i['id']: i['title'] for i in items}
+    for row in rows:
+        row['item_title'] = titles.get(row['item_id'], 'Unknown Item')
+    
+    return {'start': start_day, 'end': end_day, 'rows': rows}
+
+@api_router.get("/audit/analytics/failed-access")
+async def audit_failed_access(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    user_id: Optional[str] = None,
+    vault_id: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Denied JIT and break-glass requests per day (Admin only)"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Only admins can view audit analytics")
+    
+    start_day, end_day = analytics_range(start, end)
+    return {
+        'start': start_day,
+        'end': end_day,
+        'rows': await audit_rollups.failed_access(start_day, end_day, user_id=user_id, vault_id=vault_id)
+    }
+
+@api_router.get("/audit/analytics/anomalies")
+async def audit_anomalies(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    threshold: int = AUDIT_ANOMALY_DAILY_REVEALS,
+    current_user: User = Depends(get_current_user)
+):
+    """Users revealing unusually many secrets in a day, and emergency access (Admin only)"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Only admins can view audit analytics")
+    
+    start_day, end_day = analytics_range(start, end)
+    return {'start': start_day, 'end': end_day, **await audit_rollups.anomalies(start_day, end_day, threshold)}
+
+@api_router.post("/audit/analytics/rebuild")
+async def rebuild_audit_rollups(request: Request, current_user: User = Depends(get_current_user)):
+    """Recompute the daily counters from the audit events still in MongoDB (Admin only)"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Only admins can rebuild audit analytics")
+    
+    result = await audit_rollups.rebuild(audit_store, client)
+    await log_audit('audit_rollups_rebuilt', current_user, request, details=result)
+    return result
+
 
 # ============= JIT ROUTES =============
 
@@ -990,24 +2068,24 @@ async def approve_jit_request(request_id: str, current_user: User = Depends(get_
     if current_user.role not in ['admin', 'manager']:
         raise HTTPException(status_code=403, detail="Only managers and admins can approve")
     
-    jit_request = await db.jit_requests.find_one({'id': request_id})
+    jit_request = await db.jit_requests.find_one({'id': request_id}, {'_id': 0, 'requested_duration_hours': 1})
     if not jit_request:
         raise HTTPException(status_code=404, detail="Request not found")
     
-    if jit_request['status'] != 'pending':
-        raise HTTPException(status_code=400, detail="Request already processed")
-    
     expires_at = datetime.now(timezone.utc) + timedelta(hours=jit_request['requested_duration_hours'])
     
-    await db.jit_requests.update_one(
-        {'id': request_id},
-        {'$set': {
+    jit_request = await decide_pending_request(
+        db.jit_requests,
+        request_id,
+        {
             'status': 'approved',
             'approved_by': current_user.id,
             'approved_at': datetime.now(timezone.utc),
             'expires_at': expires_at
-        }}
+        },
+        projection={'_id': 0, 'requester_id': 1, 'item_id': 1, 'vault_id': 1}
     )
+    await jit_grants.grant(request_id, jit_request['requester_id'], jit_request['item_id'], jit_request['vault_id'], expires_at)
     
     await log_audit('jit_approved', current_user, request, item_id=jit_request['item_id'], vault_id=jit_request['vault_id'], details={'request_id': request_id})
     
@@ -1025,16 +2103,11 @@ async def deny_jit_request(request_id: str, current_user: User = Depends(get_cur
     if current_user.role not in ['admin', 'manager']:
         raise HTTPException(status_code=403, detail="Only managers and admins can deny")
     
-    jit_request = await db.jit_requests.find_one({'id': request_id})
-    if not jit_request:
-        raise HTTPException(status_code=404, detail="Request not found")
-    
-    if jit_request['status'] != 'pending':
-        raise HTTPException(status_code=400, detail="Request already processed")
-    
-    await db.jit_requests.update_one(
-        {'id': request_id},
-        {'$set': {'status': 'denied', 'approved_by': current_user.id, 'approved_at': datetime.now(timezone.utc)}}
+    jit_request = await decide_pending_request(
+        db.jit_requests,
+        request_id,
+        {'status': 'denied', 'approved_by': current_user.id, 'approved_at': datetime.now(timezone.utc)},
+        projection={'_id': 0, 'item_id': 1, 'vault_id': 1}
     )
     
     await log_audit('jit_denied', current_user, request, item_id=jit_request['item_id'], vault_id=jit_request['vault_id'], details={'request_id': request_id})
@@ -1042,6 +2115,97 @@ async def deny_jit_request(request_id: str, current_user: User = Depends(get_cur
     return {"message": "Request denied"}
 
 
+async def expire_jit_grants():
+    """Mark approved JIT requests whose window has passed as expired"""
+    result = await db.jit_requests.update_many(
+        {'status': 'approved', 'expires_at': {'$lte': datetime.now(timezone.utc)}},
+        {'$set': {'status': 'expired'}}
+    )
+    jit_grants.prune()
+    if result.modified_count:
+        logger.info(f"Expired {result.modified_count} JIT grants")
+    return result.modified_count
+
+async def run_jit_expirer():
+    """Background loop for expire_jit_grants"""
+    while True:
+        try:
+            await expire_jit_grants()
+        except Exception as e:
+            logger.error(f"Error expiring JIT grants: {str(e)}")
+        await asyncio.sleep(JIT_EXPIRY_INTERVAL_SECONDS)
+
+
+@api_router.post("/jit/approve-batch")
+async def approve_jit_requests_batch(batch: BatchDecisionRequest, current_user: User = Depends(get_current_user), request: Request = None):
+    """Approve several JIT requests at once (Manager/Admin only)"""
+    if current_user.role not in ['admin', 'manager']:
+        raise HTTPException(status_code=403, detail="Only managers and admins can approve")
+    
+    now = datetime.now(timezone.utc)
+    approved = await apply_batch_decision(
+        db.jit_requests,
+        batch.request_ids,
+        lambda req: {
+            'status': 'approved',
+            'approved_by': current_user.id,
+            'approved_at': now,
+            'expires_at': now + timedelta(hours=req['requested_duration_hours'])
+        }
+    )
+    if not approved:
+        return {"approved": [], "skipped": batch.request_ids}
+    
+    expires = {req['id']: now + timedelta(hours=req['requested_duration_hours']) for req in approved}
+    await jit_grants.grant_many([
+        {'_id': req['id'], 'user_id': req['requester_id'], 'item_id': req['item_id'], 'vault_id': req['vault_id'], 'expires_at': expires[req['id']]}
+        for req in approved
+    ])
+    
+    await log_audit_many([
+        await build_audit_entry('jit_approved', current_user, request, item_id=req['item_id'], vault_id=req['vault_id'], details={'request_id': req['id'], 'batch': True})
+        for req in approved
+    ])
+    
+    # Send one digest notification
+    names, titles = await resolve_names(approved)
+    lines = [
+        f"• {names.get(req['requester_id'], 'Unknown')} → {titles.get(req['item_id'], 'Unknown')} (expires {expires[req['id']].strftime('%Y-%m-%d %H:%M UTC')})"
+        for req in approved
+    ]
+    notify_in_background(f"✅ {len(approved)} JIT Access Requests Approved by {current_user.name}\n\n" + "\n".join(lines))
+    
+    approved_ids = [req['id'] for req in approved]
+    return {
+        "approved": approved_ids,
+        "skipped": [rid for rid in batch.request_ids if rid not in approved_ids]
+    }
+
+@api_router.post("/jit/deny-batch")
+async def deny_jit_requests_batch(batch: BatchDecisionRequest, current_user: User = Depends(get_current_user), request: Request = None):
+    """Deny several JIT requests at once (Manager/Admin only)"""
+    if current_user.role not in ['admin', 'manager']:
+        raise HTTPException(status_code=403, detail="Only managers and admins can deny")
+    
+    now = datetime.now(timezone.utc)
+    denied = await apply_batch_decision(
+        db.jit_requests,
+        batch.request_ids,
+        lambda req: {'status': 'denied', 'approved_by': current_user.id, 'approved_at': now}
+    )
+    
+    await log_audit_many([
+        await build_audit_entry('jit_denied', current_user, request, item_id=req['item_id'], vault_id=req['vault_id'], details={'request_id': req['id'], 'batch': True})
+        for req in denied
+    ])
+    
+    denied_ids = [req['id'] for req in denied]
+    return {
+        "denied": denied_ids,
+        "skipped": [rid for rid in batch.request_ids if rid not in denied_ids]
+    }
+
+
 # ============= NOTIFICATIONS ROUTES =============
 
 @api_router.get("/notifications")
@@ -1138,12 +2302,13 @@ async def create_one_time_link(
 ):
     """Create a one-time view link for an item"""
     # Get item
-    item = await db.items.find_one({'id': item_id})
+    item = await db.items.find_one(await live_items_query({'id': item_id}))
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
     
     # Generate unique token
     token = str(uuid.uuid4())
+    invalid_token_cache.discard(('one_time', token))
     
     # Create one-time secret
     expires_at = datetime.now(timezone.utc) + timedelta(hours=link_request.expires_hours)
@@ -1161,7 +2326,7 @@ async def create_one_time_link(
     secret_dict['expires_at'] = expires_at.isoformat()
     secret_dict['created_at'] = datetime.now(timezone.utc).isoformat()
     
-    await db.one_time_secrets.insert_one(secret_dict)
+    await get_collection(db, 'one_time_secrets', 'secret_write').insert_one(secret_dict)
     
     # Log audit
     await log_audit(
@@ -1188,49 +2353,31 @@ async def create_one_time_link(
 @api_router.get("/view-secret/{token}")
 async def view_one_time_secret(token: str, request: Request):
     """View a one-time secret (public endpoint)"""
-    # Find secret
-    secret = await db.one_time_secrets.find_one({'token': token})
+    await guard_public_token(request, 'one_time', token, "Secret not found or already viewed")
+    
+    # Claim and delete the secret in one atomic step, so a concurrent view finds nothing
+    secret = await delete_returning(db.one_time_secrets, {'token': token})
+    remember_invalid_token('one_time', token)
     
     if not secret:
         raise HTTPException(status_code=404, detail="Secret not found or already viewed")
     
     # Check if expired
     if datetime.fromisoformat(secret['expires_at']).replace(tzinfo=timezone.utc) < datetime.now(timezone.utc):
-        await db.one_time_secrets.delete_one({'token': token})
         raise HTTPException(status_code=410, detail="This secret has expired")
     
     # Check if already viewed
     if secret['current_views'] >= secret['max_views']:
-        await db.one_time_secrets.delete_one({'token': token})
         raise HTTPException(status_code=410, detail="This secret has already been viewed")
     
     # Get item details
-    item = await db.items.find_one({'id': secret['item_id']})
+    item = await db.items.find_one(await live_items_query({'id': secret['item_id']}))
     if not item:
-        await db.one_time_secrets.delete_one({'token': token})
         raise HTTPException(status_code=404, detail="Associated item not found")
     
     # Decrypt password
     password_decrypted = fernet.decrypt(item['password_encrypted'].encode()).decode()
     
-    # Get client IP
-    client_ip = await get_client_ip(request)
-    
-    # Update view count and delete
-    await db.one_time_secrets.update_one(
-        {'token': token},
-        {
-            '$set': {
-                'current_views': secret['current_views'] + 1,
-                'viewed_at': datetime.now(timezone.utc),
-                'viewed_by_ip': client_ip
-            }
-        }
-    )
-    
-    # Delete the secret after viewing
-    await db.one_time_secrets.delete_one({'token': token})
-    
     # Return secret details (without sensitive vault info)
     return {
         "title": item['title'],
@@ -1335,22 +2482,17 @@ async def approve_breakglass_request(request_id: str, current_user: User = Depen
     if current_user.role not in ['admin', 'manager']:
         raise HTTPException(status_code=403, detail="Only admins and managers can approve")
     
-    bg_request = await db.breakglass_requests.find_one({'id': request_id})
-    if not bg_request:
-        raise HTTPException(status_code=404, detail="Request not found")
-    
-    if bg_request['status'] != 'pending':
-        raise HTTPException(status_code=400, detail="Request already processed")
-    
     # Approve with single approval
-    await db.breakglass_requests.update_one(
-        {'id': request_id},
-        {'$set': {
+    bg_request = await decide_pending_request(
+        db.breakglass_requests,
+        request_id,
+        {
             'approver1_id': current_user.id,
             'approver1_at': datetime.now(timezone.utc),
             'status': 'approved',
             'completed_at': datetime.now(timezone.utc)
-        }}
+        },
+        projection={'_id': 0, 'requester_id': 1, 'item_id': 1, 'vault_id': 1}
     )
     await log_audit('breakglass_approved', current_user, request, item_id=bg_request['item_id'], vault_id=bg_request['vault_id'], details={'request_id': request_id})
     
@@ -1368,20 +2510,15 @@ async def deny_breakglass_request(request_id: str, current_user: User = Depends(
     if current_user.role not in ['admin', 'manager']:
         raise HTTPException(status_code=403, detail="Only admins and managers can deny")
     
-    bg_request = await db.breakglass_requests.find_one({'id': request_id})
-    if not bg_request:
-        raise HTTPException(status_code=404, detail="Request not found")
-    
-    if bg_request['status'] != 'pending':
-        raise HTTPException(status_code=400, detail="Request already processed")
-    
-    await db.breakglass_requests.update_one(
-        {'id': request_id},
-        {'$set': {
+    bg_request = await decide_pending_request(
+        db.breakglass_requests,
+        request_id,
+        {
             'status': 'denied',
             'approver1_id': current_user.id,
             'approver1_at': datetime.now(timezone.utc)
-        }}
+        },
+        projection={'_id': 0, 'item_id': 1, 'vault_id': 1}
     )
     
     await log_audit('breakglass_denied', current_user, request, item_id=bg_request['item_id'], vault_id=bg_request['vault_id'], details={'request_id': request_id})
@@ -1389,91 +2526,280 @@ async def deny_breakglass_request(request_id: str, current_user: User = Depends(
     return {"message": "Break-glass request denied"}
 
 
+@api_router.post("/breakglass/approve-batch")
+async def approve_breakglass_requests_batch(batch: BatchDecisionRequest, current_user: User = Depends(get_current_user), request: Request = None):
+    """Approve several break-glass requests at once (Admin/Manager only)"""
+    if current_user.role not in ['admin', 'manager']:
+        raise HTTPException(status_code=403, detail="Only admins and managers can approve")
+    
+    now = datetime.now(timezone.utc)
+    approved = await apply_batch_decision(
+        db.breakglass_requests,
+        batch.request_ids,
+        lambda req: {
+            'approver1_id': current_user.id,
+            'approver1_at': now,
+            'status': 'approved',
+            'completed_at': now
+        }
+    )
+    if not approved:
+        return {"approved": [], "skipped": batch.request_ids}
+    
+    await log_audit_many([
+        await build_audit_entry('breakglass_approved', current_user, request, item_id=req['item_id'], vault_id=req['vault_id'], details={'request_id': req['id'], 'batch': True})
+        for req in approved
+    ])
+    
+    # Send one digest notification
+    names, titles = await resolve_names(approved)
+    lines = [f"• {names.get(req['requester_id'], 'Unknown')} → {titles.get(req['item_id'], 'Unknown')}" for req in approved]
+    notify_in_background(f"✅ {len(approved)} BREAK-GLASS Requests Approved by {current_user.name}\n\n" + "\n".join(lines) + "\n\n🔓 Emergency access granted!")
+    
+    approved_ids = [req['id'] for req in approved]
+    return {
+        "approved": approved_ids,
+        "skipped": [rid for rid in batch.request_ids if rid not in approved_ids]
+    }
+
+@api_router.post("/breakglass/deny-batch")
+async def deny_breakglass_requests_batch(batch: BatchDecisionRequest, current_user: User = Depends(get_current_user), request: Request = None):
+    """Deny several break-glass requests at once (Admin/Manager only)"""
+    if current_user.role not in ['admin', 'manager']:
+        raise HTTPException(status_code=403, detail="Only admins and managers can deny")
+    
+    now = datetime.now(timezone.utc)
+    denied = await apply_batch_decision(
+        db.breakglass_requests,
+        batch.request_ids,
+        lambda req: {'status': 'denied', 'approver1_id': current_user.id, 'approver1_at': now}
+    )
+    
+    await log_audit_many([
+        await build_audit_entry('breakglass_denied', current_user, request, item_id=req['item_id'], vault_id=req['vault_id'], details={'request_id': req['id'], 'batch': True})
+        for req in denied
+    ])
+    
+    denied_ids = [req['id'] for req in denied]
+    return {
+        "denied": denied_ids,
+        "skipped": [rid for rid in batch.request_ids if rid not in denied_ids]
+    }
+
+
 # ============= CHECK-OUT/CHECK-IN ROUTES =============
 
+def checkout_available_filter(now: datetime) -> dict:
+    """Match items whose check-out lease is free or has lapsed"""
+    return {'$or': [
+        {'checked_out_by': None},
+        {'checkout_expires_at': {'$lte': now}},
+        # Leases taken before expiry was tracked
+        {'checkout_expires_at': None, 'checked_out_at': {'$lte': now - timedelta(minutes=CHECKOUT_LEASE_MINUTES)}}
+    ]}
+
+def release_expired_checkout(item: dict) -> dict:
+    """Present a lapsed check-out lease as checked in"""
+    expires_at = item.get('checkout_expires_at')
+    if item.get('checked_out_by') and expires_at:
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        if expires_at <= datetime.now(timezone.utc):
+            item.update({'checked_out_by': None, 'checked_out_by_name': None, 'checked_out_at': None, 'checkout_expires_at': None})
+    return item
+
 @api_router.post("/items/{item_id}/checkout")
-async def checkout_item(item_id: str, current_user: User = Depends(get_current_user), request: Request = None):
-    """Check-out item (lock for exclusive use)"""
-    item = await db.items.find_one({'id': item_id})
-    if not item:
-        raise HTTPException(status_code=404, detail="Item not found")
+async def checkout_item(item_id: str, lease_minutes: Optional[int] = None, current_user: User = Depends(get_current_user), request: Request = None):
+    """Check-out item (lock for exclusive use until the lease expires)"""
+    lease_minutes = min(lease_minutes or CHECKOUT_LEASE_MINUTES, CHECKOUT_MAX_LEASE_MINUTES)
+    if lease_minutes <= 0:
+        raise HTTPException(status_code=400, detail="Lease must be at least one minute")
     
-    if not item.get('requires_checkout'):
-        raise HTTPException(status_code=400, detail="This item does not require check-out")
-    
-    if item.get('checked_out_by'):
-        checked_out_user = await db.users.find_one({'id': item['checked_out_by']})
-        raise HTTPException(status_code=409, detail=f"Item already checked out by {checked_out_user['name'] if checked_out_user else 'another user'}")
+    now = datetime.now(timezone.utc)
+    expires_at = now + timedelta(minutes=lease_minutes)
     
-    await db.items.update_one(
-        {'id': item_id},
+    # Take the lease only if nobody holds it, in a single atomic operation
+    item = await update_returning(
+        db.items,
+        await live_items_query({'id': item_id, 'requires_checkout': True, **checkout_available_filter(now)}),
         {'$set': {
             'checked_out_by': current_user.id,
-            'checked_out_at': datetime.now(timezone.utc)
-        }}
+            'checked_out_by_name': current_user.name,
+            'checked_out_at': now,
+            'checkout_expires_at': expires_at
+        }},
+        projection={'_id': 0, 'vault_id': 1, 'title': 1},
+        before=True
     )
     
-    await log_audit('item_checked_out', current_user, request, item_id=item_id, vault_id=item['vault_id'], details={'title': item['title']})
+    if not item:
+        item = await db.items.find_one({'id': item_id}, {'_id': 0, 'requires_checkout': 1, 'checked_out_by_name': 1})
+        if not item:
+            raise HTTPException(status_code=404, detail="Item not found")
+        if not item.get('requires_checkout'):
+            raise HTTPException(status_code=400, detail="This item does not require check-out")
+        raise HTTPException(status_code=409, detail=f"Item already checked out by {item.get('checked_out_by_name') or 'another user'}")
+    
+    await log_audit('item_checked_out', current_user, request, item_id=item_id, vault_id=item['vault_id'], details={'title': item['title'], 'lease_minutes': lease_minutes})
     
-    return {"message": "Item checked out successfully", "checked_out_by": current_user.name}
+    return {"message": "Item checked out successfully", "checked_out_by": current_user.name, "expires_at": expires_at}
 
 @api_router.post("/items/{item_id}/checkin")
 async def checkin_item(item_id: str, current_user: User = Depends(get_current_user), request: Request = None):
     """Check-in item (release lock)"""
-    item = await db.items.find_one({'id': item_id})
-    if not item:
-        raise HTTPException(status_code=404, detail="Item not found")
-    
-    if not item.get('checked_out_by'):
-        raise HTTPException(status_code=400, detail="Item is not checked out")
-    
-    if item['checked_out_by'] != current_user.id and current_user.role not in ['admin', 'manager']:
-        raise HTTPException(status_code=403, detail="Only the user who checked out can check in (or admin/manager)")
+    query = {'id': item_id, 'checked_out_by': {'$ne': None}}
+    if current_user.role not in ['admin', 'manager']:
+        query['checked_out_by'] = current_user.id
     
-    await db.items.update_one(
-        {'id': item_id},
+    item = await update_returning(
+        db.items,
+        query,
         {'$set': {
             'checked_out_by': None,
-            'checked_out_at': None
-        }}
+            'checked_out_by_name': None,
+            'checked_out_at': None,
+            'checkout_expires_at': None
+        }},
+        projection={'_id': 0, 'vault_id': 1, 'title': 1},
+        before=True
     )
     
+    if not item:
+        item = await db.items.find_one({'id': item_id}, {'_id': 0, 'checked_out_by': 1})
+        if not item:
+            raise HTTPException(status_code=404, detail="Item not found")
+        if not item.get('checked_out_by'):
+            raise HTTPException(status_code=400, detail="Item is not checked out")
+        raise HTTPException(status_code=403, detail="Only the user who checked out can check in (or admin/manager)")
+    
     await log_audit('item_checked_in', current_user, request, item_id=item_id, vault_id=item['vault_id'], details={'title': item['title']})
     
     return {"message": "Item checked in successfully"}
 
+@api_router.get("/checkouts")
+async def get_active_checkouts(current_user: User = Depends(get_current_user)):
+    """List active check-out leases (own leases unless Admin/Manager)"""
+    query = {
+        'checked_out_by': {'$type': 'string'},
+        'checkout_expires_at': {'$gt': datetime.now(timezone.utc)}
+    }
+    if current_user.role not in ['admin', 'manager']:
+        query['checked_out_by'] = current_user.id
+    
+    leases = await db.items.find(
+        await live_items_query(query),
+        {'_id': 0, 'id': 1, 'title': 1, 'vault_id': 1, 'checked_out_by': 1, 'checked_out_by_name': 1, 'checked_out_at': 1, 'checkout_expires_at': 1}
+    ).sort('checkout_expires_at', 1).to_list(1000)
+    
+    return [
+        {
+            'item_id': lease['id'],
+            'title': lease['title'],
+            'vault_id': lease['vault_id'],
+            'checked_out_by': lease['checked_out_by'],
+            'checked_out_by_name': lease.get('checked_out_by_name'),
+            'checked_out_at': lease.get('checked_out_at'),
+            'expires_at': lease['checkout_expires_at']
+        }
+        for lease in leases
+    ]
+
 
 # ============= IMPORT ROUTES =============
 
+async def resolve_import_vaults(rows: List[ImportSheetRow], current_user: User, create: bool = True) -> Dict[str, str]:
+    """Vault id per path of the rows, creating the missing vaults (tagged from their first row) in one insert"""
+    paths = list(dict.fromkeys(row.vault_path for row in rows))
+    vaults = await db.vaults.find({'path': {'$in': paths}, 'deleted_at': None}, {'_id': 0, 'id': 1, 'path': 1}).to_list(None)
+    vault_ids = {vault['path']: vault['id'] for vault in vaults}
+    
+    new_vaults = []
+    for row in rows:
+        if row.vault_path in vault_ids:
+            continue
+        vault = Vault(
+            name=row.vault_path.split(' > ')[-1],
+            type='client',
+            path=row.vault_path,
+            owner_id=current_user.id,
+            tags={'client': row.client or '', 'squad': row.squad or ''},
+            tag_pairs=tag_pairs({'client': row.client, 'squad': row.squad})
+        )
+        vault_ids[row.vault_path] = vault.id
+        new_vaults.append(vault.dict())
+    if new_vaults and create:
+        await db.vaults.insert_many(new_vaults)
+    return vault_ids
+
+async def sync_sheet_import(rows: List[ImportSheetRow], dry_run: bool, prune: bool, current_user: User, request: Request) -> dict:
+    vault_ids = await resolve_import_vaults(rows, current_user, create=not dry_run)
+    
+    def build(row: Dict[str, Any], vault_id: str) -> dict:
+        item = Item(
+            vault_id=vault_id,
+            type=row['type'],
+            title=row['title'],
+            login=row['login'],
+            password_encrypted=encrypt_data(row['password']) if row['password'] else None,
+            login_url=row['login_url'],
+            owner_id=current_user.id,
+            environment=row['environment'],
+            criticality=row['criticality'],
+            tags={'client': row['client'] or '', 'squad': row['squad'] or ''},
+            tag_pairs=tag_pairs({'client': row['client'], 'squad': row['squad']}),
+            created_by=current_user.id,
+            updated_by=current_user.id
+        )
+        return item_document(item, row['password'])
+    
+    plan = await sheet_sync.plan([row.dict() for row in rows], vault_ids, build)
+    diff = plan.summary()
+    written = None
+    if not dry_run:
+        written = await sheet_sync.apply(plan, current_user.id, prune=prune)
+        await log_audit('import_synced', current_user, request, details={**diff, 'written': written, 'pruned': prune})
+    
+    return {
+        'mode': 'sync',
+        'dry_run': dry_run,
+        'diff': diff,
+        'written': written,
+        'changes': plan.changes,
+        'errors_count': len(plan.errors),
+        'errors': plan.errors
+    }
+
 @api_router.post("/import/sheets")
-async def import_from_sheets(rows: List[ImportSheetRow], current_user: User = Depends(get_current_user), request: Request = None):
-    """Import items from Google Sheets format"""
+async def import_from_sheets(
+    rows: List[ImportSheetRow],
+    mode: str = 'append',
+    dry_run: bool = False,
+    prune: bool = False,
+    current_user: User = Depends(get_current_user),
+    request: Request = None
+):
+    """Import items from Google Sheets format; mode=sync updates the items of earlier imports instead of duplicating them"""
+    if mode == 'sync':
+        if prune and current_user.role != 'admin':
+            raise HTTPException(status_code=403, detail="Only admins can prune items in a sync import")
+        return await sync_sheet_import(rows, dry_run, prune, current_user, request)
+    if mode != 'append':
+        raise HTTPException(status_code=400, detail="mode must be append or sync")
+    
     imported_count = 0
+    imported = []
     errors = []
+    vault_ids = await resolve_import_vaults(rows, current_user)
     
     for row in rows:
         try:
-            # Find or create vault
-            vault = await db.vaults.find_one({'path': row.vault_path})
-            
-            if not vault:
-                # Create vault
-                vault = Vault(
-                    name=row.vault_path.split(' > ')[-1],
-                    type='client',
-                    path=row.vault_path,
-                    owner_id=current_user.id,
-                    tags={'client': row.client or '', 'squad': row.squad or ''}
-                )
-                await db.vaults.insert_one(vault.dict())
-            
             # Create item
             password_encrypted = None
             if row.password:
                 password_encrypted = encrypt_data(row.password)
             
             item = Item(
-                vault_id=vault['id'],
+                vault_id=vault_ids[row.vault_path],
                 type=row.type,
                 title=row.title,
                 login=row.login,
@@ -1483,16 +2809,20 @@ async def import_from_sheets(rows: List[ImportSheetRow], current_user: User = De
                 environment=row.environment,
                 criticality=row.criticality,
                 tags={'client': row.client or '', 'squad': row.squad or ''},
+                tag_pairs=tag_pairs({'client': row.client, 'squad': row.squad}),
                 created_by=current_user.id,
                 updated_by=current_user.id
             )
             
-            await db.items.insert_one(item.dict())
+            doc = item_document(item, row.password)
+            await get_collection(db, 'items', 'secret_write').insert_one(doc)
+            imported.append(doc)
             imported_count += 1
             
         except Exception as e:
             errors.append({'row': row.dict(), 'error': str(e)})
     
+    await vault_rollups.added(imported)
     await log_audit('import_completed', current_user, request, details={'imported': imported_count, 'errors': len(errors)})
     
     return {
@@ -1551,7 +2881,7 @@ async def check_expiring_items():
                     'expires_at': item['expires_at'].isoformat()
                 }
             )
-            await db.audit_logs.insert_one(log_entry.dict())
+            await audit_chain.append([log_entry.dict()])
         
         return {
             'checked': len(expiring_items),
@@ -1577,8 +2907,8 @@ async def check_expiring_items():
 @api_router.get("/stats/dashboard")
 async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
     """Get dashboard statistics"""
-    total_vaults = await db.vaults.count_documents({})
-    total_items = await db.items.count_documents({})
+    total_vaults = await db.vaults.count_documents({'deleted_at': None})
+    total_items = await db.items.count_documents(await live_items_query({}))
     
     # Items expiring soon (next 7 days)
     seven_days_from_now = datetime.now(timezone.utc) + timedelta(days=7)
@@ -1590,7 +2920,7 @@ async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
     pending_jit = await db.jit_requests.count_documents({'status': 'pending'})
     
     # Recent activity
-    recent_logs = await db.audit_logs.find().sort('timestamp', -1).limit(10).to_list(10)
+    recent_logs = await audit_store.find({}, limit=10)
     
     return {
         'total_vaults': total_vaults,
@@ -1658,13 +2988,7 @@ async def update_user_role(user_id: str, role_data: UpdateRoleRequest, request:
     if role_data.role not in ['admin', 'manager', 'contributor', 'client']:
         raise HTTPException(status_code=400, detail="Invalid role")
     
-    result = await db.users.update_one(
-        {'id': user_id},
-        {'$set': {'role': role_data.role}}
-    )
-    
-    if result.modified_count == 0:
-        raise HTTPException(status_code=404, detail="User not found")
+    await update_or_404(db.users, {'id': user_id}, {'$set': {'role': role_data.role}}, "User not found", projection={'_id': 0, 'id': 1})
     
     # Log audit
     await log_audit(
@@ -1688,13 +3012,11 @@ async def update_user_status(user_id: str, status_data: UpdateStatusRequest, req
     if status_data.status not in ['active', 'inactive', 'pending']:
         raise HTTPException(status_code=400, detail="Invalid status")
     
-    result = await db.users.update_one(
-        {'id': user_id},
-        {'$set': {'status': status_data.status}}
-    )
+    await update_or_404(db.users, {'id': user_id}, {'$set': {'status': status_data.status}}, "User not found", projection={'_id': 0, 'id': 1})
     
-    if result.modified_count == 0:
-        raise HTTPException(status_code=404, detail="User not found")
+    # Tokens handed out before deactivation stay dead if the user is reactivated
+    if status_data.status == 'inactive':
+        await token_revocations.revoke_user(user_id, datetime.now(timezone.utc) + JWT_TOKEN_TTL)
     
     # Log audit
     await log_audit(
@@ -1710,6 +3032,135 @@ async def update_user_status(user_id: str, status_data: UpdateStatusRequest, req
     return {"message": "User status updated successfully"}
 
 
+# ============= CREDENTIAL HYGIENE ROUTES =============
+
+@api_router.get("/hygiene/reuse")
+async def get_password_reuse(vault_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """Groups of items sharing the same password, largest first (Admin/Manager only)"""
+    if current_user.role not in ['admin', 'manager']:
+        raise HTTPException(status_code=403, detail="Only admins and managers can view credential hygiene")
+    
+    groups = await credential_hygiene.reuse_groups(await live_items_query({}))
+    if vault_id:
+        groups = [g for g in groups if any(item['vault_id'] == vault_id for item in g['items'])]
+    return {
+        'groups': groups,
+        'counts': {
+            'groups': len(groups),
+            'reused_items': sum(g['count'] for g in groups),
+            'cross_vault_groups': sum(1 for g in groups if g['vaults'] > 1)
+        }
+    }
+
+@api_router.get("/hygiene/report")
+async def get_hygiene_report(vault_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """Reused and weak passwords per vault (Admin/Manager only)"""
+    if current_user.role not in ['admin', 'manager']:
+        raise HTTPException(status_code=403, detail="Only admins and managers can view credential hygiene")
+    
+    live = await live_items_query({})
+    groups = await credential_hygiene.reuse_groups(live)
+    weak = await credential_hygiene.weak_items(await live_items_query({'vault_id': vault_id}) if vault_id else live)
+    unchecked = await db.items.count_documents(
+        {'$and': [live, {'password_encrypted': {'$type': 'string'}, 'password_fingerprint': {'$exists': False}}]}
+    )
+    
+    vaults: Dict[str, dict] = {}
+    for group in groups:
+        for item in group['items']:
+            if vault_id and item['vault_id'] != vault_id:
+                continue
+            vaults.setdefault(item['vault_id'], {'vault_id': item['vault_id'], 'reused': [], 'weak': []})['reused'].append({
+                'item_id': item['id'],
+                'title': item['title'],
+                'type': item['type'],
+                'group': group['group'],
+                'shared_with': group['count'] - 1,
+                'other_vaults': len({i['vault_id'] for i in group['items']} - {item['vault_id']})
+            })
+    for item in weak:
+        vaults.setdefault(item['vault_id'], {'vault_id': item['vault_id'], 'reused': [], 'weak': []})['weak'].append({
+            'item_id': item['id'],
+            'title': item['title'],
+            'type': item['type'],
+            'weaknesses': item['password_weaknesses']
+        })
+    
+    names = await db.vaults.find({'id': {'$in': list(vaults)}}, {'_id': 0, 'id': 1, 'path': 1}).to_list(None)
+    paths = {v['id']: v['path'] for v in names}
+    report = sorted(vaults.values(), key=lambda v: paths.get(v['vault_id'], ''))
+    for v in report:
+        v['vault_path'] = paths.get(v['vault_id'])
+    
+    return {
+        'vaults': report,
+        'counts': {
+            'reused_items': sum(len(v['reused']) for v in report),
+            'weak_items': sum(len(v['weak']) for v in report),
+            'unchecked_items': unchecked
+        }
+    }
+
+@api_router.post("/hygiene/backfill")
+async def start_hygiene_backfill(current_user: User = Depends(get_current_user), request: Request = None):
+    """Fingerprint the passwords of items stored before fingerprints existed (Admin only); track it with GET /jobs/{id}"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Only admins can start the fingerprint backfill")
+    
+    job = await credential_hygiene.start_backfill(current_user.id)
+    if job is None:
+        raise HTTPException(status_code=409, detail="A fingerprint backfill is already running")
+    background_tasks.append(asyncio.create_task(credential_hygiene.backfill(job)))
+    
+    await log_audit('hygiene_backfill_started', current_user, request, details={'job_id': job['id']})
+    return {"message": "Backfill started", "job_id": job['id']}
+
+@api_router.post("/hygiene/breach-rescan")
+async def start_breach_rescan(current_user: User = Depends(get_current_user), request: Request = None):
+    """Recheck every item password against the breach corpus, e.g. after updating it (Admin only); track it with GET /jobs/{id}"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Only admins can start a breach rescan")
+    if credential_hygiene.breaches is None:
+        raise HTTPException(status_code=400, detail="No breached-password corpus configured (BREACH_CORPUS_PATH)")
+    # Write paths in this process check new passwords against the corpus the rescan uses
+    credential_hygiene.reload_breaches()
+    
+    job = await credential_hygiene.start_breach_rescan(current_user.id)
+    if job is None:
+        raise HTTPException(status_code=409, detail="A breach rescan is already running")
+    background_tasks.append(asyncio.create_task(credential_hygiene.rescan_breaches(job)))
+    
+    await log_audit('breach_rescan_started', current_user, request, details={'job_id': job['id'], 'corpus_hashes': len(credential_hygiene.breaches)})
+    return {"message": "Breach rescan started", "job_id": job['id']}
+
+
+# ============= JOB ROUTES =============
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str, current_user: User = Depends(get_current_user)):
+    """Status and progress of a background job (Admin/Manager only)"""
+    if current_user.role not in ['admin', 'manager']:
+        raise HTTPException(status_code=403, detail="Only admins and managers can view jobs")
+    
+    job = await db.jobs.find_one({'id': job_id}, {'_id': 0, 'vault_ids': 0, 'locked_until': 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+# ============= DEBUG ROUTES =============
+
+@api_router.get("/debug/query-profile")
+async def get_query_profile(current_user: User = Depends(get_current_user)):
+    """Explain-plan report of sampled queries per route (Admin only, QUERY_PROFILER mode)"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Only admins can view the query profile")
+    if not query_profiler:
+        raise HTTPException(status_code=404, detail="Query profiler is not enabled")
+    
+    return query_profiler.report()
+
+
 # ============= SETTINGS ROUTES =============
 
 @api_router.get("/settings/webhook")
@@ -1734,12 +3185,15 @@ async def update_webhook_settings(webhook_url: str, current_user: User = Depends
 @api_router.post("/admin/make-me-admin")
 async def make_me_admin(current_user: User = Depends(get_current_user)):
     """Emergency route to make current user admin (temporary)"""
-    result = await db.users.update_one(
+    previous = await update_returning(
+        db.users,
         {'id': current_user.id},
-        {'$set': {'role': 'admin'}}
+        {'$set': {'role': 'admin'}},
+        projection={'_id': 0, 'role': 1},
+        before=True
     )
     
-    if result.modified_count > 0:
+    if previous and previous['role'] != 'admin':
         return {"message": f"User {current_user.email} is now admin"}
     else:
         return {"message": "User is already admin"}
@@ -1754,8 +3208,130 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# Outermost, so latency covers CORS handling too
+app.add_middleware(MetricsMiddleware)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    """Prometheus metrics (request latency, MongoDB round trips), for scrapers holding METRICS_TOKEN"""
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(request.headers.get('authorization', '').encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Invalid metrics token", headers={'WWW-Authenticate': 'Bearer'})
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+# Indexes checked (and created if missing) at startup
+INDEXES = {
+    'users': [
+        ('id', {'unique': True}),
+        ('email', {}),
+    ],
+    'vaults': [
+        ('id', {'unique': True}),
+        ('path', {}),
+        ('client_share_token', {'partialFilterExpression': {'client_share_token': {'$type': 'string'}}}),
+        ('deleted_at', {'partialFilterExpression': {'deleted_at': {'$type': 'date'}}}),
+        ('purge_job_id', {'partialFilterExpression': {'purge_job_id': {'$type': 'string'}}}),
+        ([('tag_pairs.key', 1), ('tag_pairs.value', 1)], {}),
+    ],
+    'items': [
+        ('id', {'unique': True}),
+        ('vault_id', {}),
+        # Platform identifier lookups; multikey, one entry per identifier
+        ([('identifiers.field', 1), ('identifiers.value', 1)], {}),
+        # Tag filters and the tag facet; multikey, one entry per tag
+        ([('tag_pairs.key', 1), ('tag_pairs.value', 1)], {}),
+        # Password reuse groups and the weak-password report
+        ('password_fingerprint', {'partialFilterExpression': {'password_fingerprint': {'$type': 'string'}}}),
+        ('password_weaknesses', {}),
+        # Sheet sync: one item per (vault, type, title, login) among imported items
+        ('natural_key', {'unique': True, 'partialFilterExpression': {'natural_key': {'$type': 'string'}}}),
+        # Which attachment files are still referenced (the attachment sweeper)
+        ('attachments.file_id', {'partialFilterExpression': {'attachments.file_id': {'$exists': True}}}),
+        # Active check-out leases; lapsed leases are ignored by the queries that use it
+        ('checkout_expires_at', {'partialFilterExpression': {'checked_out_by': {'$type': 'string'}}}),
+    ],
+    'attachments.files': [
+        # Content addresses: identical uploads share one file
+        ('metadata.content_hash', {'unique': True, 'partialFilterExpression': {'metadata.content_hash': {'$type': 'string'}}}),
+        ('metadata.last_referenced_at', {}),
+    ],
+    # Pre-partitioning events, read until the archiver has moved them into audit_logs_YYYY_MM
+    'audit_logs': [
+        ([('timestamp', -1)], {}),
+    ],
+    'jit_requests': [
+        ('id', {'unique': True}),
+        ([('status', 1), ('expires_at', 1)], {}),
+        ([('status', 1), ('created_at', -1)], {}),
+        ('vault_id', {}),
+    ],
+    'breakglass_requests': [
+        ('id', {'unique': True}),
+        ([('status', 1), ('created_at', -1)], {}),
+        ('vault_id', {}),
+    ],
+    'one_time_secrets': [
+        ('token', {'unique': True}),
+        ('item_id', {}),
+    ],
+    'jobs': [
+        ('id', {'unique': True}),
+        ([('type', 1), ('status', 1), ('purge_after', 1)], {}),
+    ],
+}
+
+async def create_indexes():
+    await database.ensure_indexes(db, INDEXES)
+    await rate_limit_backend.ensure_indexes()
+    await jit_grants.ensure_indexes()
+    await item_history.ensure_indexes()
+    await audit_rollups.ensure_indexes()
+    await token_revocations.ensure_indexes()
+
+@app.on_event("startup")
+async def startup_db_client():
+    if db_settings.warmup:
+        await database.warm_up(db, db_settings)
+    await create_indexes()
+
+@app.on_event("startup")
+async def start_background_tasks():
+    await jit_grants.load()
+    background_tasks.append(asyncio.create_task(jit_grants.watch()))
+    if GOOGLE_CLIENT_ID:
+        # Without Google login configured there is nothing to verify, and possibly no network to fetch keys over
+        background_tasks.append(asyncio.create_task(google_jwks.run()))
+    await token_revocations.load()
+    background_tasks.append(asyncio.create_task(token_revocations.watch()))
+    background_tasks.append(asyncio.create_task(share_link_cache.watch()))
+    background_tasks.append(asyncio.create_task(run_jit_expirer()))
+    if query_profiler:
+        background_tasks.append(asyncio.create_task(query_profiler.run(db)))
+    background_tasks.append(asyncio.create_task(vault_purger.run(VAULT_PURGE_INTERVAL_SECONDS)))
+    background_tasks.append(asyncio.create_task(audit_store.run(AUDIT_ARCHIVE_INTERVAL_SECONDS)))
+    background_tasks.append(asyncio.create_task(identifier_index.backfill()))
+    background_tasks.append(asyncio.create_task(tag_index.backfill_all([db.vaults, db.items])))
+    background_tasks.append(asyncio.create_task(attachment_store.run(ATTACHMENT_SWEEP_INTERVAL_SECONDS)))
+    background_tasks.append(asyncio.create_task(vault_rollups.run(VAULT_ROLLUP_RECONCILE_INTERVAL_SECONDS)))
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    if query_profiler:
+        report = query_profiler.write_report(QUERY_PROFILER_REPORT)
+        logger.info(f"Query profile written to {QUERY_PROFILER_REPORT} ({report['flagged']} flagged)")
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    database.shutdown(client)
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await http_client.aclose()
\ No newline at end of file
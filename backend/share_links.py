@@ -0,0 +1,111 @@
+import asyncio
+import logging
+from typing import Dict, Hashable, Optional, Set
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Vault fields a cached link depends on: the token and its switch, tombstones, and what submissions read
+WATCHED_FIELDS = ('client_share_token', 'client_share_enabled', 'deleted_at', 'name', 'tags')
+
+
+def _touches_link(change: dict) -> bool:
+    if change['operationType'] != 'update':
+        # Replaced or deleted outright
+        return True
+    description = change.get('updateDescription') or {}
+    fields = list(description.get('updatedFields') or {}) + list(description.get('removedFields') or [])
+    return any(field.split('.', 1)[0] in WATCHED_FIELDS for field in fields)
+
+
+class ShareLinkCache:
+    """Share token -> vault summary of enabled client links, answered from memory.
+
+    Entries expire after `ttl` seconds. Links regenerated, disabled or
+    deleted on any worker are dropped through a change stream on the
+    vaults, keyed by the vault's `_id`; only changes to the fields a link
+    depends on count, so the item counters written on every submission do
+    not empty the cache. Deployments without change streams (standalone
+    mongod) fall back to rechecking the cached tokens every
+    `refresh_seconds`.
+    """
+
+    def __init__(self, collection, ttl: float = 60.0, maxsize: int = 10000, refresh_seconds: int = 30):
+        self.collection = collection
+        self.refresh_seconds = refresh_seconds
+        self._links = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._tokens_by_vault: Dict[Hashable, Set[str]] = {}
+
+    def get(self, token: str) -> Optional[dict]:
+        return self._links.get(token)
+
+    def set(self, token: str, vault: dict) -> None:
+        """Cache a resolved link; `vault` carries the vault's `_id`, which change events are keyed by"""
+        self._links.set(token, vault)
+        self._tokens_by_vault.setdefault(vault['_id'], set()).add(token)
+
+    def discard(self, token: str) -> None:
+        vault = self._links.get(token)
+        self._links.discard(token)
+        if vault is not None:
+            tokens = self._tokens_by_vault.get(vault['_id'], set())
+            tokens.discard(token)
+            if not tokens:
+                self._tokens_by_vault.pop(vault['_id'], None)
+
+    def discard_vault(self, vault_key: Hashable) -> None:
+        # Every token cached for the vault, in case an old one was resolved after the new one
+        for token in self._tokens_by_vault.pop(vault_key, set()):
+            self._links.discard(token)
+
+    def clear(self) -> None:
+        self._links.clear()
+        self._tokens_by_vault.clear()
+
+    async def refresh(self) -> int:
+        """Drop cached links that are no longer enabled; returns how many were dropped"""
+        # Entries that expired are only forgotten here
+        for vault_key, cached in list(self._tokens_by_vault.items()):
+            cached.intersection_update([token for token in cached if token in self._links])
+            if not cached:
+                del self._tokens_by_vault[vault_key]
+        tokens = [token for cached in self._tokens_by_vault.values() for token in cached]
+        if not tokens:
+            return 0
+        live = set(await self.collection.distinct(
+            'client_share_token',
+            {'client_share_token': {'$in': tokens}, 'client_share_enabled': True, 'deleted_at': None}
+        ))
+        stale = [token for token in tokens if token not in live]
+        for token in stale:
+            self.discard(token)
+        return len(stale)
+
+    async def watch(self) -> None:
+        """Follow vault changes made by other workers until cancelled"""
+        while True:
+            try:
+                async with self.collection.watch([{'$match': {'operationType': {'$in': ['update', 'replace', 'delete']}}}]) as stream:
+                    # Changes made while the stream was down are not replayed
+                    self.clear()
+                    async for change in stream:
+                        if _touches_link(change):
+                            self.discard_vault(change['documentKey']['_id'])
+            except OperationFailure as e:
+                logger.info(f"Vault change stream unavailable ({e.code}), rechecking share links every {self.refresh_seconds}s")
+                await self._poll()
+            except PyMongoError as e:
+                logger.error(f"Vault change stream interrupted: {str(e)}")
+                self.clear()
+                await asyncio.sleep(self.refresh_seconds)
+
+    async def _poll(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                await self.refresh()
+            except PyMongoError as e:
+                logger.error(f"Error rechecking share links: {str(e)}")
@@ -0,0 +1,224 @@
+import hashlib
+import hmac
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from cryptography.fernet import Fernet, InvalidToken
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from credential_hygiene import CredentialHygiene
+from item_history import ItemHistory
+from tag_index import tag_pairs
+from vault_rollups import VaultRollups
+
+logger = logging.getLogger(__name__)
+
+# Sheet columns a sync compares and overwrites; the natural key columns identify the item
+SYNCED_FIELDS = ['login_url', 'environment', 'criticality']
+TAG_COLUMNS = ['client', 'squad']
+
+# What a diff needs of each existing item (ciphertexts are read, never decrypted when a fingerprint exists)
+PROJECTION = {
+    '_id': 0, 'id': 1, 'vault_id': 1, 'type': 1, 'title': 1, 'login': 1, 'natural_key': 1, 'version': 1,
+    'login_url': 1, 'environment': 1, 'criticality': 1, 'expires_at': 1, 'tags': 1, 'password_encrypted': 1, 'password_fingerprint': 1
+}
+
+
+def natural_key(vault_id: str, item_type: str, title: str, login: Optional[str]) -> str:
+    """Identity of an imported row: (vault, type, title, login), hashed to a fixed-size indexable value"""
+    parts = [vault_id, item_type.strip(), title.strip(), (login or '').strip()]
+    return hashlib.sha256('\x1f'.join(parts).encode()).hexdigest()
+
+
+@dataclass
+class SyncPlan:
+    """Diff of a sheet against the items earlier syncs of it created"""
+    create: List[dict] = field(default_factory=list)
+    update: List[Tuple[dict, dict]] = field(default_factory=list)  # (existing item, changed fields)
+    adopt: List[Tuple[dict, str]] = field(default_factory=list)  # (unkeyed item, natural key)
+    unchanged: int = 0
+    remove: List[dict] = field(default_factory=list)
+    errors: List[dict] = field(default_factory=list)
+    changes: List[dict] = field(default_factory=list)
+
+    def summary(self) -> Dict[str, int]:
+        return {
+            'created': len(self.create),
+            'updated': len(self.update),
+            'unchanged': self.unchanged,
+            'removed': len(self.remove),
+            'errors': len(self.errors)
+        }
+
+
+class SheetSync:
+    """Idempotent spreadsheet import: rows are matched to items, not appended.
+
+    Items created by a sync carry a `natural_key` (a hash of vault, type,
+    title and login) under a unique index. Syncing a sheet again loads the
+    items of its vaults with one query, diffs them in memory and applies the
+    result as a single unordered bulk_write: an upsert per new row, a
+    version-conditional update per changed row and, with prune, a delete per
+    keyed item the sheet no longer lists. Passwords are compared through
+    their keyed fingerprints, so unchanged secrets are never decrypted.
+    Items imported before sync existed are adopted by the first sync that
+    finds their key, instead of being duplicated.
+    """
+
+    def __init__(self, db, fernet: Fernet, hygiene: CredentialHygiene, history: ItemHistory, rollups: VaultRollups, report_limit: int = 1000):
+        self.db = db
+        self.fernet = fernet
+        self.hygiene = hygiene
+        self.history = history
+        self.rollups = rollups
+        self.report_limit = report_limit
+
+    def _same_password(self, existing: dict, password: str) -> bool:
+        if isinstance(existing.get('password_fingerprint'), str):
+            return hmac.compare_digest(existing['password_fingerprint'], self.hygiene.fingerprint(password))
+        if not existing.get('password_encrypted'):
+            return False
+        # Only items the fingerprint backfill has not reached yet get here
+        try:
+            return self.fernet.decrypt(existing['password_encrypted'].encode()).decode() == password
+        except (InvalidToken, UnicodeDecodeError):
+            return False
+
+    def changes(self, existing: dict, row: Dict[str, Any]) -> Dict[str, Any]:
+        """Fields of `existing` that `row` changes, as they should be stored"""
+        changes: Dict[str, Any] = {name: row[name] for name in SYNCED_FIELDS if existing.get(name) != row[name]}
+        # Sheet columns overwrite their own tags; tags added in the app are kept
+        tags = {**(existing.get('tags') or {}), **{name: row.get(name) or '' for name in TAG_COLUMNS}}
+        if tags != (existing.get('tags') or {}):
+            changes['tags'] = tags
+            changes['tag_pairs'] = tag_pairs(tags)
+        # A blank password cell leaves the stored password alone
+        password = row.get('password')
+        if password and not self._same_password(existing, password):
+            changes['password_encrypted'] = self.fernet.encrypt(password.encode()).decode()
+            changes.update(self.hygiene.assess(password))
+        return changes
+
+    def _report(self, plan: SyncPlan, action: str, row: Dict[str, Any], fields: Optional[List[str]] = None) -> None:
+        if len(plan.changes) < self.report_limit:
+            plan.changes.append({
+                'action': action,
+                'vault_path': row.get('vault_path'),
+                'type': row['type'],
+                'title': row['title'],
+                'login': row.get('login'),
+                'fields': fields or []
+            })
+
+    async def plan(self, rows: List[Dict[str, Any]], vault_ids: Dict[str, str], build: Callable[[Dict[str, Any], str], dict]) -> SyncPlan:
+        """Diff `rows` against the items of their vaults; `build(row, vault_id)` makes the document of a new item"""
+        plan = SyncPlan()
+        existing = await self.db.items.find({'vault_id': {'$in': list(set(vault_ids.values()))}}, PROJECTION).to_list(None)
+        keyed = {item['natural_key']: item for item in existing if item.get('natural_key')}
+        unkeyed: Dict[str, dict] = {}
+        for item in existing:
+            if not item.get('natural_key'):
+                unkeyed.setdefault(natural_key(item['vault_id'], item['type'], item['title'], item.get('login')), item)
+        paths = {vault_id: path for path, vault_id in vault_ids.items()}
+
+        seen = set()
+        for row in rows:
+            vault_id = vault_ids[row['vault_path']]
+            key = natural_key(vault_id, row['type'], row['title'], row.get('login'))
+            if key in seen:
+                plan.errors.append({'row': row, 'error': "Duplicate of an earlier row (same vault, type, title and login)"})
+                continue
+            seen.add(key)
+
+            item = keyed.get(key)
+            adopted = item is None and key in unkeyed
+            if adopted:
+                item = unkeyed[key]
+            if item is None:
+                plan.create.append({**build(row, vault_id), 'natural_key': key})
+                self._report(plan, 'created', row)
+                continue
+
+            changes = self.changes(item, row)
+            if changes:
+                if adopted:
+                    changes['natural_key'] = key
+                plan.update.append((item, changes))
+                self._report(plan, 'updated', row, sorted(name for name in changes if name not in ('tag_pairs', 'natural_key', 'password_fingerprint', 'password_weaknesses')))
+            else:
+                plan.unchanged += 1
+                if adopted:
+                    plan.adopt.append((item, key))
+
+        for key, item in keyed.items():
+            if key not in seen:
+                plan.remove.append(item)
+                self._report(plan, 'removed', {**item, 'vault_path': paths.get(item['vault_id'])})
+        return plan
+
+    async def apply(self, plan: SyncPlan, user_id: str, prune: bool = False) -> Dict[str, int]:
+        """Write a plan with one bulk_write; returns what was actually written"""
+        now = datetime.now(timezone.utc)
+        operations = []
+        for doc in plan.create:
+            # An upsert, so a sync that is re-run or races another one cannot create the item twice
+            operations.append(UpdateOne({'natural_key': doc['natural_key']}, {'$setOnInsert': doc}, upsert=True))
+        for item, changes in plan.update:
+            # Conditional on the version read: an item edited meanwhile is left as its editor saved it
+            operations.append(UpdateOne(
+                {'id': item['id'], 'version': item.get('version')},
+                {'$set': {**changes, 'updated_at': now, 'updated_by': user_id}, '$inc': {'version': 1}}
+            ))
+        for item, key in plan.adopt:
+            operations.append(UpdateOne({'id': item['id'], 'natural_key': {'$exists': False}}, {'$set': {'natural_key': key}}))
+        if prune:
+            for item in plan.remove:
+                operations.append(DeleteOne({'id': item['id'], 'natural_key': item['natural_key']}))
+        if not operations:
+            return {'created': 0, 'updated': 0, 'removed': 0, 'failed': 0}
+
+        try:
+            result = (await self.db.items.bulk_write(operations, ordered=False)).bulk_api_result
+        except BulkWriteError as e:
+            result = e.details
+            for error in result['writeErrors']:
+                logger.warning(f"Sheet sync write {error['index']} failed: {error.get('errmsg')}")
+
+        written = 0
+        if plan.update:
+            ids = [item['id'] for item, _ in plan.update]
+            applied = {
+                item['id']: item.get('version')
+                for item in await self.db.items.find(
+                    {'id': {'$in': ids}, 'updated_at': now, 'updated_by': user_id}, {'_id': 0, 'id': 1, 'version': 1}
+                ).to_list(None)
+            }
+            # Items created before versioning count as version 0, like in update_item
+            history = [
+                (item, changes, (item.get('version') or 0) + 1)
+                for item, changes in plan.update
+                if applied.get(item['id']) == (item.get('version') or 0) + 1
+            ]
+            written = len(history)
+            await self.history.record_many(history, user_id)
+            # Like update_item: only criticality and expiry move an item between counters
+            await self.rollups.changed_many(
+                (item, {**item, **changes}) for item, changes, _ in history if 'criticality' in changes or 'expires_at' in changes
+            )
+        # Upserted ids are reported by operation index, and the creates come first
+        await self.rollups.added(plan.create[upserted['index']] for upserted in result.get('upserted', []))
+        if prune and plan.remove:
+            removed_ids = [item['id'] for item in plan.remove]
+            remaining = set(await self.db.items.distinct('id', {'id': {'$in': removed_ids}})) if result.get('nRemoved', 0) < len(removed_ids) else set()
+            await self.rollups.removed(item for item in plan.remove if item['id'] not in remaining)
+            await self.history.collection.delete_many({'item_id': {'$in': removed_ids}})
+
+        return {
+            'created': result.get('nUpserted', 0),
+            'updated': written,
+            'removed': result.get('nRemoved', 0),
+            'failed': len(result.get('writeErrors', []))
+        }
@@ -0,0 +1,85 @@
+import logging
+from typing import Any, Dict, List, Mapping, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Item fields counted by the facets endpoint, besides client, squad and tags
+FACET_FIELDS = ['type', 'environment', 'criticality']
+
+
+def tag_pairs(tags: Optional[Mapping[str, Any]]) -> List[Dict[str, str]]:
+    """Tags as a [{key, value}] array, which a multikey index can serve (empty values are left out)"""
+    pairs = []
+    for key, value in (tags or {}).items():
+        if value is None or str(value).strip() == '':
+            continue
+        pairs.append({'key': str(key).strip(), 'value': str(value).strip()})
+    return sorted(pairs, key=lambda pair: (pair['key'], pair['value']))
+
+
+def tag_filter(key: str, value: str) -> dict:
+    """Query for documents tagged key=value, normalized like `tag_pairs` stores them"""
+    return {'tag_pairs': {'$elemMatch': {'key': key.strip(), 'value': value.strip()}}}
+
+
+async def backfill(collection, batch_size: int = 1000) -> Dict[str, int]:
+    """Write `tag_pairs` on documents whose tags were stored before it existed, or have drifted from it"""
+    scanned = updated = 0
+    batch: List[UpdateOne] = []
+    async for doc in collection.find({}, {'_id': 1, 'tags': 1, 'tag_pairs': 1}).batch_size(batch_size):
+        scanned += 1
+        pairs = tag_pairs(doc.get('tags'))
+        if doc.get('tag_pairs') == pairs:
+            continue
+        # Conditional on the tags read, so a concurrent edit is never overwritten with stale pairs
+        batch.append(UpdateOne({'_id': doc['_id'], 'tags': doc.get('tags')}, {'$set': {'tag_pairs': pairs}}))
+        if len(batch) >= batch_size:
+            updated += (await collection.bulk_write(batch, ordered=False)).modified_count
+            batch = []
+    if batch:
+        updated += (await collection.bulk_write(batch, ordered=False)).modified_count
+    return {'scanned': scanned, 'updated': updated}
+
+
+async def backfill_all(collections: List[Any], batch_size: int = 1000) -> None:
+    """Backfill every collection that carries tags (run once at startup)"""
+    for collection in collections:
+        try:
+            result = await backfill(collection, batch_size)
+            logger.info(f"Tag index of {collection.name}: {result['updated']} of {result['scanned']} document(s) backfilled")
+        except PyMongoError as e:
+            logger.error(f"Error backfilling the tag index of {collection.name}: {str(e)}")
+
+
+def _count_by(expression: Any) -> List[dict]:
+    return [{'$group': {'_id': expression, 'count': {'$sum': 1}}}, {'$sort': {'count': -1, '_id': 1}}]
+
+
+def facet_pipeline(match: dict, tag_limit: int) -> List[dict]:
+    """One aggregation counting items per type, environment, criticality, client, squad and tag"""
+    facets: Dict[str, List[dict]] = {field: _count_by(f'${field}') for field in FACET_FIELDS}
+    # Client and squad are top-level fields on items created in the app, tags on imported ones
+    for field in ('client', 'squad'):
+        facets[field] = _count_by({'$ifNull': [f'${field}', f'$tags.{field}']})
+    facets['tags'] = [{'$unwind': '$tag_pairs'}] + _count_by('$tag_pairs') + [{'$limit': tag_limit}]
+    facets['total'] = [{'$count': 'count'}]
+    return [{'$match': match}, {'$facet': facets}]
+
+
+def facet_counts(result: Optional[dict]) -> Dict[str, Any]:
+    """Shape the $facet output as {facet: [{value, count}]}, dropping empty values"""
+    result = result or {}
+    counts: Dict[str, Any] = {
+        field: [{'value': row['_id'], 'count': row['count']} for row in result.get(field, []) if row['_id'] not in (None, '')]
+        for field in FACET_FIELDS + ['client', 'squad']
+    }
+    counts['tags'] = [
+        {'key': row['_id']['key'], 'value': row['_id']['value'], 'count': row['count']}
+        for row in result.get('tags', [])
+    ]
+    total = result.get('total')
+    counts['total'] = total[0]['count'] if total else 0
+    return counts
@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import logging
+import math
+from datetime import datetime, timezone
+from typing import Dict, Tuple
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Documents revoking every token of a user issued before a point in time
+USER_PREFIX = 'user:'
+
+
+def _aware(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (no false negatives, tunable false positives)"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = max(1, capacity)
+        self.size = max(64, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        # Double hashing: position i = h1 + i * h2
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class TokenRevocationList:
+    """Revoked JWTs, answered from memory.
+
+    Revocations live in their own collection with a TTL index on the
+    revoked token's expiry: `_id` is the token's `jti`, or `user:<id>` to
+    revoke every token a user was issued before `issued_before`. Each
+    worker keeps a Bloom filter of revoked jtis in front of an exact set,
+    so checking a token never touches MongoDB and most checks stop at the
+    filter. Other workers' revocations arrive through a change stream;
+    deployments without one (standalone mongod) fall back to polling.
+    """
+
+    def __init__(self, collection, refresh_seconds: int = 30, capacity: int = 100000, error_rate: float = 0.001):
+        self.collection = collection
+        self.refresh_seconds = refresh_seconds
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._filter = BloomFilter(capacity, error_rate)
+        self._revoked: Dict[str, datetime] = {}
+        # user_id -> (issued_before, expires_at)
+        self._user_cutoffs: Dict[str, Tuple[datetime, datetime]] = {}
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index('expires_at', expireAfterSeconds=0)
+
+    def add(self, revocation: dict) -> None:
+        expires_at = _aware(revocation['expires_at'])
+        if revocation['_id'].startswith(USER_PREFIX):
+            user_id = revocation['user_id']
+            cutoff = _aware(revocation['issued_before'])
+            current = self._user_cutoffs.get(user_id)
+            if current is None or current[0] < cutoff:
+                self._user_cutoffs[user_id] = (cutoff, expires_at)
+            return
+        jti = revocation['_id']
+        if jti not in self._revoked:
+            if self._filter.count >= self._filter.capacity:
+                # Full: drop lapsed revocations and resize before the false positive rate climbs
+                self.prune()
+            self._filter.add(jti)
+        self._revoked[jti] = expires_at
+
+    def _rebuild_filter(self, capacity: int) -> None:
+        self._filter = BloomFilter(max(self.capacity, capacity), self.error_rate)
+        for jti in self._revoked:
+            self._filter.add(jti)
+
+    async def revoke(self, jti: str, user_id: str, expires_at: datetime) -> None:
+        """Revoke one token until it would have expired anyway"""
+        revocation = {
+            '_id': jti,
+            'user_id': user_id,
+            'revoked_at': datetime.now(timezone.utc),
+            'expires_at': expires_at
+        }
+        await self.collection.replace_one({'_id': jti}, revocation, upsert=True)
+        self.add(revocation)
+
+    async def revoke_user(self, user_id: str, expires_at: datetime) -> None:
+        """Revoke every token issued to a user so far; `expires_at` is when the newest of them expires"""
+        now = datetime.now(timezone.utc)
+        revocation = {
+            '_id': f'{USER_PREFIX}{user_id}',
+            'user_id': user_id,
+            'issued_before': now,
+            'revoked_at': now,
+            'expires_at': expires_at
+        }
+        await self.collection.replace_one({'_id': revocation['_id']}, revocation, upsert=True)
+        self.add(revocation)
+
+    def is_revoked(self, payload: dict) -> bool:
+        """Whether a decoded token has been revoked (no database access)"""
+        cutoff = self._user_cutoffs.get(payload.get('user_id'))
+        if cutoff is not None and payload.get('iat', 0) < cutoff[0].timestamp():
+            return True
+        jti = payload.get('jti')
+        if jti is None or jti not in self._filter:
+            return False
+        # Filter hit: confirm against the exact set (false positives end here)
+        return jti in self._revoked
+
+    def prune(self) -> int:
+        """Drop revocations of tokens that have expired since, and rebuild the filter"""
+        now = datetime.now(timezone.utc)
+        lapsed = [jti for jti, expires_at in self._revoked.items() if expires_at <= now]
+        for jti in lapsed:
+            del self._revoked[jti]
+        for user_id in [u for u, (_, expires_at) in self._user_cutoffs.items() if expires_at <= now]:
+            del self._user_cutoffs[user_id]
+        self._rebuild_filter(len(self._revoked) * 2)
+        return len(lapsed)
+
+    async def load(self) -> None:
+        """Replace the in-memory revocations with the ones in the database"""
+        revocations = await self.collection.find({'expires_at': {'$gt': datetime.now(timezone.utc)}}).to_list(None)
+        self._revoked.clear()
+        self._user_cutoffs.clear()
+        self._filter = BloomFilter(max(self.capacity, len(revocations) * 2), self.error_rate)
+        for revocation in revocations:
+            self.add(revocation)
+
+    async def watch(self) -> None:
+        """Follow revocations made by other workers until cancelled"""
+        while True:
+            try:
+                async with self.collection.watch(full_document='updateLookup') as stream:
+                    await self.load()
+                    async for change in stream:
+                        if change['operationType'] in ('insert', 'replace', 'update') and change.get('fullDocument'):
+                            self.add(change['fullDocument'])
+            except OperationFailure as e:
+                logger.info(f"Token revocation change stream unavailable ({e.code}), polling every {self.refresh_seconds}s")
+                await self._poll()
+            except PyMongoError as e:
+                logger.error(f"Token revocation change stream interrupted: {str(e)}")
+                await asyncio.sleep(self.refresh_seconds)
+
+    async def _poll(self) -> None:
+        while True:
+            try:
+                await self.load()
+            except PyMongoError as e:
+                logger.error(f"Error refreshing token revocations: {str(e)}")
+            await asyncio.sleep(self.refresh_seconds)
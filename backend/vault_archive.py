@@ -0,0 +1,326 @@
+import logging
+import os
+import struct
+import uuid
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import zstandard
+from bson import json_util
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from pymongo.errors import BulkWriteError
+
+from attachment_store import BUCKET
+from database import update_returning
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'KKVAULT1'
+SALT_SIZE = 16
+NONCE_SIZE = 12
+LENGTH = struct.Struct('>I')
+FRAME_INDEX = struct.Struct('>Q')
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+# Canonical extended JSON keeps datetimes and number types exact across the round trip
+JSON_OPTIONS = json_util.CANONICAL_JSON_OPTIONS
+
+# Restore order: a vault before its items, an item before its history and files, a file's chunks before the file
+COLLECTIONS = ['vaults', 'items', 'item_history', 'attachment_chunks', 'attachment_files']
+# Record kinds stored under another collection name
+TARGETS = {'attachment_chunks': f'{BUCKET}.chunks', 'attachment_files': f'{BUCKET}.files'}
+# Stored attachment bytes per frame; chunks are ciphertext, so compression does not shrink them
+ATTACHMENT_FRAME_BYTES = 8 * 1024 * 1024
+
+JOB_TYPE = 'vault_archive_import'
+
+DUPLICATE_KEY = 11000
+
+
+class ArchiveError(Exception):
+    """The archive is not one, is truncated, or was sealed with another key"""
+
+
+def archive_key(master_key: str, salt: bytes) -> bytes:
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=salt, info=b'keykeeper vault archive v1').derive(master_key.encode())
+
+
+class ArchiveWriter:
+    """Vault archive, produced frame by frame.
+
+    Layout: MAGIC, a random salt, then frames of [4-byte length][nonce]
+    [AES-256-GCM ciphertext]. Each frame is zstd-compressed NDJSON of
+    {"c": collection, "d": document} records, sealed with a key derived
+    from the master key and the salt, and authenticated together with its
+    index, so frames cannot be reordered or dropped unnoticed. The first
+    frame is a $header record, the last an $end record with the counts.
+    """
+
+    def __init__(self, master_key: str):
+        self.salt = os.urandom(SALT_SIZE)
+        self._aead = AESGCM(archive_key(master_key, self.salt))
+        self._compressor = zstandard.ZstdCompressor(level=3)
+        self._index = 0
+
+    def preamble(self) -> bytes:
+        return MAGIC + self.salt
+
+    def frame(self, records: List[dict]) -> bytes:
+        plaintext = self._compressor.compress(
+            '\n'.join(json_util.dumps(record, json_options=JSON_OPTIONS) for record in records).encode()
+        )
+        nonce = os.urandom(NONCE_SIZE)
+        body = nonce + self._aead.encrypt(nonce, plaintext, FRAME_INDEX.pack(self._index))
+        self._index += 1
+        return LENGTH.pack(len(body)) + body
+
+
+class ArchiveReader:
+    """Incremental archive parser: feed bytes as they arrive, get whole frames back"""
+
+    def __init__(self, master_key: str):
+        self.master_key = master_key
+        self._buffer = bytearray()
+        self._aead: Optional[AESGCM] = None
+        self._decompressor = zstandard.ZstdDecompressor()
+        self._index = 0
+
+    def feed(self, data: bytes) -> List[Tuple[int, List[dict]]]:
+        """(frame index, records) of every frame completed by `data`"""
+        self._buffer += data
+        if self._aead is None:
+            preamble = len(MAGIC) + SALT_SIZE
+            if len(self._buffer) < preamble:
+                return []
+            if bytes(self._buffer[:len(MAGIC)]) != MAGIC:
+                raise ArchiveError("Not a vault archive")
+            self._aead = AESGCM(archive_key(self.master_key, bytes(self._buffer[len(MAGIC):preamble])))
+            del self._buffer[:preamble]
+
+        frames = []
+        while len(self._buffer) >= LENGTH.size:
+            (length,) = LENGTH.unpack_from(self._buffer)
+            if length > MAX_FRAME_SIZE or length <= NONCE_SIZE:
+                raise ArchiveError(f"Frame {self._index} has an invalid length")
+            if len(self._buffer) < LENGTH.size + length:
+                break
+            body = bytes(self._buffer[LENGTH.size:LENGTH.size + length])
+            del self._buffer[:LENGTH.size + length]
+            try:
+                plaintext = self._aead.decrypt(body[:NONCE_SIZE], body[NONCE_SIZE:], FRAME_INDEX.pack(self._index))
+            except InvalidTag:
+                raise ArchiveError(f"Frame {self._index} failed authentication (corrupted, or sealed with another ENCRYPTION_KEY)")
+            lines = self._decompressor.decompress(plaintext).decode().split('\n')
+            frames.append((self._index, [json_util.loads(line, json_options=JSON_OPTIONS) for line in lines if line]))
+            self._index += 1
+        return frames
+
+    def finish(self) -> None:
+        if self._aead is None or self._buffer:
+            raise ArchiveError("Archive is truncated")
+
+
+async def _chunks(cursor, size: int) -> AsyncIterator[List[dict]]:
+    chunk = []
+    async for doc in cursor:
+        chunk.append(doc)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def _attachment_frames(db, writer: ArchiveWriter, file_ids: List[str], counts: Dict[str, int]) -> AsyncIterator[bytes]:
+    """The GridFS files behind `file_ids`: each file's chunks in order, the file document in the frame of its last chunks"""
+    files = db[TARGETS['attachment_files']].find({'_id': {'$in': file_ids}, 'metadata.content_hash': {'$type': 'string'}}).sort('_id', 1)
+    async for file in files:
+        records: List[dict] = []
+        size = 0
+        async for chunk in db[TARGETS['attachment_chunks']].find({'files_id': file['_id']}).sort('n', 1):
+            records.append({'c': 'attachment_chunks', 'd': chunk})
+            size += len(chunk['data'])
+            if size >= ATTACHMENT_FRAME_BYTES:
+                counts['attachment_chunks'] += len(records)
+                yield writer.frame(records)
+                records, size = [], 0
+        counts['attachment_chunks'] += len(records)
+        counts['attachment_files'] += 1
+        yield writer.frame(records + [{'c': 'attachment_files', 'd': file}])
+
+
+async def export_vaults(db, vault_ids: List[str], header: dict, master_key: str, chunk_size: int = 1000) -> AsyncIterator[bytes]:
+    """Archive of the vaults, their items, item history and attachment files, one frame per cursor batch.
+
+    Only one batch (or a few MB of one attachment) is held at a time, so
+    memory stays flat however large the vaults are. Ciphertexts, attachment
+    chunks included, are copied as they are: the archive can only be
+    restored where the same ENCRYPTION_KEY is in use.
+    """
+    writer = ArchiveWriter(master_key)
+    counts = {name: 0 for name in COLLECTIONS}
+    exported_files = set()
+    yield writer.preamble()
+    yield writer.frame([{'c': '$header', **header}])
+
+    vaults = db.vaults.find({'id': {'$in': vault_ids}, 'deleted_at': None}, {'_id': 0}).sort('path', 1)
+    async for chunk in _chunks(vaults, chunk_size):
+        counts['vaults'] += len(chunk)
+        yield writer.frame([{'c': 'vaults', 'd': doc} for doc in chunk])
+
+    items = db.items.find({'vault_id': {'$in': vault_ids}}, {'_id': 0}).batch_size(chunk_size)
+    async for chunk in _chunks(items, chunk_size):
+        counts['items'] += len(chunk)
+        yield writer.frame([{'c': 'items', 'd': doc} for doc in chunk])
+        history = db.item_history.find({'item_id': {'$in': [item['id'] for item in chunk]}}, {'_id': 0}).batch_size(chunk_size)
+        async for entries in _chunks(history, chunk_size):
+            counts['item_history'] += len(entries)
+            yield writer.frame([{'c': 'item_history', 'd': doc} for doc in entries])
+        # Files go after the items that reference them, so the attachment sweeper never finds them unreferenced
+        file_ids = {attachment['file_id'] for item in chunk for attachment in item.get('attachments') or [] if attachment.get('file_id')}
+        file_ids -= exported_files
+        exported_files |= file_ids
+        async for frame in _attachment_frames(db, writer, sorted(file_ids), counts):
+            yield frame
+
+    yield writer.frame([{'c': '$end', 'counts': counts}])
+    logger.info(f"Exported vault {header.get('root_id')}: {counts}")
+
+
+def new_import_job(user_id: str) -> dict:
+    """Job document tracking an archive restore, so a failed one can be resumed"""
+    now = datetime.now(timezone.utc)
+    return {
+        'id': str(uuid.uuid4()),
+        'type': JOB_TYPE,
+        'status': 'running',  # running, completed, failed
+        'archive_id': None,
+        'created_by': user_id,
+        'created_at': now,
+        'updated_at': now,
+        'progress': {'frames': 0, 'vaults': 0, 'items': 0, 'item_history': 0, 'attachment_chunks': 0, 'attachment_files': 0, 'skipped': 0},
+        'last_error': None
+    }
+
+
+async def _adopt_files(db, files: List[dict]) -> None:
+    """Restored files that collided with a stored one: keep the stored copy of identical content and point the items at it"""
+    stored = db[TARGETS['attachment_files']]
+    for file in files:
+        if await stored.find_one({'_id': file['_id']}, {'_id': 1}):
+            # Restored before (a resumed restore), or never swept after the purge
+            continue
+        # Touched like an upload deduplicated onto it, so the sweeper keeps it while the items are rewritten
+        existing = await update_returning(
+            stored,
+            {'metadata.content_hash': file['metadata']['content_hash']},
+            {'$set': {'metadata.last_referenced_at': datetime.now(timezone.utc)}},
+            projection={'_id': 1}
+        )
+        if not existing:
+            # Swept meanwhile: the restored copy can take the address after all
+            await stored.insert_one(file)
+            continue
+        await db[TARGETS['attachment_chunks']].delete_many({'files_id': file['_id']})
+        async for item in db.items.find({'attachments.file_id': file['_id']}, {'_id': 0, 'id': 1, 'attachments': 1}):
+            attachments = [
+                {**attachment, 'file_id': existing['_id']} if attachment.get('file_id') == file['_id'] else attachment
+                for attachment in item['attachments']
+            ]
+            await db.items.update_one({'id': item['id'], 'attachments.file_id': file['_id']}, {'$set': {'attachments': attachments}})
+
+
+async def _insert(db, records: List[dict]) -> Dict[str, int]:
+    by_collection: Dict[str, List[dict]] = {}
+    for record in records:
+        by_collection.setdefault(record['c'], []).append(record['d'])
+    now = datetime.now(timezone.utc)
+    for file in by_collection.get('attachment_files', []):
+        # A fresh grace period, as for an upload
+        file['metadata']['last_referenced_at'] = now
+    counts = {'skipped': 0}
+    for name in COLLECTIONS:
+        docs = by_collection.get(name)
+        if not docs:
+            continue
+        # Documents already there (unique ids) are skipped, which is what makes a resumed restore safe
+        try:
+            inserted = len((await db[TARGETS.get(name, name)].insert_many(docs, ordered=False)).inserted_ids)
+        except BulkWriteError as e:
+            if any(error['code'] != DUPLICATE_KEY for error in e.details['writeErrors']):
+                raise
+            inserted = e.details['nInserted']
+            if name == 'attachment_files':
+                # Either the same file, or identical content stored under another id (the content_hash index)
+                await _adopt_files(db, [docs[error['index']] for error in e.details['writeErrors']])
+        counts[name] = inserted
+        counts['skipped'] += len(docs) - inserted
+    return counts
+
+
+async def import_archive(db, chunks: AsyncIterator[bytes], master_key: str, job: dict) -> Dict[str, int]:
+    """Restore an archive with one insert_many per collection and frame, recording progress on the job.
+
+    Frames the job has already committed are skipped, so uploading the
+    same archive again with the job resumes a restore that failed. If the
+    archived root vault's parent does not exist here, the root is restored
+    as a top-level vault and the subtree's paths are shortened to match.
+    Attachment files whose content is already stored here under another id
+    are not restored twice: their items are pointed at the stored copy.
+    """
+    reader = ArchiveReader(master_key)
+    resume_from = job['progress']['frames']
+    relocate: Optional[Tuple[str, str]] = None
+    ended = False
+
+    async for data in chunks:
+        for index, records in reader.feed(data):
+            kind = records[0]['c'] if records else None
+            if index == 0:
+                if kind != '$header':
+                    raise ArchiveError("Archive has no header")
+                header = records[0]
+                if job.get('archive_id') not in (None, header['archive_id']):
+                    raise ArchiveError("This job restores a different archive")
+                await db.jobs.update_one({'id': job['id']}, {'$set': {'archive_id': header['archive_id'], 'vault_id': header['root_id']}})
+                parent_id = header.get('root_parent_id')
+                if parent_id and not await db.vaults.find_one({'id': parent_id, 'deleted_at': None}, {'_id': 1}):
+                    relocate = (header['root_id'], f"{header['root_parent_path']} > ")
+                continue
+            if kind == '$end':
+                ended = True
+                continue
+            if index < resume_from:
+                continue
+
+            if relocate:
+                root_id, prefix = relocate
+                for record in records:
+                    if record['c'] == 'vaults':
+                        vault = record['d']
+                        if vault['id'] == root_id:
+                            vault['parent_id'] = None
+                        if vault['path'].startswith(prefix):
+                            vault['path'] = vault['path'][len(prefix):]
+            counts = await _insert(db, records)
+            await db.jobs.update_one(
+                {'id': job['id']},
+                {
+                    '$set': {'progress.frames': index + 1, 'updated_at': datetime.now(timezone.utc)},
+                    '$inc': {f'progress.{name}': count for name, count in counts.items()}
+                }
+            )
+
+    reader.finish()
+    if not ended:
+        raise ArchiveError("Archive is truncated")
+    job = await update_returning(
+        db.jobs,
+        {'id': job['id']},
+        {'$set': {'status': 'completed', 'completed_at': datetime.now(timezone.utc), 'updated_at': datetime.now(timezone.utc), 'last_error': None}},
+        projection={'_id': 0, 'progress': 1}
+    )
+    return job['progress'] if job else {}
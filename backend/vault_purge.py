@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from pymongo.errors import PyMongoError
+
+from database import update_returning
+
+logger = logging.getLogger(__name__)
+
+JOB_TYPE = 'vault_purge'
+
+
+def new_purge_job(vault_id: str, vault_ids: List[str], user_id: str, purge_after: datetime) -> dict:
+    """Job document for purging a soft-deleted vault and its descendants"""
+    now = datetime.now(timezone.utc)
+    return {
+        'id': str(uuid.uuid4()),
+        'type': JOB_TYPE,
+        'status': 'scheduled',  # scheduled, running, completed, cancelled
+        'vault_id': vault_id,
+        'vault_ids': vault_ids,
+        'created_by': user_id,
+        'created_at': now,
+        'updated_at': now,
+        'purge_after': purge_after,
+        'locked_until': None,
+        'progress': {
+            'items': 0,
+            'one_time_secrets': 0,
+            'jit_grants': 0,
+            'item_history': 0,
+            'jit_requests': 0,
+            'breakglass_requests': 0,
+            'vaults': 0
+        },
+        'last_error': None
+    }
+
+
+class VaultPurger:
+    """Background deletion of soft-deleted vaults, in bounded and throttled batches.
+
+    Deleting a vault only tombstones it and records a job in the `jobs`
+    collection. Once the restore window has passed, a worker claims the job
+    under a lease and deletes everything under the vaults batch by batch,
+    recording progress on the job. Every step is idempotent, so a job whose
+    worker died is picked up again when its lease lapses.
+    """
+
+    def __init__(self, db, batch_size: int = 500, batch_delay: float = 0.2, lease_seconds: int = 300):
+        self.db = db
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.lease_seconds = lease_seconds
+
+    async def claim(self) -> Optional[dict]:
+        """Take the lease on one due purge job, if any"""
+        now = datetime.now(timezone.utc)
+        return await update_returning(
+            self.db.jobs,
+            {
+                'type': JOB_TYPE,
+                'status': {'$in': ['scheduled', 'running']},
+                'purge_after': {'$lte': now},
+                '$or': [{'locked_until': None}, {'locked_until': {'$lte': now}}]
+            },
+            {'$set': {
+                'status': 'running',
+                'locked_until': now + timedelta(seconds=self.lease_seconds),
+                'updated_at': now
+            }},
+            projection={'_id': 0, 'id': 1, 'vault_id': 1, 'vault_ids': 1},
+            before=True
+        )
+
+    async def _record(self, job_id: str, counts: Dict[str, int]) -> None:
+        """Add to the job's progress counters and extend its lease"""
+        now = datetime.now(timezone.utc)
+        await self.db.jobs.update_one(
+            {'id': job_id},
+            {
+                '$inc': {f'progress.{name}': count for name, count in counts.items()},
+                '$set': {'locked_until': now + timedelta(seconds=self.lease_seconds), 'updated_at': now}
+            }
+        )
+        await asyncio.sleep(self.batch_delay)
+
+    async def _purge_items(self, job_id: str, vault_ids: List[str]) -> None:
+        while True:
+            batch = await self.db.items.find(
+                {'vault_id': {'$in': vault_ids}}, {'_id': 0, 'id': 1}
+            ).limit(self.batch_size).to_list(self.batch_size)
+            if not batch:
+                return
+            item_ids = [item['id'] for item in batch]
+            secrets = await self.db.one_time_secrets.delete_many({'item_id': {'$in': item_ids}})
+            grants = await self.db.jit_grants.delete_many({'item_id': {'$in': item_ids}})
+            history = await self.db.item_history.delete_many({'item_id': {'$in': item_ids}})
+            items = await self.db.items.delete_many({'id': {'$in': item_ids}})
+            await self._record(job_id, {
+                'items': items.deleted_count,
+                'one_time_secrets': secrets.deleted_count,
+                'jit_grants': grants.deleted_count,
+                'item_history': history.deleted_count
+            })
+
+    async def _purge_collection(self, job_id: str, name: str, query: dict) -> None:
+        collection = self.db[name]
+        while True:
+            batch = await collection.find(query, {'_id': 1}).limit(self.batch_size).to_list(self.batch_size)
+            if not batch:
+                return
+            result = await collection.delete_many({'_id': {'$in': [doc['_id'] for doc in batch]}})
+            await self._record(job_id, {name: result.deleted_count})
+
+    async def purge(self, job: dict) -> None:
+        """Delete the job's vaults and everything in them"""
+        vault_ids = job['vault_ids']
+        await self._purge_items(job['id'], vault_ids)
+        await self._purge_collection(job['id'], 'jit_requests', {'vault_id': {'$in': vault_ids}})
+        await self._purge_collection(job['id'], 'breakglass_requests', {'vault_id': {'$in': vault_ids}})
+        await self._purge_collection(job['id'], 'vaults', {'id': {'$in': vault_ids}, 'purge_job_id': job['id']})
+
+        await self.db.jobs.update_one(
+            {'id': job['id']},
+            {'$set': {
+                'status': 'completed',
+                'completed_at': datetime.now(timezone.utc),
+                'updated_at': datetime.now(timezone.utc),
+                'locked_until': None
+            }}
+        )
+        logger.info(f"Purged vault {job['vault_id']} ({len(vault_ids)} vault(s))")
+
+    async def run_once(self) -> int:
+        """Purge every due job; returns how many were completed"""
+        completed = 0
+        while True:
+            job = await self.claim()
+            if job is None:
+                return completed
+            try:
+                await self.purge(job)
+                completed += 1
+            except PyMongoError as e:
+                logger.error(f"Error purging vault {job['vault_id']}: {str(e)}")
+                await self.db.jobs.update_one({'id': job['id']}, {'$set': {'last_error': str(e)}})
+                return completed
+
+    async def run(self, interval: int) -> None:
+        """Purge due jobs every `interval` seconds until cancelled"""
+        while True:
+            try:
+                await self.run_once()
+            except PyMongoError as e:
+                logger.error(f"Error claiming vault purge jobs: {str(e)}")
+            await asyncio.sleep(interval)
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+from datetime import date, datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Vault field holding the counters of the items directly in it
+FIELD = 'item_counts'
+
+EXPIRING_WINDOWS = {'expiring_7d': 7, 'expiring_30d': 30}
+
+
+def _key(value: Any) -> str:
+    # Counter names become field names: no dots, no leading $
+    return str(value or 'unknown').replace('.', '_').lstrip('$') or 'unknown'
+
+
+def expiry_day(value: Optional[datetime]) -> Optional[str]:
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo:
+        value = value.astimezone(timezone.utc)
+    return value.date().isoformat()
+
+
+def item_delta(item: dict, sign: int = 1) -> Dict[str, int]:
+    """Counter increments for adding (sign=1) or removing (sign=-1) one item, as paths under `item_counts`"""
+    delta = {
+        'total': sign,
+        f"by_type.{_key(item.get('type'))}": sign,
+        f"by_criticality.{_key(item.get('criticality'))}": sign
+    }
+    day = expiry_day(item.get('expires_at'))
+    if day:
+        delta[f'expiry_days.{day}'] = sign
+    return delta
+
+
+def _combine(into: Dict[str, int], delta: Dict[str, int]) -> Dict[str, int]:
+    for path, count in delta.items():
+        into[path] = into.get(path, 0) + count
+        if not into[path]:
+            del into[path]
+    return into
+
+
+def _nest(counts: dict, delta: Dict[str, int]) -> dict:
+    for path, count in delta.items():
+        *parents, leaf = path.split('.')
+        node = counts
+        for name in parents:
+            node = node.setdefault(name, {})
+        node[leaf] = node.get(leaf, 0) + count
+    return counts
+
+
+def _nonzero(counts: Any) -> Any:
+    if not isinstance(counts, dict):
+        return counts
+    kept = {name: _nonzero(value) for name, value in counts.items()}
+    return {name: value for name, value in kept.items() if value not in (0, {})}
+
+
+def merge(total: dict, counts: dict) -> dict:
+    """Add one set of raw counters into another"""
+    for name, value in (counts or {}).items():
+        if isinstance(value, dict):
+            merge(total.setdefault(name, {}), value)
+        else:
+            total[name] = total.get(name, 0) + value
+    return total
+
+
+def view(counts: dict, today: date) -> Dict[str, Any]:
+    """Raw counters as the API returns them, with expiry days folded into buckets relative to today"""
+    counts = _nonzero(counts or {})
+    summary = {
+        'total': counts.get('total', 0),
+        'by_type': counts.get('by_type', {}),
+        'by_criticality': counts.get('by_criticality', {}),
+        'expired': 0,
+        **{bucket: 0 for bucket in EXPIRING_WINDOWS}
+    }
+    for day, count in counts.get('expiry_days', {}).items():
+        remaining = (date.fromisoformat(day) - today).days
+        if remaining < 0:
+            summary['expired'] += count
+        for bucket, days in EXPIRING_WINDOWS.items():
+            if 0 <= remaining <= days:
+                summary[bucket] += count
+    return summary
+
+
+def tree_rollups(vaults: List[dict], today: Optional[date] = None) -> Dict[str, Dict[str, Any]]:
+    """{vault_id: {direct, subtree}} for a list of vaults, subtree totals summed over their descendants in the list"""
+    today = today or datetime.now(timezone.utc).date()
+    children: Dict[str, List[str]] = {}
+    by_id = {vault['id']: vault for vault in vaults}
+    for vault in vaults:
+        if vault.get('parent_id') in by_id:
+            children.setdefault(vault['parent_id'], []).append(vault['id'])
+
+    subtree: Dict[str, dict] = {}
+
+    def total(vault_id: str) -> dict:
+        if vault_id not in subtree:
+            counts = merge({}, by_id[vault_id].get(FIELD) or {})
+            for child_id in children.get(vault_id, []):
+                merge(counts, total(child_id))
+            subtree[vault_id] = counts
+        return subtree[vault_id]
+
+    return {
+        vault['id']: {'direct': view(vault.get(FIELD), today), 'subtree': view(total(vault['id']), today)}
+        for vault in vaults
+    }
+
+
+class VaultRollups:
+    """Item counters per vault, kept on the vault document itself.
+
+    Every item write adds its increments (total, per type, per criticality
+    and per expiry day) to `item_counts` of the item's vault, so the vault
+    list carries them without an extra query. Expiry is counted per day
+    and bucketed (expired, expiring in 7/30 days) when read, so counters
+    never go stale as time passes. Subtree totals are summed over the tree
+    when the vault list is built, which also makes vault moves free. A
+    periodic reconciler recomputes the counters from the items and fixes
+    any drift.
+    """
+
+    def __init__(self, db, batch_size: int = 500):
+        self.db = db
+        self.batch_size = batch_size
+
+    async def apply(self, deltas: Dict[str, Dict[str, int]]) -> None:
+        """Write {vault_id: counter increments} with one bulk_write"""
+        updates = [
+            UpdateOne({'id': vault_id}, {'$inc': {f'{FIELD}.{path}': count for path, count in delta.items()}})
+            for vault_id, delta in deltas.items() if delta
+        ]
+        if updates:
+            await self.db.vaults.bulk_write(updates, ordered=False)
+
+    async def added(self, items: Iterable[dict], sign: int = 1) -> None:
+        deltas: Dict[str, Dict[str, int]] = {}
+        for item in items:
+            _combine(deltas.setdefault(item['vault_id'], {}), item_delta(item, sign))
+        await self.apply(deltas)
+
+    async def removed(self, items: Iterable[dict]) -> None:
+        await self.added(items, sign=-1)
+
+    async def changed(self, before: dict, after: dict) -> None:
+        await self.changed_many([(before, after)])
+
+    async def changed_many(self, changes: Iterable[Tuple[dict, dict]]) -> None:
+        """Counter moves of many edited items, as (before, after) pairs, with one bulk_write"""
+        deltas: Dict[str, Dict[str, int]] = {}
+        for before, after in changes:
+            _combine(deltas.setdefault(before['vault_id'], {}), item_delta(before, -1))
+            _combine(deltas.setdefault(after['vault_id'], {}), item_delta(after, 1))
+        await self.apply(deltas)
+
+    async def reconcile(self, vault_ids: Optional[List[str]] = None) -> Dict[str, int]:
+        """Recompute counters from the items (of some vaults, or all) and fix the ones that drifted"""
+        query = {'id': {'$in': vault_ids}} if vault_ids is not None else {}
+        vaults = await self.db.vaults.find(query, {'_id': 0, 'id': 1, FIELD: 1}).to_list(None)
+        match = {'vault_id': {'$in': vault_ids}} if vault_ids is not None else {}
+        groups = await self.db.items.aggregate([
+            {'$match': match},
+            {'$group': {
+                '_id': {'vault_id': '$vault_id', 'type': '$type', 'criticality': '$criticality', 'expires_at': '$expires_at'},
+                'count': {'$sum': 1}
+            }}
+        ], allowDiskUse=True).to_list(None)
+
+        computed: Dict[str, dict] = {}
+        for group in groups:
+            _nest(computed.setdefault(group['_id'].get('vault_id'), {}), item_delta(group['_id'], group['count']))
+
+        updates = []
+        for vault in vaults:
+            counts = computed.get(vault['id'], {})
+            if _nonzero(vault.get(FIELD) or {}) == counts:
+                continue
+            # Conditional on the counters read: a vault written to meanwhile waits for the next run
+            updates.append(UpdateOne({'id': vault['id'], FIELD: vault.get(FIELD)}, {'$set': {FIELD: counts}}))
+        fixed = 0
+        for start in range(0, len(updates), self.batch_size):
+            fixed += (await self.db.vaults.bulk_write(updates[start:start + self.batch_size], ordered=False)).modified_count
+        return {'vaults': len(vaults), 'fixed': fixed, 'skipped': len(updates) - fixed}
+
+    async def run(self, interval: int) -> None:
+        """Reconcile every `interval` seconds (starting now, which also fills in vaults that predate the counters)"""
+        while True:
+            try:
+                result = await self.reconcile()
+                if result['fixed'] or result['skipped']:
+                    logger.info(f"Vault rollups reconciled: {result}")
+            except PyMongoError as e:
+                logger.error(f"Error reconciling vault rollups: {str(e)}")
+            await asyncio.sleep(interval)
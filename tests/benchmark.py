@@ -0,0 +1,628 @@
+"""Load-test and benchmark the backend's hot endpoints.
+
+Runs the FastAPI app in-process against a local MongoDB (--mongo-url) or,
+by default, a mongomock-motor stand-in. Seeds configurable volumes, drives
+each scenario at the requested concurrency and writes a JSON report that
+can be compared across commits:
+
+    python -m tests.benchmark --items 20000 --concurrency 32 --out bench.json
+    python -m tests.benchmark --compare baseline.json --out bench.json
+
+--archive-items streams a vault of that many items out through the export
+endpoint and back in through the archive import, reporting throughput and
+peak Python memory:
+
+    python -m tests.benchmark --archive-items 100000 --scenarios items
+
+With --profile (requires --mongo-url) every distinct query shape issued by
+each route is explained, and the run fails if any is flagged (COLLSCAN or a
+high docsExamined/nReturned ratio):
+
+    python -m tests.benchmark --mongo-url mongodb://localhost --profile profile.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND_DIR))
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'keykeeper_bench')
+os.environ.setdefault('JWT_SECRET', 'benchmark-jwt-secret-not-for-production')
+os.environ.setdefault('PUBLIC_IP_RATE_LIMIT_PER_MINUTE', '1000000')
+
+import httpx  # noqa: E402
+
+from audit_analytics import AuditRollups  # noqa: E402
+from audit_chain import AuditChain, AuditVerifier  # noqa: E402
+from audit_store import AuditStore  # noqa: E402
+import metrics  # noqa: E402
+import server  # noqa: E402
+from query_profiler import QueryProfiler  # noqa: E402
+from tests.oauth_standin import OAuthStandIn  # noqa: E402
+
+ITEM_TYPES = ['web_credential', 'api_key', 'ad_token_google', 'ad_token_meta', 'db_credential']
+SQUADS = ['Growth', 'Performance', 'CRM', 'Data']
+EVENT_TYPES = ['item_revealed', 'item_created', 'item_updated', 'login', 'jit_requested']
+
+
+# ============= DATABASE SETUP =============
+
+def use_mongomock():
+    """Point the app at an in-process mongomock-motor database, counting calls per request"""
+    from mongomock_motor import AsyncMongoMockClient, AsyncMongoMockCollection
+
+    # mongomock does not emit command events, so count collection calls instead
+    def counted(method):
+        def wrapper(self, *args, **kwargs):
+            stats = metrics.current_request_stats.get()
+            if stats is not None:
+                stats.record(0.0)
+            return method(self, *args, **kwargs)
+        return wrapper
+
+    for name in ['find', 'find_one', 'find_one_and_update', 'find_one_and_delete', 'insert_one', 'insert_many',
+                 'update_one', 'update_many', 'replace_one', 'delete_one', 'delete_many', 'bulk_write',
+                 'count_documents', 'aggregate', 'distinct']:
+        if hasattr(AsyncMongoMockCollection, name):
+            setattr(AsyncMongoMockCollection, name, counted(getattr(AsyncMongoMockCollection, name)))
+
+    return AsyncMongoMockClient()
+
+
+def use_database(args, profiler=None):
+    if args.mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        listeners = [metrics.MongoCommandListener()] + ([profiler] if profiler else [])
+        client = AsyncIOMotorClient(args.mongo_url, event_listeners=listeners)
+        backend = 'mongodb'
+    else:
+        client = use_mongomock()
+        backend = 'mongomock'
+
+    server.db = client[args.db_name]
+    server.jit_grants.collection = server.db.jit_grants
+    server.item_history.collection = server.db.item_history
+    server.audit_store = AuditStore(server.db, server.AUDIT_ARCHIVE_DIR, hot_months=server.AUDIT_HOT_MONTHS)
+    server.token_revocations.collection = server.db.revoked_tokens
+    server.identifier_index.collection = server.db.items
+    server.credential_hygiene.db = server.db
+    server.sheet_sync.db = server.db
+    server.vault_rollups.db = server.db
+    server.audit_rollups = AuditRollups(server.db.audit_rollups)
+    server.audit_chain = AuditChain(server.db, server.audit_store, max_batch=server.AUDIT_CHAIN_MAX_BATCH, on_write=server.audit_rollups.apply)
+    server.audit_verifier = AuditVerifier(server.db, server.audit_store, checkpoint_size=server.AUDIT_CHECKPOINT_SIZE)
+    return backend
+
+
+def use_oauth_standin():
+    """Send the login flow's outbound calls (code exchange, JWKS) to an in-process stand-in"""
+    standin = OAuthStandIn(client_id='bench-client')
+    http = httpx.AsyncClient(transport=httpx.ASGITransport(app=standin.app))
+    server.google_oauth.http = server.google_jwks.http = http
+    server.google_oauth.client_id = standin.client_id
+    return standin
+
+
+async def insert_batched(collection, docs, batch_size=5000):
+    for start in range(0, len(docs), batch_size):
+        await collection.insert_many(docs[start:start + batch_size])
+
+
+async def seed(args, rng):
+    """Seed users, vaults, items, audit logs and JIT requests; return fixture ids"""
+    db = server.db
+    for name in ['users', 'vaults', 'items', 'item_history', 'audit_logs', 'audit_chain', 'audit_checkpoints', 'audit_rollups', 'revoked_tokens', 'jit_requests', 'jit_grants']:
+        await db[name].delete_many({})
+    for name in await server.audit_store.partitions(refresh=True):
+        await db.drop_collection(name)
+
+    admin = server.User(email='bench-admin@v4company.com', name='Bench Admin', role='admin')
+    users = [admin] + [
+        server.User(email=f'user{i}@v4company.com', name=f'User {i}', role='contributor')
+        for i in range(args.users)
+    ]
+    await insert_batched(db.users, [u.dict() for u in users])
+
+    vaults = []
+    for i in range(args.vaults):
+        parent = rng.choice(vaults) if vaults and rng.random() < 0.5 else None
+        name = f'Vault {i}'
+        vaults.append(server.Vault(
+            name=name,
+            type='client',
+            parent_id=parent.id if parent else None,
+            path=f'{parent.path} > {name}' if parent else name,
+            owner_id=admin.id,
+            tags={'client': f'Client {i % 50}'},
+            tag_pairs=server.tag_pairs({'client': f'Client {i % 50}'})
+        ))
+    await insert_batched(db.vaults, [v.dict() for v in vaults])
+
+    now = datetime.now(timezone.utc)
+    password_encrypted = server.encrypt_data('bench-password')
+    password_hygiene = server.credential_hygiene.assess('bench-password')
+    # A small pool of platform ids, so some pixels / MCCs are shared across clients
+    pixel_ids = [str(rng.randint(10 ** 14, 10 ** 15)) for _ in range(max(1, args.items // 20))]
+    mcc_ids = [f'{rng.randint(100, 999)}-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}' for _ in range(max(1, args.items // 20))]
+    items = []
+    for i in range(args.items):
+        vault = rng.choice(vaults)
+        expires_at = now + timedelta(days=rng.randint(-3, 60)) if rng.random() < 0.2 else None
+        item_type = rng.choice(ITEM_TYPES)
+        metadata = {
+            'ad_token_google': {'customer_id': str(rng.randint(10 ** 9, 10 ** 10)), 'mcc_id': rng.choice(mcc_ids)},
+            'ad_token_meta': {'ad_account_id': str(rng.randint(10 ** 14, 10 ** 15)), 'pixel_id': rng.choice(pixel_ids)}
+        }.get(item_type, {})
+        tags = {'squad': rng.choice(SQUADS)}
+        item = server.Item(
+            vault_id=vault.id,
+            type=item_type,
+            metadata=metadata,
+            identifiers=server.identifier_index.extract(item_type, metadata),
+            tags=tags,
+            tag_pairs=server.tag_pairs(tags),
+            title=f'Credential {i}',
+            login=f'login{i}@client.com',
+            password_encrypted=password_encrypted,
+            owner_id=admin.id,
+            criticality=rng.choice(['high', 'medium', 'low']),
+            environment=rng.choice(['prod', 'stage']),
+            requires_checkout=(i == 0),
+            created_by=admin.id,
+            updated_by=admin.id
+        ).dict()
+        # Every seeded item shares one password, so the reuse report has a large group to build
+        item.update(password_hygiene)
+        # Notifications compare expires_at as an ISO string
+        item['expires_at'] = expires_at.isoformat() if expires_at else None
+        items.append(item)
+    await insert_batched(db.items, items)
+
+    logs = []
+    for i in range(args.audit_logs):
+        user = rng.choice(users)
+        item = rng.choice(items)
+        logs.append(server.AuditLog(
+            event_type=rng.choice(EVENT_TYPES),
+            user_id=user.id,
+            user_email=user.email,
+            item_id=item['id'],
+            vault_id=item['vault_id'],
+            details={'title': item['title']},
+            timestamp=now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+        ).dict())
+    await server.audit_chain.append(logs)
+
+    jit = []
+    for i in range(args.jit_requests):
+        item = rng.choice(items)
+        jit.append(server.JITRequest(
+            requester_id=rng.choice(users).id,
+            item_id=item['id'],
+            vault_id=item['vault_id'],
+            reason='benchmark',
+            status=rng.choice(['pending', 'approved', 'denied'])
+        ).dict())
+    await insert_batched(db.jit_requests, jit)
+
+    # Logged-out tokens, so auth checks run against a populated revocation list
+    await insert_batched(db.revoked_tokens, [
+        {'_id': uuid.uuid4().hex, 'user_id': rng.choice(users).id, 'revoked_at': now, 'expires_at': now + server.JWT_TOKEN_TTL}
+        for _ in range(args.revoked_tokens)
+    ])
+    await server.token_revocations.load()
+
+    if args.mongo_url:
+        await server.create_indexes()
+
+    return {
+        'admin': admin,
+        'users': users,
+        'vault_ids': [v.id for v in vaults],
+        'vault_paths': [v.path for v in vaults],
+        'item_ids': [item['id'] for item in items],
+        'identifiers': [('pixel_id', pixel_id) for pixel_id in pixel_ids] + [('mcc_id', mcc_id) for mcc_id in mcc_ids],
+        'checkout_item_id': items[0]['id'] if items else None
+    }
+
+
+# ============= SCENARIOS =============
+
+def build_scenarios(fixtures, rng, import_rows, oauth):
+    """Scenario name -> function returning (method, url, json body)"""
+    def login():
+        return 'GET', f"/api/auth/google/callback?code={oauth.issue_code(rng.choice(fixtures['users']).email)}", None
+
+    def items():
+        return 'GET', f"/api/items?vault_id={rng.choice(fixtures['vault_ids'])}", None
+
+    def vault_tree():
+        return 'GET', '/api/vaults', None
+
+    def item_facets():
+        return 'GET', f"/api/items/facets?vault_id={rng.choice(fixtures['vault_ids'])}", None
+
+    def hygiene_report():
+        return 'GET', '/api/hygiene/report', None
+
+    def item_lookup():
+        field, value = rng.choice(fixtures['identifiers'])
+        return 'GET', f"/api/items/lookup?field={field}&value={value}", None
+
+    def identifier_clients():
+        field, value = rng.choice(fixtures['identifiers'])
+        return 'GET', f"/api/items/lookup/clients?field={field}&value={value}", None
+
+    def audit_logs():
+        return 'GET', '/api/audit/logs?limit=100', None
+
+    def auth():
+        return 'GET', '/api/auth/me', None
+
+    def audit_analytics():
+        start = (datetime.now(timezone.utc) - timedelta(days=365)).date().isoformat()
+        return 'GET', f'/api/audit/analytics/reveals?start={start}', None
+
+    def notifications():
+        return 'GET', '/api/notifications', None
+
+    def reveal():
+        return 'POST', f"/api/items/{rng.choice(fixtures['item_ids'])}/reveal", None
+
+    def update_item():
+        body = {'title': f'Credential {uuid.uuid4().hex[:8]}', 'environment': rng.choice(['prod', 'stage'])}
+        return 'PUT', f"/api/items/{rng.choice(fixtures['item_ids'])}", body
+
+    def update_vault():
+        return 'PUT', f"/api/vaults/{rng.choice(fixtures['vault_ids'])}?name=Vault%20{uuid.uuid4().hex[:8]}", {'client': 'Bench'}
+
+    def import_sheets():
+        vault_path = rng.choice(fixtures['vault_paths'])
+        rows = [
+            {'vault_path': vault_path, 'type': 'web_credential', 'title': f'Imported {uuid.uuid4().hex[:8]}',
+             'login': 'import@client.com', 'password': 'imported-secret'}
+            for _ in range(import_rows)
+        ]
+        return 'POST', '/api/import/sheets', rows
+
+    # The same sheet synced again and again, with one password changed each time
+    sync_rows = [
+        {'vault_path': fixtures['vault_paths'][0], 'type': 'web_credential', 'title': f'Synced {i}',
+         'login': f'sync{i}@client.com', 'password': f'synced-secret-{i}'}
+        for i in range(import_rows)
+    ]
+
+    def import_sync():
+        rows = [dict(row) for row in sync_rows]
+        rows[rng.randrange(len(rows))]['password'] = f'rotated-{uuid.uuid4().hex[:8]}'
+        return 'POST', '/api/import/sheets?mode=sync', rows
+
+    return {
+        'login': login,
+        'auth': auth,
+        'items': items,
+        'vault_tree': vault_tree,
+        'item_facets': item_facets,
+        'item_lookup': item_lookup,
+        'hygiene_report': hygiene_report,
+        'identifier_clients': identifier_clients,
+        'audit_logs': audit_logs,
+        'audit_analytics': audit_analytics,
+        'notifications': notifications,
+        'reveal': reveal,
+        'update_item': update_item,
+        'update_vault': update_vault,
+        'import_sheets': import_sheets,
+        'import_sync': import_sync
+    }
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def parse_db_queries(server_timing):
+    """Extract the query count from the Server-Timing header added by MetricsMiddleware"""
+    for part in (server_timing or '').split(','):
+        part = part.strip()
+        if part.startswith('db;') and 'desc="' in part:
+            return int(part.split('desc="', 1)[1].split(' ', 1)[0])
+    return None
+
+
+def measure_auth_overhead(user, iterations=20000):
+    """Mean cost of the in-memory part of authentication: JWT decode plus revocation check"""
+    token = server.create_jwt_token(user.dict())
+    start = time.perf_counter()
+    for _ in range(iterations):
+        payload = server.jwt.decode(token, server.JWT_SECRET, algorithms=[server.JWT_ALGORITHM])
+        server.token_revocations.is_revoked(payload)
+    decode_and_check = (time.perf_counter() - start) / iterations
+
+    payload = server.jwt.decode(token, server.JWT_SECRET, algorithms=[server.JWT_ALGORITHM])
+    start = time.perf_counter()
+    for _ in range(iterations):
+        server.token_revocations.is_revoked(payload)
+    check = (time.perf_counter() - start) / iterations
+    return {
+        'iterations': iterations,
+        'decode_and_revocation_check_us': round(decode_and_check * 1e6, 2),
+        'revocation_check_us': round(check * 1e6, 2),
+    }
+
+
+async def run_scenario(http, make_request, total, concurrency, headers):
+    latencies = []
+    db_ops = []
+    errors = 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            method, url, body = make_request()
+            start = time.perf_counter()
+            response = await http.request(method, url, json=body, headers=headers)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+            queries = parse_db_queries(response.headers.get('server-timing'))
+            if queries is not None:
+                db_ops.append(queries)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': total,
+        'errors': errors,
+        'concurrency': concurrency,
+        'duration_s': round(elapsed, 3),
+        'throughput_rps': round(total / elapsed, 1) if elapsed else None,
+        'mean_ms': round(sum(latencies) / len(latencies), 2) if latencies else None,
+        'p50_ms': round(percentile(latencies, 50), 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95), 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 2) if latencies else None,
+        'db_ops_per_request': round(sum(db_ops) / len(db_ops), 2) if db_ops else None
+    }
+
+
+async def run_checkout_contention(http, fixtures, contenders):
+    """Hundreds of users check out the same item at once; exactly one may win"""
+    item_id = fixtures['checkout_item_id']
+    users = fixtures['users'][1:contenders + 1]
+    start = time.perf_counter()
+    responses = await asyncio.gather(*[
+        http.post(f'/api/items/{item_id}/checkout', headers=auth_headers(user)) for user in users
+    ])
+    elapsed = time.perf_counter() - start
+    winners = sum(1 for r in responses if r.status_code == 200)
+    conflicts = sum(1 for r in responses if r.status_code == 409)
+    return {
+        'requests': len(responses),
+        'duration_s': round(elapsed, 3),
+        'winners': winners,
+        'conflicts': conflicts,
+        'ok': winners == 1 and winners + conflicts == len(responses)
+    }
+
+
+async def run_vault_archive(http, fixtures, count, headers):
+    """Export a vault of `count` items to an archive, wipe it and restore it, tracking peak Python memory"""
+    db = server.db
+    admin = fixtures['admin']
+    vault = server.Vault(name='Archive bench', type='client', path='Archive bench', owner_id=admin.id)
+    await db.vaults.insert_one(vault.dict())
+    password_encrypted = server.encrypt_data('bench-password')
+    for start in range(0, count, 5000):
+        await db.items.insert_many([
+            server.Item(
+                vault_id=vault.id, type='web_credential', title=f'Archived {i}', login=f'archived{i}@client.com',
+                password_encrypted=password_encrypted, owner_id=admin.id, created_by=admin.id, updated_by=admin.id
+            ).dict()
+            for i in range(start, min(count, start + 5000))
+        ])
+
+    with tempfile.TemporaryFile() as archive:
+        tracemalloc.start()
+        start = time.perf_counter()
+        async with http.stream('GET', f'/api/vaults/{vault.id}/export', headers=headers) as response:
+            async for chunk in response.aiter_bytes():
+                archive.write(chunk)
+        export_s = time.perf_counter() - start
+        export_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        size = archive.tell()
+
+        await db.items.delete_many({'vault_id': vault.id})
+        await db.vaults.delete_one({'id': vault.id})
+
+        async def upload():
+            archive.seek(0)
+            while chunk := archive.read(64 * 1024):
+                yield chunk
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        response = await http.post('/api/vaults/import-archive', content=upload(), headers=headers)
+        import_s = time.perf_counter() - start
+        import_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    restored = await db.items.count_documents({'vault_id': vault.id})
+    return {
+        'items': count,
+        'archive_bytes': size,
+        'export_s': round(export_s, 3),
+        'export_items_per_s': round(count / export_s) if export_s else None,
+        'export_peak_mib': round(export_peak / 2 ** 20, 1),
+        'import_s': round(import_s, 3),
+        'import_items_per_s': round(count / import_s) if import_s else None,
+        'import_peak_mib': round(import_peak / 2 ** 20, 1),
+        'restored': restored,
+        'ok': response.status_code == 200 and restored == count
+    }
+
+
+def auth_headers(user):
+    return {'Authorization': f"Bearer {server.create_jwt_token(user.dict())}"}
+
+
+# ============= REPORTING =============
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(report, baseline):
+    print(f"\nCompared with {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')}):")
+    for name, result in report['endpoints'].items():
+        before = baseline.get('endpoints', {}).get(name)
+        if not before:
+            continue
+        deltas = []
+        for key in ['throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'db_ops_per_request']:
+            if result.get(key) is not None and before.get(key):
+                deltas.append(f"{key} {before[key]} -> {result[key]} ({(result[key] - before[key]) / before[key] * 100:+.1f}%)")
+        if deltas:
+            print(f"  {name}: " + ', '.join(deltas))
+
+
+async def main(args):
+    # Per-request audit/httpx log lines would dominate the measurements
+    logging.getLogger().setLevel(logging.WARNING)
+    rng = random.Random(args.seed)
+    if args.profile and not args.mongo_url:
+        print("--profile needs a real MongoDB (--mongo-url): mongomock cannot explain queries")
+        return 2
+    profiler = QueryProfiler(max_examined_ratio=args.max_examined_ratio) if args.profile else None
+    backend = use_database(args, profiler)
+    print(f"Seeding {args.vaults} vaults, {args.items} items, {args.audit_logs} audit logs, {args.jit_requests} JIT requests ({backend})")
+    fixtures = await seed(args, rng)
+    if profiler:
+        profiler_task = asyncio.create_task(profiler.run(server.db))
+
+    oauth = use_oauth_standin()
+    scenarios = build_scenarios(fixtures, rng, args.import_rows, oauth)
+    selected = args.scenarios.split(',') if args.scenarios else list(scenarios)
+    headers = auth_headers(fixtures['admin'])
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'backend': backend,
+            'seed': {k: getattr(args, k) for k in ['users', 'vaults', 'items', 'audit_logs', 'jit_requests', 'revoked_tokens', 'seed']},
+            'concurrency': args.concurrency,
+            'requests_per_scenario': args.requests
+        },
+        'endpoints': {}
+    }
+
+    transport = httpx.ASGITransport(app=server.app, client=('10.0.0.1', 50000))
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as http:
+        for name in selected:
+            if name == 'checkout_contention':
+                continue
+            result = await run_scenario(http, scenarios[name], args.requests, args.concurrency, headers)
+            report['endpoints'][name] = result
+            print(f"{name:>16}: {result['throughput_rps']} req/s, p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, "
+                  f"p99 {result['p99_ms']} ms, {result['db_ops_per_request']} db ops/req, {result['errors']} errors")
+
+        if 'login' in selected:
+            report['endpoints']['login']['oauth_calls'] = dict(oauth.counts)
+            print(f"   login: {oauth.counts['token']} code exchanges, {oauth.counts['jwks']} JWKS fetch(es), no userinfo calls")
+
+        if 'auth' in selected:
+            overhead = measure_auth_overhead(fixtures['admin'])
+            report['auth_overhead'] = overhead
+            print(f"   auth overhead: {overhead['decode_and_revocation_check_us']} us/request decode + check, "
+                  f"{overhead['revocation_check_us']} us revocation check ({args.revoked_tokens} revoked tokens), "
+                  f"{report['endpoints']['auth']['db_ops_per_request']} db ops/req")
+
+        if args.archive_items:
+            result = await run_vault_archive(http, fixtures, args.archive_items, headers)
+            report['vault_archive'] = result
+            print(f"   vault_archive: {result['items']} items, {result['archive_bytes']} bytes; export {result['export_s']}s "
+                  f"(peak {result['export_peak_mib']} MiB), import {result['import_s']}s (peak {result['import_peak_mib']} MiB), "
+                  f"{'ok' if result['ok'] else 'FAILED'}")
+
+        if not args.scenarios or 'checkout_contention' in selected:
+            result = await run_checkout_contention(http, fixtures, min(args.contenders, args.users))
+            report['endpoints']['checkout_contention'] = result
+            print(f"checkout_contention: {result['winners']} winner(s), {result['conflicts']} conflicts in {result['duration_s']}s")
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+        print(f"\nReport written to {args.out}")
+
+    flagged = 0
+    if profiler:
+        await profiler.drain()
+        profiler_task.cancel()
+        profile = profiler.write_report(args.profile)
+        flagged = profile['flagged']
+        for route, entries in profile['routes'].items():
+            for entry in entries:
+                if entry['flags']:
+                    print(f"  FLAGGED {route}: {entry['command']} {entry['collection']} {entry['shape']} "
+                          f"{', '.join(entry['flags'])} (examined {entry['docs_examined']}, returned {entry['n_returned']})")
+        print(f"Query profile written to {args.profile}: {flagged} flagged query shape(s)")
+
+    if args.compare:
+        print_comparison(report, json.loads(Path(args.compare).read_text()))
+
+    contention = report['endpoints'].get('checkout_contention')
+    archive = report.get('vault_archive')
+    return 1 if (contention and not contention['ok']) or (archive and not archive['ok']) or flagged else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mongo-url', help='Benchmark against this MongoDB instead of mongomock-motor')
+    parser.add_argument('--db-name', default='keykeeper_bench')
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--vaults', type=int, default=200)
+    parser.add_argument('--items', type=int, default=5000)
+    parser.add_argument('--audit-logs', type=int, default=20000)
+    parser.add_argument('--jit-requests', type=int, default=500)
+    parser.add_argument('--revoked-tokens', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=500, help='Requests per scenario')
+    parser.add_argument('--import-rows', type=int, default=20, help='Rows per /api/import/sheets request (append and sync)')
+    parser.add_argument('--contenders', type=int, default=300, help='Parallel check-outs in checkout_contention')
+    parser.add_argument('--archive-items', type=int, default=0,
+                        help='Export and restore a vault of this many items (e.g. 100000); 0 skips it')
+    parser.add_argument('--scenarios', help='Comma-separated subset of scenarios to run')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', help='Write the JSON report here')
+    parser.add_argument('--compare', help='Baseline JSON report to compare against')
+    parser.add_argument('--profile', help='Explain every query shape and write the per-route report here')
+    parser.add_argument('--max-examined-ratio', type=float, default=10.0,
+                        help='Flag queries examining more than this many documents per document returned')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main(parse_args())))
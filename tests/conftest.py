@@ -0,0 +1,80 @@
+"""Shared fixtures: the FastAPI app in-process against a fresh mongomock-motor database per test"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND_DIR))
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'keykeeper_test')
+os.environ.setdefault('JWT_SECRET', 'test-jwt-secret-not-for-production')
+os.environ.setdefault('PUBLIC_IP_RATE_LIMIT_PER_MINUTE', '1000000')
+
+import httpx  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+import attachment_store  # noqa: E402
+from attachment_store import AttachmentStore  # noqa: E402
+from audit_analytics import AuditRollups  # noqa: E402
+from audit_chain import AuditChain, AuditVerifier  # noqa: E402
+from audit_store import AuditStore  # noqa: E402
+import server  # noqa: E402
+from tests.gridfs_standin import GridFSBucketStandIn  # noqa: E402
+
+# Attachment segment size in tests, so a few dozen bytes span several segments
+SEGMENT_SIZE = 16
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Point the app at an empty in-process database"""
+    database = AsyncMongoMockClient()['keykeeper_test']
+    server.db = database
+    server.jit_grants.collection = database.jit_grants
+    server.item_history.collection = database.item_history
+    server.vault_purger.db = database
+    server.token_revocations.collection = database.revoked_tokens
+    server.share_link_cache.collection = database.vaults
+    server.identifier_index.collection = database.items
+    server.credential_hygiene.db = database
+    server.sheet_sync.db = database
+    server.vault_rollups.db = database
+    server.audit_store = AuditStore(database, str(tmp_path / 'audit'), hot_months=server.AUDIT_HOT_MONTHS)
+    server.audit_rollups = AuditRollups(database.audit_rollups)
+    server.audit_chain = AuditChain(database, server.audit_store, on_write=server.audit_rollups.apply)
+    server.audit_verifier = AuditVerifier(database, server.audit_store, checkpoint_size=server.AUDIT_CHECKPOINT_SIZE)
+    for cache in (server.tombstone_cache, server.invalid_token_cache, server.share_link_cache):
+        cache.clear()
+    return database
+
+
+@pytest.fixture
+async def attachments(db, monkeypatch):
+    """Attachment store on the test database, with GridFS stood in (mongomock has none)"""
+    monkeypatch.setattr(attachment_store, 'AsyncIOMotorGridFSBucket', GridFSBucketStandIn)
+    # As created at startup: the index that deduplicates identical content
+    await db['attachments.files'].create_index(
+        'metadata.content_hash', unique=True, partialFilterExpression={'metadata.content_hash': {'$type': 'string'}}
+    )
+    return AttachmentStore(db, server.ENCRYPTION_KEY, segment_size=SEGMENT_SIZE, max_size=1024, grace_seconds=0)
+
+
+@pytest.fixture
+async def client(db):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url='http://test') as http:
+        yield http
+
+
+async def create_user(db, role: str = 'admin', name: str = 'Ada', email: str = 'ada@v4company.com'):
+    """Insert a user and return it with its Authorization header"""
+    user = server.User(email=email, name=name, role=role)
+    await db.users.insert_one(user.dict())
+    return user, {'Authorization': f"Bearer {server.create_jwt_token(user.dict())}"}
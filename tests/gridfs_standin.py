@@ -0,0 +1,77 @@
+"""In-process stand-in for AsyncIOMotorGridFSBucket.
+
+mongomock has no GridFS, so this stores files the way GridFS lays them
+out (a `<bucket>.files` document, `<bucket>.chunks` of `chunk_size_bytes`
+with `files_id` and `n`) through the collections of any motor-like
+database, and reads them back with the seek/read interface of GridOut.
+Only what AttachmentStore uses is implemented.
+"""
+from datetime import datetime, timezone
+
+from bson import Binary, ObjectId
+
+
+class GridIn:
+    def __init__(self, bucket: 'GridFSBucketStandIn', file_id, filename: str, chunk_size_bytes: int, metadata: dict):
+        self.bucket = bucket
+        self.file_id = file_id
+        self.filename = filename
+        self.chunk_size = chunk_size_bytes
+        self.metadata = metadata
+        self._buffer = bytearray()
+        self._n = 0
+        self._length = 0
+
+    async def _flush(self, data: bytes) -> None:
+        await self.bucket.chunks.insert_one({'_id': ObjectId(), 'files_id': self.file_id, 'n': self._n, 'data': Binary(data)})
+        self._n += 1
+
+    async def write(self, data: bytes) -> None:
+        self._buffer += data
+        self._length += len(data)
+        while len(self._buffer) >= self.chunk_size:
+            await self._flush(bytes(self._buffer[:self.chunk_size]))
+            del self._buffer[:self.chunk_size]
+
+    async def close(self) -> None:
+        if self._buffer:
+            await self._flush(bytes(self._buffer))
+            self._buffer.clear()
+        await self.bucket.files.insert_one({
+            '_id': self.file_id,
+            'filename': self.filename,
+            'length': self._length,
+            'chunkSize': self.chunk_size,
+            'uploadDate': datetime.now(timezone.utc),
+            'metadata': self.metadata
+        })
+
+    async def abort(self) -> None:
+        await self.bucket.chunks.delete_many({'files_id': self.file_id})
+
+
+class GridOut:
+    def __init__(self, data: bytes):
+        self._data = data
+        self._position = 0
+
+    def seek(self, position: int) -> None:
+        self._position = position
+
+    async def read(self, size: int) -> bytes:
+        data = self._data[self._position:self._position + size]
+        self._position += len(data)
+        return data
+
+
+class GridFSBucketStandIn:
+    def __init__(self, db, bucket_name: str = 'fs'):
+        self.files = db[f'{bucket_name}.files']
+        self.chunks = db[f'{bucket_name}.chunks']
+
+    def open_upload_stream_with_id(self, file_id, filename: str, chunk_size_bytes: int, metadata: dict) -> GridIn:
+        return GridIn(self, file_id, filename, chunk_size_bytes, metadata)
+
+    async def open_download_stream(self, file_id) -> GridOut:
+        chunks = await self.chunks.find({'files_id': file_id}).sort('n', 1).to_list(None)
+        return GridOut(b''.join(bytes(chunk['data']) for chunk in chunks))
@@ -0,0 +1,132 @@
+"""Local stand-in for Google's OAuth token and JWKS endpoints.
+
+Signs id_tokens with a throwaway RSA key and serves the matching JWKS with
+a Cache-Control max-age, at the same paths as Google. Point the backend at
+it to exercise the login flow without network access:
+
+    python -m tests.oauth_standin --port 8765
+    GOOGLE_AUTH_URL=http://localhost:8765/o/oauth2/v2/auth \\
+    GOOGLE_TOKEN_URL=http://localhost:8765/token \\
+    GOOGLE_JWKS_URL=http://localhost:8765/oauth2/v3/certs \\
+    GOOGLE_CLIENT_ID=standin-client uvicorn server:app
+
+The authorize endpoint logs in whoever is passed as login_hint. In-process
+users (the benchmark, tests) can mount `OAuthStandIn(...).app` on an
+httpx.ASGITransport instead and mint codes with `issue_code`.
+"""
+import argparse
+import json
+import secrets
+import time
+import uuid
+from typing import Dict
+from urllib.parse import urlencode
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import FastAPI, Form, HTTPException
+from fastapi.responses import JSONResponse, RedirectResponse
+
+ISSUER = 'https://accounts.google.com'
+
+
+class OAuthStandIn:
+    """Token and JWKS endpoints backed by an in-memory signing key"""
+
+    def __init__(self, client_id: str = 'standin-client', jwks_max_age: int = 3600, token_lifetime: int = 3600):
+        self.client_id = client_id
+        self.jwks_max_age = jwks_max_age
+        self.token_lifetime = token_lifetime
+        self.kid = uuid.uuid4().hex
+        self._private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        # Set to False to make the JWKS endpoint fail (503)
+        self.jwks_available = True
+        self._codes: Dict[str, dict] = {}
+        self.counts = {'authorize': 0, 'token': 0, 'jwks': 0}
+        self.app = self._build_app()
+
+    def issue_code(self, email: str, name: str = None) -> str:
+        """Authorization code that logs in `email` (single use)"""
+        code = secrets.token_urlsafe(16)
+        self._codes[code] = {'email': email, 'name': name or email.split('@')[0]}
+        return code
+
+    def rotate_key(self) -> str:
+        """Sign with a new key from now on, served under a new key id; returns the id"""
+        self.kid = uuid.uuid4().hex
+        self._private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        return self.kid
+
+    def id_token(self, profile: dict, audience: str, **overrides) -> str:
+        """Signed id_token for `profile`; `overrides` replace or add claims"""
+        now = int(time.time())
+        claims = {
+            'iss': ISSUER,
+            'aud': audience,
+            'sub': str(uuid.uuid5(uuid.NAMESPACE_URL, profile['email']).int)[:21],
+            'email': profile['email'],
+            'email_verified': True,
+            'name': profile['name'],
+            'picture': None,
+            'iat': now,
+            'exp': now + self.token_lifetime,
+            **overrides
+        }
+        return jwt.encode(claims, self._private_key, algorithm='RS256', headers={'kid': self.kid})
+
+    def jwks(self) -> dict:
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(self._private_key.public_key()))
+        return {'keys': [{**jwk, 'kid': self.kid, 'alg': 'RS256', 'use': 'sig'}]}
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI(title='OAuth stand-in')
+
+        @app.get('/o/oauth2/v2/auth')
+        async def authorize(redirect_uri: str, login_hint: str = 'standin@v4company.com', state: str = ''):
+            self.counts['authorize'] += 1
+            query = {'code': self.issue_code(login_hint)}
+            if state:
+                query['state'] = state
+            return RedirectResponse(f"{redirect_uri}?{urlencode(query)}")
+
+        @app.post('/token')
+        async def token(code: str = Form(...), client_id: str = Form(...), grant_type: str = Form('authorization_code')):
+            self.counts['token'] += 1
+            profile = self._codes.pop(code, None)
+            if profile is None or grant_type != 'authorization_code':
+                return JSONResponse({'error': 'invalid_grant'}, status_code=400)
+            if client_id != self.client_id:
+                raise HTTPException(status_code=401, detail='invalid_client')
+            return {
+                'access_token': secrets.token_urlsafe(32),
+                'id_token': self.id_token(profile, client_id),
+                'expires_in': self.token_lifetime,
+                'token_type': 'Bearer',
+                'scope': 'openid email profile'
+            }
+
+        @app.get('/oauth2/v3/certs')
+        async def certs():
+            self.counts['jwks'] += 1
+            if not self.jwks_available:
+                return JSONResponse({'error': 'unavailable'}, status_code=503)
+            return JSONResponse(self.jwks(), headers={'Cache-Control': f'public, max-age={self.jwks_max_age}, must-revalidate, no-transform'})
+
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--client-id', default='standin-client')
+    parser.add_argument('--jwks-max-age', type=int, default=3600)
+    args = parser.parse_args()
+
+    import uvicorn
+    standin = OAuthStandIn(client_id=args.client_id, jwks_max_age=args.jwks_max_age)
+    uvicorn.run(standin.app, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import pytest
+
+from attachment_store import AttachmentError, RangeNotSatisfiable, parse_range
+
+pytestmark = pytest.mark.anyio
+
+# Three full segments and a short last one
+DATA = bytes(range(50))
+
+
+@pytest.mark.parametrize('header, size, expected', [
+    (None, 50, None),
+    ('', 50, None),
+    ('bytes=-', 50, None),
+    ('bytes=0-9,20-29', 50, None),
+    ('items=0-9', 50, None),
+    ('bytes=0-9', 50, (0, 9)),
+    (' bytes=10-10 ', 50, (10, 10)),
+    ('bytes=10-', 50, (10, 49)),
+    ('bytes=10-500', 50, (10, 49)),
+    ('bytes=-10', 50, (40, 49)),
+    ('bytes=-500', 50, (0, 49)),
+    ('bytes=49-49', 50, (49, 49))
+])
+def test_parse_range(header, size, expected):
+    assert parse_range(header, size) == expected
+
+
+@pytest.mark.parametrize('header, size', [
+    ('bytes=50-', 50),
+    ('bytes=50-60', 50),
+    ('bytes=20-10', 50),
+    ('bytes=0-', 0),
+    ('bytes=-0', 50),
+    ('bytes=-10', 0)
+])
+def test_unsatisfiable_ranges(header, size):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, size)
+
+
+async def pieces(data: bytes, size: int = 7):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+async def save(attachments, data: bytes) -> dict:
+    stored = await attachments.save(pieces(data), 'u1')
+    return await attachments.find(stored['file_id'])
+
+
+async def read(attachments, file: dict, start: int, end: int) -> bytes:
+    return b''.join([data async for data in attachments.stream(file, start, end)])
+
+
+@pytest.mark.parametrize('start, end', [
+    (0, 49),
+    (0, 0),
+    (3, 9),
+    (15, 16),
+    (16, 31),
+    (15, 32),
+    (47, 48),
+    (48, 49),
+    (49, 49),
+    (10, 45)
+])
+async def test_stream_returns_exactly_the_range(attachments, start, end):
+    file = await save(attachments, DATA)
+
+    assert await read(attachments, file, start, end) == DATA[start:end + 1]
+
+
+async def test_stream_reads_only_the_segments_of_the_range(attachments, monkeypatch):
+    file = await save(attachments, DATA)
+    decrypted = []
+    aead = attachments._aead
+
+    def counting_aead(metadata):
+        cipher = aead(metadata)
+        decrypt = cipher.decrypt
+
+        class Counting:
+            def decrypt(self, nonce, data, aad):
+                decrypted.append(aad)
+                return decrypt(nonce, data, aad)
+        return Counting()
+
+    monkeypatch.setattr(attachments, '_aead', counting_aead)
+
+    assert await read(attachments, file, 20, 40) == DATA[20:41]
+    assert len(decrypted) == 2
+
+
+@pytest.mark.parametrize('data', [bytes(range(48)), b'x', bytes(range(17))])
+async def test_last_segment_at_and_off_a_boundary(attachments, data):
+    file = await save(attachments, data)
+
+    assert file['metadata']['size'] == len(data)
+    assert await read(attachments, file, 0, len(data) - 1) == data
+    assert await read(attachments, file, len(data) - 1, len(data) - 1) == data[-1:]
+
+
+async def test_empty_file(attachments):
+    file = await save(attachments, b'')
+
+    assert file['metadata']['size'] == 0
+    # Stored as one empty, final segment; the route asks for 0..-1, which reads nothing
+    assert await attachments.chunks.count_documents({'files_id': file['_id']}) == 1
+    assert await read(attachments, file, 0, -1) == b''
+
+
+async def test_identical_content_is_stored_once(attachments):
+    first = await save(attachments, DATA)
+    second = await attachments.save(pieces(DATA, 5), 'u2')
+
+    assert second['file_id'] == first['_id']
+    assert await attachments.files.count_documents({}) == 1
+
+
+async def test_tampered_or_misplaced_segment_fails_authentication(attachments):
+    file = await save(attachments, DATA)
+    chunks = await attachments.chunks.find({'files_id': file['_id']}).sort('n', 1).to_list(None)
+    # Segment 1 copied over segment 0: still a valid ciphertext, but of another index
+    await attachments.chunks.update_one({'_id': chunks[0]['_id']}, {'$set': {'data': chunks[1]['data']}})
+
+    assert await read(attachments, file, 16, 31) == DATA[16:32]
+    with pytest.raises(AttachmentError, match='Segment 0'):
+        await read(attachments, file, 0, 15)
@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from audit_store import LEGACY_COLLECTION, AuditStore
+
+pytestmark = pytest.mark.anyio
+
+
+def events(start: datetime, count: int, prefix: str) -> list:
+    return [{'_id': f'{prefix}-{i}', 'event_type': 'item_revealed', 'timestamp': start + timedelta(hours=i)} for i in range(count)]
+
+
+@pytest.fixture
+async def store(db, tmp_path):
+    """Migration half done: Jan and Feb moved into partitions, March still in the legacy collection, April written after cutover"""
+    store = AuditStore(db, str(tmp_path / 'audit'))
+    await store.insert_many(events(datetime(2025, 1, 10, tzinfo=timezone.utc), 5, 'jan'))
+    await store.insert_many(events(datetime(2025, 2, 10, tzinfo=timezone.utc), 5, 'feb'))
+    await db[LEGACY_COLLECTION].insert_many(events(datetime(2025, 3, 10, tzinfo=timezone.utc), 5, 'mar'))
+    await store.insert_many(events(datetime(2025, 4, 10, tzinfo=timezone.utc), 3, 'apr'))
+    return store
+
+
+def ids(logs: list) -> list:
+    return [entry['_id'] for entry in logs]
+
+
+async def test_legacy_events_are_merged_in_timestamp_order(store):
+    logs = await store.find({}, limit=100)
+
+    assert len(logs) == 18
+    timestamps = [entry['timestamp'] for entry in logs]
+    assert timestamps == sorted(timestamps, reverse=True)
+    assert ids(logs[:8]) == ['apr-2', 'apr-1', 'apr-0', 'mar-4', 'mar-3', 'mar-2', 'mar-1', 'mar-0']
+
+
+@pytest.mark.parametrize('limit', [1, 3, 4, 8, 9, 12])
+async def test_limit_keeps_the_newest_events(store, limit):
+    everything = await store.find({}, limit=100)
+
+    assert ids(await store.find({}, limit=limit)) == ids(everything[:limit])
+
+
+async def test_time_range_applies_to_the_legacy_collection(store):
+    logs = await store.find({}, start=datetime(2025, 2, 1, tzinfo=timezone.utc), end=datetime(2025, 3, 10, 3, tzinfo=timezone.utc), limit=100)
+
+    assert ids(logs) == ['mar-2', 'mar-1', 'mar-0', 'feb-4', 'feb-3', 'feb-2', 'feb-1', 'feb-0']
+
+
+async def test_migration_moves_the_events_without_changing_results(store):
+    before = ids(await store.find({}, limit=10))
+    while await store.migrate_legacy(batch_size=2):
+        assert ids(await store.find({}, limit=10)) == before
+    await store.partitions(refresh=True)
+
+    assert ids(await store.find({}, limit=10)) == before
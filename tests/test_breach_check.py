@@ -0,0 +1,143 @@
+import hashlib
+import os
+
+import pytest
+from cryptography.fernet import Fernet
+
+from breach_check import RECORD_SIZE, BreachCorpus, convert
+from credential_hygiene import BREACHED, CredentialHygiene
+
+
+def sha1(password: str) -> bytes:
+    return hashlib.sha1(password.encode()).digest()
+
+
+def write_source(path, passwords, counts: bool = True) -> None:
+    lines = [digest.hex().upper() + (':42' if counts else '') for digest in sorted(sha1(p) for p in passwords)]
+    path.write_text('\n'.join(lines) + '\n\n')
+
+
+@pytest.fixture
+def corpus_path(tmp_path):
+    source = tmp_path / 'pwned.txt'
+    write_source(source, [f'password{i}' for i in range(100)])
+    target = tmp_path / 'breached.sha1'
+    convert(str(source), str(target))
+    return target
+
+
+def test_convert_writes_sorted_fixed_width_records(tmp_path):
+    source, target = tmp_path / 'pwned.txt', tmp_path / 'breached.sha1'
+    write_source(source, ['hunter2', 'letmein', 'qwerty'], counts=False)
+
+    assert convert(str(source), str(target)) == 3
+
+    data = target.read_bytes()
+    assert len(data) == 3 * RECORD_SIZE
+    assert data == b''.join(sorted(sha1(p) for p in ['hunter2', 'letmein', 'qwerty']))
+    assert not os.path.exists(f'{target}.tmp')
+
+
+@pytest.mark.parametrize('lines, error', [
+    (['B' * 40, 'A' * 40], 'sorted'),
+    (['A' * 40, 'A' * 40], 'sorted'),
+    (['ABCDEF:1'], 'SHA-1')
+])
+def test_convert_rejects_bad_input_and_keeps_the_existing_corpus(corpus_path, tmp_path, lines, error):
+    before = corpus_path.read_bytes()
+    source = tmp_path / 'bad.txt'
+    source.write_text('\n'.join(lines) + '\n')
+
+    with pytest.raises(ValueError, match=error):
+        convert(str(source), str(corpus_path))
+
+    assert corpus_path.read_bytes() == before
+    assert not os.path.exists(f'{corpus_path}.tmp')
+
+
+def test_lookup_finds_first_last_and_every_record(corpus_path):
+    corpus = BreachCorpus(str(corpus_path))
+    digests = sorted(sha1(f'password{i}') for i in range(100))
+
+    assert len(corpus) == 100
+    assert corpus.contains_digest(digests[0])
+    assert corpus.contains_digest(digests[-1])
+    assert all(corpus.contains_digest(digest) for digest in digests)
+    assert 'password42' in corpus
+
+
+def test_lookup_misses_below_above_and_between_records(corpus_path):
+    corpus = BreachCorpus(str(corpus_path))
+    digests = sorted(sha1(f'password{i}') for i in range(100))
+
+    assert not corpus.contains_digest(b'\x00' * RECORD_SIZE)
+    assert not corpus.contains_digest(b'\xff' * RECORD_SIZE)
+    between = (int.from_bytes(digests[10], 'big') + 1).to_bytes(RECORD_SIZE, 'big')
+    assert between not in digests
+    assert not corpus.contains_digest(between)
+    assert 'correct horse battery staple' not in corpus
+
+
+def test_single_record_and_empty_corpus(tmp_path):
+    single = tmp_path / 'single.sha1'
+    single.write_bytes(sha1('hunter2'))
+    assert 'hunter2' in BreachCorpus(str(single))
+    assert 'hunter3' not in BreachCorpus(str(single))
+
+    empty = tmp_path / 'empty.sha1'
+    empty.write_bytes(b'')
+    corpus = BreachCorpus(str(empty))
+    assert len(corpus) == 0
+    assert not corpus.contains_digest(sha1('hunter2'))
+    corpus.close()
+
+
+def test_truncated_corpus_is_rejected(tmp_path):
+    path = tmp_path / 'truncated.sha1'
+    path.write_bytes(b'\x01' * (RECORD_SIZE + 3))
+
+    with pytest.raises(ValueError):
+        BreachCorpus(str(path))
+
+
+def test_corpus_renamed_over_the_path_is_reloaded(corpus_path, tmp_path):
+    hygiene = CredentialHygiene(None, Fernet.generate_key(), b'fingerprint-key', breaches=BreachCorpus(str(corpus_path)))
+    assert BREACHED not in hygiene.assess('fresh-leak-2024')['password_weaknesses']
+    assert not hygiene.reload_breaches()
+
+    source = tmp_path / 'update.txt'
+    write_source(source, [f'password{i}' for i in range(100)] + ['fresh-leak-2024'])
+    convert(str(source), str(corpus_path))
+
+    assert hygiene.reload_breaches()
+    assert len(hygiene.breaches) == 101
+    assert BREACHED in hygiene.assess('fresh-leak-2024')['password_weaknesses']
+
+
+def test_reload_leaves_the_old_corpus_readable(corpus_path, tmp_path):
+    hygiene = CredentialHygiene(None, Fernet.generate_key(), b'fingerprint-key', breaches=BreachCorpus(str(corpus_path)))
+    # A backfill thread in the middle of a lookup holds the corpus it started with
+    in_use = hygiene.breaches
+    source = tmp_path / 'update.txt'
+    write_source(source, ['fresh-leak-2024'])
+    convert(str(source), str(corpus_path))
+
+    assert hygiene.reload_breaches()
+    assert 'password42' in in_use
+    assert 'password42' not in hygiene.breaches
+
+
+def test_worker_threads_never_reload(corpus_path, monkeypatch):
+    fernet_key = Fernet.generate_key()
+    hygiene = CredentialHygiene(None, fernet_key, b'fingerprint-key', breaches=BreachCorpus(str(corpus_path)), breach_reload_seconds=0)
+
+    def reload_breaches():
+        raise AssertionError("reloaded off the event loop")
+
+    monkeypatch.setattr(hygiene, 'reload_breaches', reload_breaches)
+    doc = {'_id': 1, 'password_encrypted': Fernet(fernet_key).encrypt(b'password7').decode()}
+
+    updates, failed = hygiene._assess_batch([doc], hygiene.breaches)
+
+    assert failed == 0
+    assert BREACHED in updates[0]._doc['$set']['password_weaknesses']
@@ -0,0 +1,88 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from tests.conftest import create_user
+
+pytestmark = pytest.mark.anyio
+
+PARALLEL_CHECKOUTS = 300
+
+
+async def create_checkout_item(client, headers) -> str:
+    vault = (await client.post('/api/vaults', json={'name': 'Shared', 'type': 'internal'}, headers=headers)).json()
+    item = await client.post('/api/items', json={
+        'vault_id': vault['id'], 'type': 'web_credential', 'title': 'Ads manager', 'password': 's3cret', 'requires_checkout': True
+    }, headers=headers)
+    assert item.status_code == 200
+    return item.json()['id']
+
+
+async def test_parallel_checkouts_grant_exactly_one_lease(db, client):
+    users = [await create_user(db, role='manager', name=f'User {i}', email=f'user{i}@v4company.com') for i in range(10)]
+    item_id = await create_checkout_item(client, users[0][1])
+
+    responses = await asyncio.gather(*[
+        client.post(f'/api/items/{item_id}/checkout', headers=users[i % len(users)][1])
+        for i in range(PARALLEL_CHECKOUTS)
+    ])
+
+    statuses = [response.status_code for response in responses]
+    assert statuses.count(200) == 1
+    assert statuses.count(409) == PARALLEL_CHECKOUTS - 1
+    winner = next(response for response in responses if response.status_code == 200).json()['checked_out_by']
+    item = await db.items.find_one({'id': item_id})
+    assert item['checked_out_by_name'] == winner
+    assert len(await server.audit_store.find({'event_type': 'item_checked_out'})) == 1
+
+
+async def test_lapsed_lease_can_be_taken_over(db, client):
+    _, first = await create_user(db, role='contributor', name='First', email='first@v4company.com')
+    second, second_headers = await create_user(db, role='contributor', name='Second', email='second@v4company.com')
+    _, admin = await create_user(db)
+    item_id = await create_checkout_item(client, admin)
+
+    assert (await client.post(f'/api/items/{item_id}/checkout', params={'lease_minutes': 5}, headers=first)).status_code == 200
+    assert (await client.post(f'/api/items/{item_id}/checkout', headers=second_headers)).status_code == 409
+
+    now = datetime.now(timezone.utc)
+    assert await db.items.count_documents({'id': item_id, **server.checkout_available_filter(now)}) == 0
+    await db.items.update_one({'id': item_id}, {'$set': {'checkout_expires_at': now - timedelta(seconds=1)}})
+    assert await db.items.count_documents({'id': item_id, **server.checkout_available_filter(now)}) == 1
+
+    response = await client.post(f'/api/items/{item_id}/checkout', headers=second_headers)
+    assert response.status_code == 200
+    assert (await db.items.find_one({'id': item_id}))['checked_out_by'] == second.id
+
+
+async def test_leases_from_before_expiry_tracking_lapse_after_the_default_lease(db):
+    now = datetime.now(timezone.utc)
+    await db.items.insert_many([
+        {'id': 'recent', 'checked_out_by': 'u1', 'checked_out_at': now - timedelta(minutes=1)},
+        {'id': 'stale', 'checked_out_by': 'u1', 'checked_out_at': now - timedelta(minutes=server.CHECKOUT_LEASE_MINUTES + 1)},
+        {'id': 'free', 'checked_out_by': None}
+    ])
+
+    available = await db.items.distinct('id', server.checkout_available_filter(now))
+
+    assert sorted(available) == ['free', 'stale']
+
+
+async def test_checkin_is_limited_to_the_lease_holder(db, client):
+    holder, holder_headers = await create_user(db, role='contributor', name='Holder', email='holder@v4company.com')
+    _, other_headers = await create_user(db, role='contributor', name='Other', email='other@v4company.com')
+    _, admin = await create_user(db)
+    item_id = await create_checkout_item(client, admin)
+    assert (await client.post(f'/api/items/{item_id}/checkout', headers=holder_headers)).status_code == 200
+
+    assert (await client.post(f'/api/items/{item_id}/checkin', headers=other_headers)).status_code == 403
+    assert (await db.items.find_one({'id': item_id}))['checked_out_by'] == holder.id
+
+    assert (await client.post(f'/api/items/{item_id}/checkin', headers=holder_headers)).status_code == 200
+    item = await db.items.find_one({'id': item_id})
+    assert item['checked_out_by'] is None and item['checkout_expires_at'] is None
+
+    assert (await client.post(f'/api/items/{item_id}/checkin', headers=holder_headers)).status_code == 400
+    assert (await client.post(f'/api/items/{item_id}/checkout', headers=other_headers)).status_code == 200
@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+import httpx
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from google_auth import GoogleOAuth, JWKSCache
+from tests.oauth_standin import OAuthStandIn
+
+pytestmark = pytest.mark.anyio
+
+CLIENT_ID = 'test-client'
+PROFILE = {'email': 'ada@v4company.com', 'name': 'Ada'}
+
+
+@pytest.fixture
+def standin():
+    return OAuthStandIn(client_id=CLIENT_ID)
+
+
+@pytest.fixture
+async def oauth(standin):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=standin.app), base_url='http://standin') as http:
+        jwks = JWKSCache(http, 'http://standin/oauth2/v3/certs')
+        yield GoogleOAuth(http, jwks, CLIENT_ID, 'secret', 'http://test/callback', token_url='http://standin/token')
+
+
+async def test_valid_token_returns_its_claims(standin, oauth):
+    claims = await oauth.verify_id_token(standin.id_token(PROFILE, CLIENT_ID))
+
+    assert claims['email'] == PROFILE['email']
+    assert standin.counts['jwks'] == 1
+
+
+async def test_code_exchange_returns_a_verifiable_token(standin, oauth):
+    tokens = await oauth.exchange_code(standin.issue_code(PROFILE['email']))
+
+    assert (await oauth.verify_id_token(tokens['id_token']))['email'] == PROFILE['email']
+
+
+async def test_wrong_audience_is_rejected(standin, oauth):
+    with pytest.raises(jwt.InvalidAudienceError):
+        await oauth.verify_id_token(standin.id_token(PROFILE, 'another-client'))
+
+
+async def test_wrong_issuer_is_rejected(standin, oauth):
+    with pytest.raises(jwt.InvalidIssuerError):
+        await oauth.verify_id_token(standin.id_token(PROFILE, CLIENT_ID, iss='https://accounts.example.com'))
+
+
+async def test_expired_token_is_rejected(standin, oauth):
+    now = int(time.time())
+    token = standin.id_token(PROFILE, CLIENT_ID, iat=now - 7200, exp=now - oauth.leeway - 60)
+
+    with pytest.raises(jwt.ExpiredSignatureError):
+        await oauth.verify_id_token(token)
+
+
+async def test_bad_signature_is_rejected(standin, oauth):
+    forger = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    genuine = jwt.decode(standin.id_token(PROFILE, CLIENT_ID), options={'verify_signature': False})
+    forged = jwt.encode(genuine, forger, algorithm='RS256', headers={'kid': standin.kid})
+
+    with pytest.raises(jwt.InvalidSignatureError):
+        await oauth.verify_id_token(forged)
+
+
+async def test_unverified_email_is_rejected(standin, oauth):
+    with pytest.raises(jwt.InvalidTokenError, match='not verified'):
+        await oauth.verify_id_token(standin.id_token(PROFILE, CLIENT_ID, email_verified=False))
+
+
+async def test_unknown_key_id_refetches_once(standin, oauth):
+    await oauth.verify_id_token(standin.id_token(PROFILE, CLIENT_ID))
+    # Past the refetch throttle, as after a key rotation some time later
+    oauth.jwks._fetched_at -= oauth.jwks.min_refresh_seconds
+    standin.rotate_key()
+    token = standin.id_token(PROFILE, CLIENT_ID)
+
+    results = await asyncio.gather(*[oauth.verify_id_token(token) for _ in range(20)])
+
+    assert all(claims['email'] == PROFILE['email'] for claims in results)
+    assert standin.counts['jwks'] == 2
+
+
+async def test_unknown_key_id_is_not_refetched_within_the_throttle(standin, oauth):
+    await oauth.verify_id_token(standin.id_token(PROFILE, CLIENT_ID))
+    standin.rotate_key()
+
+    with pytest.raises(jwt.InvalidTokenError, match='Unknown signing key'):
+        await oauth.verify_id_token(standin.id_token(PROFILE, CLIENT_ID))
+    assert standin.counts['jwks'] == 1
+
+
+async def test_failed_refresh_keeps_the_cached_keys(standin, oauth):
+    token = standin.id_token(PROFILE, CLIENT_ID)
+    await oauth.verify_id_token(token)
+    standin.jwks_available = False
+    # Stale, so the next lookup refetches
+    oauth.jwks._expires_at = 0.0
+
+    assert (await oauth.verify_id_token(token))['email'] == PROFILE['email']
+    assert standin.counts['jwks'] == 2
+
+
+async def test_failed_first_fetch_raises(standin, oauth):
+    standin.jwks_available = False
+
+    with pytest.raises(httpx.HTTPStatusError):
+        await oauth.verify_id_token(standin.id_token(PROFILE, CLIENT_ID))
@@ -0,0 +1,57 @@
+import pytest
+
+import server
+from tests.conftest import create_user
+
+pytestmark = pytest.mark.anyio
+
+
+async def create_item(client, headers, item_type: str, metadata: dict) -> dict:
+    vault = (await client.post('/api/vaults', json={'name': 'Ads', 'type': 'internal'}, headers=headers)).json()
+    response = await client.post('/api/items', json={
+        'vault_id': vault['id'], 'type': item_type, 'title': 'Ads account', 'password': 's3cret', 'metadata': metadata
+    }, headers=headers)
+    assert response.status_code == 200
+    return response.json()
+
+
+async def test_metadata_edit_stores_identifiers_in_the_same_write(db, client, monkeypatch):
+    _, headers = await create_user(db)
+    item = await create_item(client, headers, 'ad_token_google', {'account_id': '123-456-7890'})
+    writes = []
+    # Collection objects are made per access, so the method is wrapped on their class
+    collection_type = type(db.items)
+    update_one = collection_type.update_one
+
+    async def counting_update_one(self, *args, **kwargs):
+        if self.name == 'items':
+            writes.append(args)
+        return await update_one(self, *args, **kwargs)
+
+    monkeypatch.setattr(collection_type, 'update_one', counting_update_one)
+
+    response = await client.put(f"/api/items/{item['id']}", json={
+        'metadata': {'account_id': '999 888 7777', 'mcc_id': '$not-a-field-path', 'api_secret': 'x'}
+    }, headers=headers)
+
+    assert response.status_code == 200
+    expected = [{'field': 'account_id', 'value': '9998887777'}, {'field': 'mcc_id', 'value': '$notafieldpath'}]
+    assert response.json()['identifiers'] == expected
+    stored = await db.items.find_one({'id': item['id']})
+    assert stored['identifiers'] == expected
+    # Metadata is stored as sent, not merged into or read as expressions
+    assert stored['metadata'] == {'account_id': '999 888 7777', 'mcc_id': '$not-a-field-path', 'api_secret': 'x'}
+    assert stored['version'] == item['version'] + 1
+    assert writes == []
+    assert await db.items.count_documents(server.identifier_index.match('account_id', '999-888-7777')) == 1
+
+
+async def test_types_without_identifiers_store_none(db, client):
+    _, headers = await create_user(db)
+    item = await create_item(client, headers, 'web_credential', {})
+
+    response = await client.put(f"/api/items/{item['id']}", json={'metadata': {'account_id': '1'}, 'title': 'Renamed'}, headers=headers)
+
+    assert response.status_code == 200
+    stored = await db.items.find_one({'id': item['id']})
+    assert stored['identifiers'] == [] and stored['title'] == 'Renamed'
@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+
+import server
+from share_links import ShareLinkCache
+from tests.conftest import create_user
+
+pytestmark = pytest.mark.anyio
+
+ITEM = {'vault_id': 'ignored', 'type': 'web_credential', 'title': 'Portal', 'password': 's3cret'}
+
+
+async def create_link(client, headers) -> tuple:
+    vault = (await client.post('/api/vaults', json={'name': 'Acme', 'type': 'client'}, headers=headers)).json()
+    token = (await client.post(f"/api/vaults/{vault['id']}/generate-client-link", headers=headers)).json()['token']
+    return vault, token
+
+
+async def submit(client, token: str) -> int:
+    return (await client.post(f'/api/vaults/client-submit/{token}/item', json=ITEM)).status_code
+
+
+class ChangeStream:
+    """Change events fed by the test, with the async context manager interface of a motor change stream"""
+
+    def __init__(self):
+        self.events: asyncio.Queue = asyncio.Queue()
+        self.opened = asyncio.Event()
+
+    async def __aenter__(self):
+        self.opened.set()
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.events.get()
+
+
+class WatchedVaults:
+    def __init__(self, vaults):
+        self.vaults = vaults
+        self.stream = ChangeStream()
+
+    def watch(self, pipeline):
+        return self.stream
+
+    def __getattr__(self, name):
+        return getattr(self.vaults, name)
+
+
+async def test_submissions_are_served_from_the_cache(db, client, monkeypatch):
+    _, headers = await create_user(db)
+    _, token = await create_link(client, headers)
+    assert await submit(client, token) == 200
+    lookups = []
+    collection_type = type(db.vaults)
+    find_one = collection_type.find_one
+
+    async def counting_find_one(self, query, *args, **kwargs):
+        if self.name == 'vaults' and 'client_share_token' in query:
+            lookups.append(query)
+        return await find_one(self, query, *args, **kwargs)
+
+    monkeypatch.setattr(collection_type, 'find_one', counting_find_one)
+
+    assert [await submit(client, token) for _ in range(5)] == [200] * 5
+    assert lookups == []
+
+
+async def test_link_disabled_on_another_worker_is_dropped_by_the_change_stream(db, client):
+    _, headers = await create_user(db)
+    vault, token = await create_link(client, headers)
+    assert await submit(client, token) == 200
+    watched = WatchedVaults(db.vaults)
+    server.share_link_cache.collection = watched
+    watcher = asyncio.create_task(server.share_link_cache.watch())
+    await watched.stream.opened.wait()
+    assert await submit(client, token) == 200
+    stored = await db.vaults.find_one({'id': vault['id']})
+
+    try:
+        # Item counters written by the submissions leave the link cached
+        await watched.stream.events.put({
+            'operationType': 'update', 'documentKey': {'_id': stored['_id']},
+            'updateDescription': {'updatedFields': {'item_counts.total': 2}, 'removedFields': []}
+        })
+        await asyncio.sleep(0)
+        assert server.share_link_cache.get(token) is not None
+
+        # Another worker disables the link
+        await db.vaults.update_one({'id': vault['id']}, {'$set': {'client_share_enabled': False}})
+        await watched.stream.events.put({
+            'operationType': 'update', 'documentKey': {'_id': stored['_id']},
+            'updateDescription': {'updatedFields': {'client_share_enabled': False}, 'removedFields': []}
+        })
+        await asyncio.sleep(0)
+        assert server.share_link_cache.get(token) is None
+        assert await submit(client, token) == 404
+    finally:
+        watcher.cancel()
+
+
+async def test_polling_drops_links_changed_elsewhere(db, client):
+    _, headers = await create_user(db)
+    vault, token = await create_link(client, headers)
+    other_vault, other_token = await create_link(client, headers)
+    assert await submit(client, token) == 200 and await submit(client, other_token) == 200
+
+    # Regenerated on another worker: this one still has the old token cached
+    await db.vaults.update_one({'id': vault['id']}, {'$set': {'client_share_token': 'regenerated'}})
+
+    assert await server.share_link_cache.refresh() == 1
+    assert await submit(client, token) == 404
+    assert await submit(client, other_token) == 200
+
+
+def test_discarding_a_token_forgets_its_vault():
+    cache = ShareLinkCache(None, ttl=60)
+    cache.set('old', {'_id': 1, 'id': 'v1'})
+    cache.set('new', {'_id': 1, 'id': 'v1'})
+    cache.discard('old')
+
+    assert cache.get('new') is not None
+    cache.set('old', {'_id': 1, 'id': 'v1'})
+    cache.discard_vault(1)
+    assert cache.get('new') is None and cache.get('old') is None
@@ -0,0 +1,178 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from sheet_sync import SyncPlan
+from tests.conftest import create_user
+from vault_rollups import FIELD
+
+pytestmark = pytest.mark.anyio
+
+ROWS = [
+    {'vault_path': 'Acme', 'type': 'web_credential', 'title': 'Ads manager', 'login': 'ads@acme.com', 'password': 'Hunter2-hunter2', 'client': 'Acme'},
+    {'vault_path': 'Acme', 'type': 'web_credential', 'title': 'Analytics', 'login': 'data@acme.com', 'password': 'Correct-Horse-9'},
+    {'vault_path': 'Acme > Social', 'type': 'social_media', 'title': 'Instagram', 'login': 'acme', 'password': 'Battery-Staple-7'}
+]
+
+
+async def sync(client, headers, rows, **params) -> dict:
+    response = await client.post('/api/import/sheets', params={'mode': 'sync', **params}, json=rows, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+@pytest.fixture
+async def natural_key_index(db):
+    # As created at startup: what makes a racing or repeated sync upsert instead of duplicating
+    await db.items.create_index('natural_key', unique=True, partialFilterExpression={'natural_key': {'$type': 'string'}})
+
+
+class CountingFernet:
+    """The app's Fernet, counting decryptions"""
+
+    def __init__(self, fernet):
+        self._fernet = fernet
+        self.decrypted = 0
+
+    def encrypt(self, data: bytes) -> bytes:
+        return self._fernet.encrypt(data)
+
+    def decrypt(self, token: bytes) -> bytes:
+        self.decrypted += 1
+        return self._fernet.decrypt(token)
+
+
+async def test_syncing_the_same_sheet_again_creates_nothing(db, client, natural_key_index):
+    _, headers = await create_user(db)
+
+    first = await sync(client, headers, ROWS)
+    again = await asyncio.gather(*[sync(client, headers, ROWS) for _ in range(3)])
+
+    assert first['diff']['created'] == 3 and first['written']['created'] == 3
+    assert all(result['written']['created'] == 0 for result in again)
+    assert await db.items.count_documents({}) == 3
+    assert await db.vaults.count_documents({}) == 2
+
+
+async def test_unchanged_rows_are_not_decrypted(db, client, monkeypatch):
+    _, headers = await create_user(db)
+    await sync(client, headers, ROWS)
+    counting = CountingFernet(server.sheet_sync.fernet)
+    monkeypatch.setattr(server.sheet_sync, 'fernet', counting)
+
+    result = await sync(client, headers, ROWS)
+
+    assert result['diff'] == {'created': 0, 'updated': 0, 'unchanged': 3, 'removed': 0, 'errors': 0}
+    assert result['changes'] == []
+    assert counting.decrypted == 0
+
+
+async def test_rotated_password_is_updated_with_history(db, client):
+    _, headers = await create_user(db)
+    await sync(client, headers, ROWS)
+    before = await db.items.find_one({'title': 'Ads manager'})
+
+    rows = [{**ROWS[0], 'password': 'Rotated-Password-3'}, *ROWS[1:]]
+    result = await sync(client, headers, rows)
+
+    assert result['diff']['updated'] == 1 and result['diff']['unchanged'] == 2
+    assert result['written']['updated'] == 1
+    assert result['changes'] == [{
+        'action': 'updated', 'vault_path': 'Acme', 'type': 'web_credential', 'title': 'Ads manager',
+        'login': 'ads@acme.com', 'fields': ['password_encrypted']
+    }]
+    item = await db.items.find_one({'id': before['id']})
+    assert item['version'] == (before.get('version') or 0) + 1
+    assert item['password_fingerprint'] != before['password_fingerprint']
+    assert server.fernet.decrypt(item['password_encrypted'].encode()).decode() == 'Rotated-Password-3'
+    history = await server.item_history.list(before['id'])
+    assert [entry['fields'] for entry in history] == [['password_encrypted']]
+
+
+async def test_append_imported_items_are_adopted(db, client, natural_key_index):
+    _, headers = await create_user(db)
+    response = await client.post('/api/import/sheets', json=ROWS, headers=headers)
+    assert response.json()['imported_count'] == 3
+    ids = set(await db.items.distinct('id'))
+
+    result = await sync(client, headers, ROWS)
+
+    assert result['diff']['created'] == 0 and result['diff']['unchanged'] == 3
+    assert set(await db.items.distinct('id')) == ids
+    assert await db.items.count_documents({'natural_key': {'$type': 'string'}}) == 3
+    assert (await sync(client, headers, ROWS))['diff']['unchanged'] == 3
+
+
+async def test_dry_run_writes_nothing(db, client):
+    _, headers = await create_user(db)
+    await sync(client, headers, ROWS[:1])
+    item = await db.items.find_one({}, {'_id': 0})
+
+    result = await sync(client, headers, [{**ROWS[0], 'password': 'Rotated-Password-3'}, *ROWS[1:]], dry_run=True, prune=True)
+
+    assert result['dry_run'] and result['written'] is None
+    assert result['diff'] == {'created': 2, 'updated': 1, 'unchanged': 0, 'removed': 0, 'errors': 0}
+    assert await db.items.find({}, {'_id': 0}).to_list(None) == [item]
+    assert await db.vaults.count_documents({}) == 1
+    assert await db.item_history.count_documents({}) == 0
+
+
+async def test_prune_deletes_only_keyed_items(db, client):
+    _, headers = await create_user(db)
+    await sync(client, headers, ROWS)
+    vault_id = (await db.items.find_one({'title': 'Ads manager'}))['vault_id']
+    manual = (await client.post('/api/items', json={
+        'vault_id': vault_id, 'type': 'web_credential', 'title': 'Added in the app', 'password': 'Not-In-The-Sheet-1'
+    }, headers=headers)).json()
+
+    kept = await sync(client, headers, ROWS[1:])
+    assert kept['diff']['removed'] == 1 and kept['written']['removed'] == 0
+    assert await db.items.count_documents({}) == 4
+
+    result = await sync(client, headers, ROWS[1:], prune=True)
+
+    assert result['written']['removed'] == 1
+    assert await db.items.find_one({'title': 'Ads manager'}) is None
+    assert await db.items.find_one({'id': manual['id']}) is not None
+    assert await db.items.count_documents({}) == 3
+
+
+async def test_counter_moves_of_a_sync_are_written_at_once(db, monkeypatch):
+    expires = datetime.now(timezone.utc) + timedelta(days=3)
+    items = [
+        {'id': f'item-{i}', 'vault_id': 'v1' if i % 2 else 'v2', 'type': 'web_credential', 'title': f'Login {i}',
+         'criticality': 'low', 'expires_at': None, 'version': 1}
+        for i in range(6)
+    ]
+    await db.items.insert_many([dict(item) for item in items])
+    await db.vaults.insert_many([{'id': 'v1'}, {'id': 'v2'}])
+    await server.vault_rollups.added(items)
+    writes = []
+    apply = server.vault_rollups.apply
+
+    async def counting_apply(deltas):
+        writes.append(deltas)
+        await apply(deltas)
+
+    monkeypatch.setattr(server.vault_rollups, 'apply', counting_apply)
+    plan = SyncPlan(update=[
+        (items[0], {'criticality': 'high'}),
+        (items[1], {'criticality': 'high'}),
+        (items[2], {'expires_at': expires}),
+        (items[3], {'login_url': 'https://ads.example.com'})
+    ])
+
+    result = await server.sheet_sync.apply(plan, 'u1')
+
+    assert result['updated'] == 4
+    # One write for the edits; the other is for the (empty) creates
+    assert len([deltas for deltas in writes if deltas]) == 1
+    # The counters match a recount from the items
+    assert await server.vault_rollups.reconcile() == {'vaults': 2, 'fixed': 0, 'skipped': 0}
+    v1 = await db.vaults.find_one({'id': 'v1'})
+    assert v1[FIELD]['by_criticality'] == {'low': 2, 'high': 1}
+    v2 = await db.vaults.find_one({'id': 'v2'})
+    assert v2[FIELD]['by_criticality'] == {'low': 2, 'high': 1}
+    assert v2[FIELD]['expiry_days'] == {expires.date().isoformat(): 1}
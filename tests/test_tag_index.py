@@ -0,0 +1,27 @@
+import pytest
+
+import server
+from tag_index import tag_filter, tag_pairs
+
+pytestmark = pytest.mark.anyio
+
+
+def test_tag_pairs_are_stripped_sorted_and_skip_empty_values():
+    assert tag_pairs({' squad ': ' Growth ', 'client': 'Acme', 'owner': '  ', 'env': None}) == [
+        {'key': 'client', 'value': 'Acme'},
+        {'key': 'squad', 'value': 'Growth'}
+    ]
+
+
+@pytest.mark.parametrize('key, value', [('client', 'Acme'), ('client', ' Acme'), (' client ', 'Acme  ')])
+async def test_tag_filter_matches_what_tag_pairs_stored(db, key, value):
+    await db.items.insert_one({'id': 'i1', 'tag_pairs': tag_pairs({'client': ' Acme '})})
+
+    assert await db.items.count_documents(tag_filter(key, value)) == 1
+
+
+@pytest.mark.parametrize('filters', [{'tag': 'client: Acme'}, {'tag': ' client :Acme'}, {'client': ' Acme'}])
+async def test_items_query_ignores_surrounding_spaces(db, filters):
+    await db.items.insert_one({'id': 'i1', 'tags': {'client': 'Acme'}, 'tag_pairs': tag_pairs({'client': 'Acme'})})
+
+    assert await db.items.count_documents(server.build_items_query(**filters)) == 1
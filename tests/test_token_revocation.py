@@ -0,0 +1,87 @@
+import asyncio
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import jwt
+import pytest
+
+import server
+from tests.conftest import create_user
+from token_revocation import TokenRevocationList
+
+pytestmark = pytest.mark.anyio
+
+
+def token_for(user) -> dict:
+    return {'Authorization': f"Bearer {server.create_jwt_token(user.dict())}"}
+
+
+async def next_second() -> None:
+    # Token iat has whole-second precision: a token minted in the cutoff's second would count as issued before it
+    await asyncio.sleep(1.01 - time.time() % 1)
+
+
+async def test_logged_out_token_is_revoked(db, client):
+    user, headers = await create_user(db)
+    other = token_for(user)
+
+    assert (await client.post('/api/auth/logout', headers=headers)).status_code == 200
+
+    response = await client.get('/api/auth/me', headers=headers)
+    assert response.status_code == 401 and response.json()['detail'] == 'Token revoked'
+    # Only the token that logged out
+    assert (await client.get('/api/auth/me', headers=other)).status_code == 200
+
+
+async def test_deactivation_kills_earlier_tokens_for_good(db, client):
+    _, admin = await create_user(db)
+    user, headers = await create_user(db, role='contributor', name='Bob', email='bob@v4company.com')
+    assert (await client.get('/api/auth/me', headers=headers)).status_code == 200
+
+    assert (await client.put(f'/api/users/{user.id}/status', json={'status': 'inactive'}, headers=admin)).status_code == 200
+    response = await client.get('/api/auth/me', headers=headers)
+    assert response.status_code == 401 and response.json()['detail'] == 'Token revoked'
+
+    await next_second()
+    assert (await client.put(f'/api/users/{user.id}/status', json={'status': 'active'}, headers=admin)).status_code == 200
+
+    assert (await client.get('/api/auth/me', headers=headers)).status_code == 401
+    assert (await client.get('/api/auth/me', headers=token_for(user))).status_code == 200
+
+
+async def test_load_picks_up_revocations_of_other_workers(db, client):
+    user, headers = await create_user(db)
+    revoked_user, _ = await create_user(db, role='contributor', name='Bob', email='bob@v4company.com')
+    payload = jwt.decode(headers['Authorization'].split()[1], options={'verify_signature': False})
+    other_worker = TokenRevocationList(db.revoked_tokens)
+    await other_worker.load()
+    assert not other_worker.is_revoked(payload)
+
+    assert (await client.post('/api/auth/logout', headers=headers)).status_code == 200
+    await server.token_revocations.revoke_user(revoked_user.id, datetime.now(timezone.utc) + timedelta(hours=1))
+    await other_worker.load()
+
+    assert other_worker.is_revoked(payload)
+    assert other_worker.is_revoked({'user_id': revoked_user.id, 'jti': 'x', 'iat': int(time.time()) - 5})
+    assert not other_worker.is_revoked({'user_id': user.id, 'jti': uuid.uuid4().hex, 'iat': int(time.time())})
+
+
+def test_resizing_keeps_every_unexpired_revocation():
+    revocations = TokenRevocationList(None, capacity=8)
+    now = datetime.now(timezone.utc)
+    live = [uuid.uuid4().hex for _ in range(200)]
+    lapsed = [uuid.uuid4().hex for _ in range(50)]
+    for i, jti in enumerate(live):
+        revocations.add({'_id': jti, 'expires_at': now + timedelta(hours=1)})
+        if i < len(lapsed):
+            revocations.add({'_id': lapsed[i], 'expires_at': now - timedelta(seconds=1)})
+
+    assert all(revocations.is_revoked({'jti': jti}) for jti in live)
+    assert revocations._filter.capacity >= len(live)
+
+    revocations.prune()
+
+    assert all(revocations.is_revoked({'jti': jti}) for jti in live)
+    assert not any(revocations.is_revoked({'jti': jti}) for jti in lapsed)
+    assert not revocations.is_revoked({'jti': uuid.uuid4().hex})
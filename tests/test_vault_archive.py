@@ -0,0 +1,123 @@
+import uuid
+
+import pytest
+
+import server
+import vault_archive
+from vault_archive import export_vaults, import_archive, new_import_job
+
+pytestmark = pytest.mark.anyio
+
+CONTENT = {'contract.pdf': bytes(range(200)), 'notes.txt': b'quarterly access review\n' * 3, 'empty.txt': b''}
+
+
+async def pieces(data: bytes):
+    yield data
+
+
+async def create_vault_with_attachments(db, attachments) -> dict:
+    vault = {'id': str(uuid.uuid4()), 'name': 'Client', 'path': 'Client', 'parent_id': None, 'deleted_at': None}
+    await db.vaults.insert_one(dict(vault))
+    refs = []
+    for filename, data in CONTENT.items():
+        stored = await attachments.save(pieces(data), 'u1')
+        refs.append({'id': str(uuid.uuid4()), 'file_id': stored['file_id'], 'filename': filename, 'size': stored['size']})
+    await db.items.insert_many([
+        {'id': 'with-files', 'vault_id': vault['id'], 'title': 'Contract', 'attachments': refs},
+        # The same file on a second item is archived once
+        {'id': 'shared-file', 'vault_id': vault['id'], 'title': 'Copy', 'attachments': refs[:1]},
+        {'id': 'no-files', 'vault_id': vault['id'], 'title': 'Login'}
+    ])
+    return vault
+
+
+async def export(db, vault: dict) -> bytes:
+    header = {'archive_id': str(uuid.uuid4()), 'root_id': vault['id'], 'root_parent_id': None}
+    return b''.join([frame async for frame in export_vaults(db, [vault['id']], header, server.ENCRYPTION_KEY, chunk_size=2)])
+
+
+async def purge(db, attachments) -> None:
+    """What a vault purge and the next attachment sweep leave behind"""
+    await db.vaults.delete_many({})
+    await db.items.delete_many({})
+    await attachments.sweep()
+    assert await attachments.files.count_documents({}) == 0
+
+
+async def restore(db, archive: bytes, job: dict = None, size: int = 1000) -> dict:
+    if job is None:
+        job = new_import_job('u1')
+        await db.jobs.insert_one(dict(job))
+
+    async def chunks():
+        for start in range(0, len(archive), size):
+            yield archive[start:start + size]
+    return await import_archive(db, chunks(), server.ENCRYPTION_KEY, job)
+
+
+async def contents(db, attachments, item_id: str) -> dict:
+    item = await db.items.find_one({'id': item_id})
+    restored = {}
+    for ref in item['attachments']:
+        file = await attachments.find(ref['file_id'])
+        assert file is not None, f"{ref['filename']} is missing"
+        restored[ref['filename']] = b''.join([data async for data in attachments.stream(file, 0, file['metadata']['size'] - 1)])
+    return restored
+
+
+@pytest.fixture
+def small_frames(monkeypatch):
+    # A few segments per frame, so a file spans several frames
+    monkeypatch.setattr(vault_archive, 'ATTACHMENT_FRAME_BYTES', 100)
+
+
+async def test_attachments_survive_a_purge_and_restore(db, attachments, small_frames):
+    vault = await create_vault_with_attachments(db, attachments)
+    chunk_count = await attachments.chunks.count_documents({})
+    archive = await export(db, vault)
+    await purge(db, attachments)
+
+    progress = await restore(db, archive)
+
+    assert progress['items'] == 3
+    assert progress['attachment_files'] == len(CONTENT)
+    assert progress['attachment_chunks'] == chunk_count
+    assert await contents(db, attachments, 'with-files') == CONTENT
+    assert await contents(db, attachments, 'shared-file') == {'contract.pdf': CONTENT['contract.pdf']}
+    # Referenced again, so the next sweep keeps them
+    assert await attachments.sweep() == 0
+
+
+async def test_restore_adopts_identical_files_stored_meanwhile(db, attachments):
+    vault = await create_vault_with_attachments(db, attachments)
+    archive = await export(db, vault)
+    await purge(db, attachments)
+    uploaded = await attachments.save(pieces(CONTENT['contract.pdf']), 'u2')
+
+    progress = await restore(db, archive)
+
+    assert progress['attachment_files'] == len(CONTENT) - 1
+    assert await contents(db, attachments, 'with-files') == CONTENT
+    item = await db.items.find_one({'id': 'shared-file'})
+    assert item['attachments'][0]['file_id'] == uploaded['file_id']
+    # The archived copy of the adopted file leaves no chunks behind
+    assert set(await attachments.chunks.distinct('files_id')) == set(await attachments.files.distinct('_id'))
+
+
+async def test_interrupted_restore_resumes_without_duplicates(db, attachments, small_frames):
+    vault = await create_vault_with_attachments(db, attachments)
+    chunk_count = await attachments.chunks.count_documents({})
+    archive = await export(db, vault)
+    await purge(db, attachments)
+    job = new_import_job('u1')
+    await db.jobs.insert_one(dict(job))
+
+    with pytest.raises(vault_archive.ArchiveError):
+        await restore(db, archive[:len(archive) * 2 // 3], job)
+    job = await db.jobs.find_one({'id': job['id']}, {'_id': 0})
+    assert 0 < job['progress']['frames']
+
+    await restore(db, archive, job, size=333)
+
+    assert await contents(db, attachments, 'with-files') == CONTENT
+    assert await attachments.chunks.count_documents({}) == chunk_count